@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'moodleroster.settings')
 
-application = get_asgi_application()
+# uvicorn does not serve /static/ the way runserver did: the page scripts and the
+# admin styles are served by the staticfiles handler in front of the app
+application = ASGIStaticFilesHandler(get_asgi_application())
@@ -94,6 +94,37 @@ DATABASES = {
     }
 }
 
+# PostgreSQL for instances several classrooms report into. The screenshot and
+# placement tables are partitioned by month there (roster.partitions); run
+# `manage.py manage_partitions` daily to create upcoming months.
+if os.environ.get('ROSTER_DB_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'roster'),
+            'USER': os.environ.get('POSTGRES_USER', 'roster'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 60,
+        }
+    }
+PARTITION_MONTHS_AHEAD = 3
+# Monthly partitions older than this many months are detached (None keeps everything)
+PARTITION_RETAIN_MONTHS = None
+PARTITION_ARCHIVE_ROOT = BASE_DIR / 'data' / 'archive'
+
+# 'concurrent' is the profile for many simultaneous writers (lesson start): WAL
+# journaling, tuned pragmas, a busy timeout and batched hot-path inserts (roster.db).
+# 'default' leaves SQLite as configured by Django.
+DB_PROFILE = os.environ.get('ROSTER_DB_PROFILE', 'default')
+SQLITE_BUSY_TIMEOUT = 20  # seconds a writer waits for the lock before "database is locked"
+DB_WRITE_COALESCING = DB_PROFILE == 'concurrent'
+DB_WRITE_BATCH_SIZE = 100  # writes committed in one transaction at most
+DB_WRITE_BATCH_WAIT = 0.01  # seconds the writer waits for more writes to join a batch
+if DB_PROFILE == 'concurrent' and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default']['OPTIONS'] = {'timeout': SQLITE_BUSY_TIMEOUT}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -202,6 +233,73 @@ LESSONS_SCHEDULE = {
 
 ACCESS_KEY = "ARU3I9VD"
 
+# Classroom change feed (Server-Sent Events at /api/classrooms/329/events/)
+CLASSROOM_EVENTS_POLL_INTERVAL = 1.0  # seconds between checks of the event table
+CLASSROOM_EVENTS_KEEPALIVE = 15  # seconds of silence before a keepalive comment
+CLASSROOM_EVENTS_STREAM_LIFETIME = 10 * 60  # streams are closed and resumed by the browser
+CLASSROOM_EVENTS_RETRY_MS = 3000
+CLASSROOM_EVENTS_RETENTION = 24 * 60 * 60  # seconds events are kept for resuming
+
+# In-memory user name index for login suggestions and student search (roster.user_index)
+USER_INDEX_TTL = 5 * 60  # seconds before changes made by other processes are picked up
+
+# Screenshot agents poll /api/classrooms/329/agent/config/ (roster.agent_config) about every
+# AGENT_CONFIG_POLL_SECONDS, spread by +-AGENT_CONFIG_POLL_JITTER of it
+AGENT_CONFIG_POLL_SECONDS = 30
+AGENT_CONFIG_POLL_JITTER = 0.2
+AGENT_CONFIG_TTL = 30  # seconds before changes made by other processes are picked up
+
+# Screenshots uploaded by classroom agents
+SCREENSHOTS_ROOT = BASE_DIR / 'data' / 'screenshots'
+# Workplaces without screenshot rows are listed from the directory tree. Once
+# `manage.py reconcile_screenshots` has created rows for every stored frame this can be off.
+SCREENSHOT_FILESYSTEM_FALLBACK = True
+
+# Storage format of frames (roster.transcode): uploads arrive as PNG and are transcoded
+# on the background worker to 'webp' or 'avif' ('png' or None keeps them as uploaded).
+# Lossy frames get the best quality in SCREENSHOT_QUALITY_RANGE that fits SCREENSHOT_TARGET_BYTES.
+SCREENSHOT_STORAGE_FORMAT = 'webp'
+SCREENSHOT_STORAGE_LOSSLESS = False
+SCREENSHOT_TARGET_BYTES = 120 * 1024
+SCREENSHOT_QUALITY_RANGE = (40, 90)
+
+# Uploads that repeat the workplace's latest frame pixel for pixel, with the same window
+# titles and user (idle desktop, locked screen), are not stored; the latest frame's
+# last_seen_at moves forward instead (roster.dedupe)
+SCREENSHOT_DEDUPE = True
+SCREENSHOT_BLANK_MAX_STDDEV = 2.0  # frames with less brightness variation count as blank
+
+# Days of frames older than this are packed into one segment file per workplace and day
+# by `manage.py compact_screenshots` (roster.segments)
+SCREENSHOT_SEGMENT_AFTER_DAYS = 7
+
+# Disk limits for `manage.py plan_retention` (roster.budget) on top of the per-classroom
+# Classroom.retention_budget_bytes: all classrooms together, and free space to keep on the
+# disk holding SCREENSHOTS_ROOT. None disables a limit.
+SCREENSHOT_DISK_BUDGET_BYTES = None
+SCREENSHOT_MIN_FREE_BYTES = None
+
+# Thumbnail derivatives served by ?thumb=1 / ?w=<width> (see roster.thumbnails)
+SCREENSHOT_THUMBNAILS_ROOT = BASE_DIR / 'data' / 'thumbnails'
+SCREENSHOT_THUMBNAIL_WIDTHS = [160, 320, 640]
+# Widths rendered right after upload; the others are rendered on first access
+SCREENSHOT_THUMBNAIL_PREGENERATE = [160]
+SCREENSHOT_THUMBNAIL_CACHE_BYTES = 512 * 1024 * 1024
+
+# Browser cache lifetime of screenshot and thumbnail responses (they never change once written)
+SCREENSHOT_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# Hand screenshot byte transfer to the front proxy: None, 'nginx' (X-Accel-Redirect)
+# or 'sendfile' (X-Sendfile for apache/lighttpd). For nginx, SCREENSHOT_SENDFILE_ROOT
+# must be exposed as an `internal` location at SCREENSHOT_SENDFILE_URL_PREFIX.
+SCREENSHOT_SENDFILE_BACKEND = os.environ.get('SCREENSHOT_SENDFILE_BACKEND') or None
+SCREENSHOT_SENDFILE_ROOT = BASE_DIR / 'data'
+SCREENSHOT_SENDFILE_URL_PREFIX = '/protected-data/'
+
+# Run retention and other slow jobs on the in-process background worker (roster.tasks).
+# When disabled, jobs run inline in the calling request.
+BACKGROUND_TASKS_ASYNC = True
+
 # Django allauth settings
 SITE_ID = 1
 
@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
@@ -34,6 +34,20 @@ class StudentGroupAdmin(admin.ModelAdmin):
     filter_horizontal = ('students',)
     readonly_fields = ('created_at', 'updated_at')
     inlines = [StudentGroupFeatureInline]
+    actions = ['auto_assign_seats']
+
+    @admin.action(description='Автоматично розсадити учнів групи')
+    def auto_assign_seats(self, request, queryset):
+        from roster import seating
+
+        for group in queryset:
+            try:
+                placements = seating.assign_group(group)
+            except seating.SeatingError as e:
+                self.message_user(request, f"{group}: {e}", messages.ERROR)
+                continue
+            seats = ', '.join(p.workplace_id for p in placements) or '—'
+            self.message_user(request, f"{group}: розсаджено {len(placements)} учнів ({seats})", messages.SUCCESS)
 
 
 class WorkplaceScreenshotAdmin(admin.ModelAdmin):
@@ -55,7 +69,13 @@ class WorkplaceScreenshotAdmin(admin.ModelAdmin):
 
 
 class ClassroomAdmin(admin.ModelAdmin):
-    list_display = ('classroom_id', 'screenshots_enabled', 'screenshot_interval', 'updated_at')
+    list_display = ('classroom_id', 'screenshots_enabled', 'screenshot_interval', 'retention_budget_bytes', 'updated_at')
+    fieldsets = (
+        (None, {'fields': ('classroom_id', 'screenshots_enabled', 'screenshot_interval')}),
+        ('Зберігання скріншотів', {'fields': (
+            'retention_keep_recent', 'retention_tiers', 'retention_compress_over_bytes', 'retention_budget_bytes',
+        )}),
+    )
 
 
 # Unregister the default User admin and register our custom one
@@ -0,0 +1,83 @@
+"""
+Configuration polled by the screenshot agents of a classroom.
+
+The agents used to ask /screenshots/status/ and /screenshots/interval/ in
+turn, each request a Classroom get_or_create. The agent-config endpoint
+returns everything in one response, built from a copy of the settings kept
+in memory: the Classroom row is read (never created) once per process and
+dropped by roster.signals whenever a Classroom is saved, so a PATCH to
+/screenshots/ is seen on the next poll. invalidate() bumps a generation, and a
+config loaded before it is not cached, so a poll racing the PATCH cannot put
+the old settings back. Other processes pick up changes after AGENT_CONFIG_TTL
+seconds.
+
+Responses carry a weak ETag of the settings, so an unchanged configuration
+costs a 304, and a next_poll hint spread by AGENT_CONFIG_POLL_JITTER around
+AGENT_CONFIG_POLL_SECONDS, so that the workplaces do not poll in step.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+# settings: the part of the response the ETag covers
+Config = namedtuple('Config', ['settings', 'etag'])
+
+_lock = threading.Lock()
+_configs = {}
+_generation = 0
+
+
+def _load(classroom_id):
+    from roster.models import Classroom
+
+    classroom = Classroom.objects.filter(classroom_id=classroom_id).first()
+    if classroom is None:
+        classroom = Classroom(classroom_id=classroom_id)  # Field defaults, not saved
+    data = {
+        'classroom_id': classroom_id,
+        'screenshots_enabled': classroom.screenshots_enabled,
+        'screenshot_interval': classroom.screenshot_interval,
+        'capture': {
+            'upload_format': 'png',
+            'storage_format': settings.SCREENSHOT_STORAGE_FORMAT or 'png',
+            'target_bytes': settings.SCREENSHOT_TARGET_BYTES,
+            'dedupe': settings.SCREENSHOT_DEDUPE,
+        },
+    }
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
+    return Config(data, f'W/"{digest}"')
+
+
+def get(classroom_id):
+    with _lock:
+        cached = _configs.get(classroom_id)
+        if cached is not None and time.monotonic() - cached[0] < settings.AGENT_CONFIG_TTL:
+            return cached[1]
+        generation = _generation
+    config = _load(classroom_id)
+    with _lock:
+        if generation == _generation:
+            _configs[classroom_id] = (time.monotonic(), config)
+    return config
+
+
+def invalidate(classroom_id=None):
+    global _generation
+    with _lock:
+        _generation += 1
+        if classroom_id is None:
+            _configs.clear()
+        else:
+            _configs.pop(classroom_id, None)
+
+
+def next_poll(rng=random):
+    """Seconds until the next poll, jittered around AGENT_CONFIG_POLL_SECONDS"""
+    base = settings.AGENT_CONFIG_POLL_SECONDS
+    jitter = settings.AGENT_CONFIG_POLL_JITTER
+    return max(1, round(base * rng.uniform(1 - jitter, 1 + jitter)))
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RosterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'roster'
+
+    def ready(self):
+        from roster import db, signals  # noqa: F401
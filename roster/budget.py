@@ -0,0 +1,223 @@
+"""
+Tiered thinning and disk budget for screenshot retention.
+
+Rotation (roster.retention) only applies the first tier of a classroom's
+Classroom.retention_tiers, as frames leave the recent window. This planner
+handles the rest, a day of a workplace at a time:
+
+1. Tiers. A day that has aged into a coarser tier since it was last thinned
+   (ScreenshotDayRollup.retention_tier) is thinned to that tier's interval,
+   or deleted by a tier without one. Applying a tier again keeps the same
+   frames, so a rebuilt rollup only costs a repeated pass.
+
+2. Budget. Usage is the image bytes counted in the day rollups. If it is over
+   Classroom.retention_budget_bytes, over SCREENSHOT_DISK_BUDGET_BYTES for all
+   classrooms together, or the disk holding SCREENSHOTS_ROOT has less than
+   SCREENSHOT_MIN_FREE_BYTES free, the oldest days are thinned one tier
+   further, oldest first, until enough is freed. Days beyond the last tier
+   are deleted whole. The keep_recent newest frames of a workplace are never
+   touched.
+
+Planned bytes are what the frames take on disk (loose, or in the day's
+segment), not the sizes on their rows, so frames already gone from the disk do
+not count towards a target. plan() only reads; apply() carries a plan out. `manage.py plan_retention`
+runs both (or only the first with --dry-run, which reports the projected
+bytes freed and frames affected).
+"""
+import datetime
+import os
+import shutil
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from roster import retention, segments, storage
+from roster.models import ScreenshotDayRollup, Workplace, WorkplaceScreenshot
+
+# reason: 'tier' (the day aged into tier) or 'budget' (thinned further to free space)
+Action = namedtuple('Action', ['workplace_id', 'date', 'tier', 'reason', 'frames', 'bytes'])
+# days: (workplace_id, date) -> the planned _Day, whose dropped frames apply() deletes
+Plan = namedtuple('Plan', ['classroom_id', 'usage', 'budget', 'target_bytes', 'actions', 'days'])
+
+
+def classroom_workplaces(classroom_id):
+    """Workplaces of a classroom; every Workplace row belongs to the one classroom served so far"""
+    if classroom_id != storage.CLASSROOM:
+        return Workplace.objects.none()
+    return Workplace.objects.all()
+
+
+def usage(workplaces=None):
+    """Bytes of the stored images, from the day rollups"""
+    qs = ScreenshotDayRollup.objects.all()
+    if workplaces is not None:
+        qs = qs.filter(workplace__in=workplaces)
+    return qs.aggregate(total=Sum('bytes'))['total'] or 0
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def thin(frames, interval):
+    """
+    Split frames ((id, filename, created_at, file_size), oldest first) into
+    (kept, dropped): one frame per interval, none if interval is None.
+    """
+    if interval is None:
+        return [], list(frames)
+    kept, dropped = [], []
+    last_kept_at = None
+    for frame in frames:
+        if last_kept_at is not None and frame[2] - last_kept_at < interval:
+            dropped.append(frame)
+        else:
+            kept.append(frame)
+            last_kept_at = frame[2]
+    return kept, dropped
+
+
+def _target_bytes(policy, classroom_usage):
+    """Bytes that have to be freed to satisfy the classroom, global and free-space limits"""
+    target = 0
+    if policy.budget_bytes is not None:
+        target = max(target, classroom_usage - policy.budget_bytes)
+    if settings.SCREENSHOT_DISK_BUDGET_BYTES is not None:
+        target = max(target, usage() - settings.SCREENSHOT_DISK_BUDGET_BYTES)
+    if settings.SCREENSHOT_MIN_FREE_BYTES is not None:
+        try:
+            free = shutil.disk_usage(storage.root()).free
+        except FileNotFoundError:
+            free = None
+        if free is not None:
+            target = max(target, settings.SCREENSHOT_MIN_FREE_BYTES - free)
+    return target
+
+
+def stored_sizes(workplace_dir, day, frames):
+    """{id: bytes on disk} of frames ((id, filename, ...) rows) of a workplace day"""
+    packed = {e.stem: e.length for e in segments.cache.entries(storage.day_dir(workplace_dir, day))}
+    sizes = {}
+    for frame in frames:
+        path = storage.locate(workplace_dir, frame[1])
+        try:
+            sizes[frame[0]] = os.path.getsize(path) if path is not None else packed.get(os.path.splitext(frame[1])[0], 0)
+        except FileNotFoundError:
+            sizes[frame[0]] = 0
+    return sizes
+
+
+class _Day:
+    """A workplace day being planned: its live, thinnable frames and the tier they are at"""
+
+    def __init__(self, rollup, cutoff):
+        self.rollup = rollup
+        self.tier = rollup.retention_tier
+        self.dropped = []
+        start, end = _day_bounds(rollup.date)
+        if cutoff is not None:
+            end = min(end, cutoff)
+        self.frames = list(
+            WorkplaceScreenshot.objects.filter(
+                workplace_id=rollup.workplace_id, image_deleted=False, created_at__gte=start, created_at__lt=end
+            ).order_by('created_at').values_list('id', 'screenshot_filename', 'created_at', 'file_size')
+        )
+        self.sizes = stored_sizes(str(rollup.workplace.workplace_number), rollup.date, self.frames)
+
+    def thin_to(self, tier, interval):
+        """Thin to tier; returns the (frames, bytes) this step drops"""
+        self.frames, dropped = thin(self.frames, interval)
+        self.tier = tier
+        self.dropped.extend(dropped)
+        return len(dropped), sum(self.sizes[frame[0]] for frame in dropped)
+
+
+def plan(classroom_id=storage.CLASSROOM, now=None):
+    policy = retention.policy(classroom_id)
+    today = timezone.localdate(now or timezone.now())
+    workplaces = list(classroom_workplaces(classroom_id))
+    classroom_usage = usage(workplaces)
+    cutoffs = {w.pk: retention.recent_cutoff(w, policy.keep_recent) for w in workplaces}
+    last_tier = len(policy.tiers) - 1
+
+    rollups = ScreenshotDayRollup.objects.filter(
+        workplace__in=workplaces, frames_kept__gt=0
+    ).select_related('workplace').order_by('date', 'workplace_id')
+    days = []
+    actions = []
+    freed = 0
+
+    # Scheduled tiers
+    for rollup in rollups:
+        if cutoffs[rollup.workplace_id] is None:
+            continue  # Fewer frames than keep_recent: all of them are recent
+        tier = retention.tier_index(policy, (today - rollup.date).days)
+        day = None
+        if tier > rollup.retention_tier:
+            day = _Day(rollup, cutoffs[rollup.workplace_id])
+            frames, size = day.thin_to(tier, policy.tiers[tier][1])
+            actions.append(Action(rollup.workplace_id, rollup.date, tier, 'tier', frames, size))
+            freed += size
+        days.append((rollup, day))
+
+    # Budget: one more tier for the oldest days, round after round
+    target = _target_bytes(policy, classroom_usage)
+    for _ in range(len(policy.tiers) + 1):
+        if freed >= target:
+            break
+        progressed = False
+        for i, (rollup, day) in enumerate(days):
+            if freed >= target:
+                break
+            if day is None:
+                day = _Day(rollup, cutoffs[rollup.workplace_id])
+                days[i] = (rollup, day)
+            if not day.frames:
+                continue
+            tier = min(day.tier + 1, last_tier)
+            interval = policy.tiers[tier][1] if tier > day.tier else None
+            frames, size = day.thin_to(tier, interval)
+            if frames:
+                actions.append(Action(rollup.workplace_id, rollup.date, tier, 'budget', frames, size))
+                freed += size
+                progressed = True
+        if not progressed:
+            break
+
+    planned_days = {(rollup.workplace_id, rollup.date): day for rollup, day in days if day is not None}
+    return Plan(classroom_id, classroom_usage, policy.budget_bytes, target, _merge(actions), planned_days)
+
+
+def _merge(actions):
+    """One action per workplace day (the last tier it reaches), in plan order"""
+    merged = {}
+    for action in actions:
+        key = (action.workplace_id, action.date)
+        if key in merged:
+            previous = merged[key]
+            action = action._replace(frames=previous.frames + action.frames, bytes=previous.bytes + action.bytes)
+        merged[key] = action
+    return list(merged.values())
+
+
+def totals(plan):
+    return {
+        'frames': sum(action.frames for action in plan.actions),
+        'bytes': sum(action.bytes for action in plan.actions),
+        'days': len(plan.actions),
+    }
+
+
+def apply(plan):
+    """Carry out a plan returned by plan(); returns its totals, with the bytes that actually left the disk"""
+    workplaces = {w.pk: w for w in Workplace.objects.filter(pk__in={a.workplace_id for a in plan.actions})}
+    freed = 0
+    for action in plan.actions:
+        day = plan.days[(action.workplace_id, action.date)]
+        workplace = workplaces[action.workplace_id]
+        freed += retention.delete_frames(str(workplace.workplace_number), workplace, day.dropped)
+        ScreenshotDayRollup.objects.filter(pk=day.rollup.pk).update(retention_tier=action.tier)
+    return {**totals(plan), 'bytes': freed}
@@ -1,10 +1,18 @@
+import asyncio
+import base64
 import datetime
 import re
+import time
 from collections import defaultdict
 
+from asgiref.sync import sync_to_async
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpResponse
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 import json
@@ -12,117 +20,20 @@ import json
 from roster.models import WorkplaceUserPlacement, Classroom
 from roster.features import check_group_constraints
 from roster.views import current_lesson, sort_ukrainian
+from roster.retention import schedule_rotation
+from roster import agent_config, db, dedupe, events, segments, storage, tasks, thumbnails, transcode
+from roster.sendfile import serve_buffer, serve_file
 
 
+# A delta covering more events than this is answered with the full state
+DELTA_MAX_EVENTS = 500
 
-# Helper for screenshot rotation
-def rotate_screenshots(dir_path, workplace=None):
-    """
-    Implements smart retention policy:
-    1. Keep 100 most recent files as is.
-    2. For older files (index >= 100):
-       - Delete if older than 1 year.
-       - Keep only one file every 15 mins (based on timestamp in filename).
-       - Delete others (and their DB records).
-       - If kept file > 50KB, compress/resize it.
-    """
-    import glob
-    import os
-    import re
-    import datetime
-    from PIL import Image
-    from roster.models import WorkplaceScreenshot
-
-    try:
-        files = glob.glob(os.path.join(dir_path, "*.png"))
-        # Sort by modification time, newest first
-        files.sort(key=os.path.getmtime, reverse=True)
-        
-        # files[0] is newest
-        
-        # We only care if we have more than 100 files
-        if len(files) <= 100:
-            return
-
-        # Indices 0..99 are kept safe (recent)
-        
-        # Process older files
-        last_kept_time = None
-        
-        for i in range(100, len(files)):
-            file_path = files[i]
-            basename = os.path.basename(file_path)
-            
-            # Policy: Keep one every 15 minutes of "file timestamp"
-            # Filename format: YYYYMMDD_HHMMSS.png
-            should_delete = False
-            
-            try:
-                # Parse time from filename
-                # Match YYYYMMDD_HHMMSS or YYYYMMDD_HHMM (for backward compatibility)
-                match = re.match(r'^(\d{8}_(\d{4,6}))\.png$', basename)
-                if not match:
-                     # Unknown format, maybe keep it to be safe? Or delete?
-                     # Let's delete to be clean if it's old
-                     should_delete = True
-                else:
-                    ts_str = match.group(1)
-                    # We use group 2 length to decide format
-                    time_part_len = len(match.group(2))
-                    
-                    if time_part_len == 6:
-                        dt = datetime.datetime.strptime(ts_str, "%Y%m%d_%H%M%S")
-                    else:
-                        dt = datetime.datetime.strptime(ts_str, "%Y%m%d_%H%M")
-                    
-                    if dt < datetime.datetime.now() - datetime.timedelta(days=365):
-                        should_delete = True
-                    elif last_kept_time is None:
-                        # This is the newest of the "old" batch. Keep it.
-                        last_kept_time = dt
-                    else:
-                        # Calculate difference
-                        diff = abs((last_kept_time - dt).total_seconds())
-                        if diff < 15 * 60: # 15 minutes
-                            should_delete = True
-                        else:
-                            # Keep it
-                            last_kept_time = dt
-                            
-            except ValueError:
-                 should_delete = True
-            
-            if should_delete:
-                try:
-                    os.remove(file_path)
-                    # Mark in DB
-                    if workplace:
-                        WorkplaceScreenshot.objects.filter(
-                            workplace=workplace, 
-                            screenshot_filename=basename
-                        ).update(image_deleted=True)
-                except OSError as e:
-                    print(f"Error deleting {file_path}: {e}")
-                continue
-            
-            # It's a keeper check compression
-            try:
-                size = os.path.getsize(file_path)
-                if size > 50 * 1024: # 50KB
-                    # Compress
-                    with Image.open(file_path) as img:
-                        # As requested: "make smaller dimension"
-                        w, h = img.size
-                        new_w = int(w * 0.5)
-                        new_h = int(h * 0.5)
-                        
-                        resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                        resized.save(file_path, optimize=True, quality=85)
-            except Exception as e:
-                print(f"Error compressing {file_path}: {e}")
+# Screenshot history pages
+SCREENSHOT_PAGE_SIZE = 200
+SCREENSHOT_PAGE_SIZE_MAX = 1000
+SEARCH_PAGE_SIZE = 100
+SCREENSHOT_LIST_FIELDS = ['filename', 'created_at', 'user_name', 'os_username', 'reported_workplace', 'window_titles', 'image_deleted']
 
-    except Exception as e:
-        print(f"Error in rotate_screenshots: {e}")
 
 def serialize_placement(placement):
     """Serialize a WorkplaceUserPlacement object to JSON-friendly dict"""
@@ -143,7 +54,9 @@ def serialize_placement(placement):
 def get_classroom_329(request):
     """
     GET /api/classrooms/329/
-    Retrieve classroom 329 state with optional filters
+    Retrieve classroom 329 state with optional filters.
+    Responses carry an ETag derived from the state version (If-None-Match -> 304);
+    ?since=<version> returns only the workplaces changed after that version.
     """
     # Get filter parameters
     today = datetime.date.today().strftime('%Y-%m-%d')
@@ -197,10 +110,31 @@ def get_classroom_329(request):
     lesson_start = datetime.datetime.combine(date, settings.LESSONS_SCHEDULE[lesson_from]['start'])
     lesson_end = datetime.datetime.combine(date, settings.LESSONS_SCHEDULE[lesson_to]['end'])
     
-    # Query placements
+    # State version: id of the latest classroom event (placements, screenshots, settings)
+    version = events.latest_event_id()
+    etag = f'"{version}-{date_str}-{lesson}-{int(singles)}"'
+    if get_conditional_response(request, etag=etag) is not None:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    # ?since=<version>: only return workplaces that changed after that version
+    changed_numbers = None
+    settings_changed = True
+    since = request.GET.get('since', '')
+    if since.isdigit() and int(since) <= version and events.is_resumable(int(since)):
+        changes = events.events_since(int(since), limit=DELTA_MAX_EVENTS)
+        if len(changes) < DELTA_MAX_EVENTS:
+            changed_numbers = {e.workplace_number for e in changes if e.workplace_number is not None}
+            settings_changed = any(e.kind == 'settings' for e in changes)
+
+    # Query placements: lesson_index >= lesson_from means created at or after its start
     placements = WorkplaceUserPlacement.objects.filter(
-        created_at__gte=lesson_start,
-        created_at__lte=lesson_end
+        lesson_date=date,
+        lesson_index__range=(lesson_from, lesson_to),
+        # The lower bound is implied by lesson_date; it lets PostgreSQL skip other months' partitions
+        created_at__gte=timezone.make_aware(datetime.datetime.combine(date, datetime.time.min)),
+        created_at__lte=timezone.make_aware(lesson_end)
     ).select_related('user').order_by('created_at')
     
     # Group by workplace
@@ -209,9 +143,8 @@ def get_classroom_329(request):
     classroom = defaultdict(list)
     
     for p in placements:
-        regex = r'.*-(\d+)'
-        if m := re.match(regex, p.workplace_id):
-            n = int(m.group(1))
+        if p.workplace_number is not None:
+            n = p.workplace_number
             # Only add if user not already in this workplace
             if p.user.id not in [x.user.id for x in classroom[n]]:
                 classroom[n].append(p)
@@ -225,63 +158,37 @@ def get_classroom_329(request):
     
     # Format workplace groups
     from roster.models import Workplace
-    from django.db.models import OuterRef, Subquery
-    from roster.models import WorkplaceScreenshot
-    
-    # Pre-fetch all workplaces info with latest screenshot (not deleted)
-    newest = WorkplaceScreenshot.objects.filter(
-        workplace=OuterRef('pk'),
-        image_deleted=False
-    ).order_by('-created_at')
-    
-    workplaces_qs = Workplace.objects.annotate(
-        latest_filename=Subquery(newest.values('screenshot_filename')[:1]),
-        latest_at=Subquery(newest.values('created_at')[:1]),
-        latest_os_username=Subquery(newest.values('os_username')[:1]),
-        latest_reported_workplace=Subquery(newest.values('reported_workplace')[:1]),
-        latest_window_titles=Subquery(newest.values('window_titles')[:1]),
-        latest_user_first_name=Subquery(newest.values('user__first_name')[:1]),
-        latest_user_last_name=Subquery(newest.values('user__last_name')[:1])
-    )
-    workplaces_info = {w.workplace_number: w for w in workplaces_qs}
+
+    # Latest non-deleted screenshot of every workplace, kept up to date at ingest and by rotation
+    workplaces_qs = Workplace.objects.select_related('latest_screenshot', 'latest_screenshot__user')
+    if changed_numbers is not None:
+        workplaces_qs = workplaces_qs.filter(workplace_number__in=changed_numbers)
+    workplaces_info = {w.workplace_number: w.latest_screenshot for w in workplaces_qs}
 
     def get_wp_data(i):
-        w = workplaces_info.get(i)
+        shot = workplaces_info.get(i)
         user_name = None
-        if w and w.latest_user_last_name:
-            user_name = f"{w.latest_user_last_name} {w.latest_user_first_name}"
-        elif w and w.latest_user_first_name:
-            user_name = w.latest_user_first_name
+        if shot and shot.user and shot.user.last_name:
+            user_name = f"{shot.user.last_name} {shot.user.first_name}"
+        elif shot and shot.user and shot.user.first_name:
+            user_name = shot.user.first_name
 
         return {
             'number': i,
             'placements': [serialize_placement(p) for p in classroom[i]],
-            'last_screenshot_filename': w.latest_filename if w else None,
-            'last_screenshot_at': w.latest_at.isoformat() if w and w.latest_at else None,
-            'last_os_username': w.latest_os_username if w else None,
+            'last_screenshot_filename': shot.screenshot_filename if shot else None,
+            'last_screenshot_at': shot.created_at.isoformat() if shot else None,
+            # Later uploads of the same picture only move this forward
+            'last_seen_at': (shot.last_seen_at or shot.created_at).isoformat() if shot else None,
+            'last_os_username': shot.os_username if shot else None,
             'last_user_name': user_name,
-            'last_reported_workplace': w.latest_reported_workplace if w else None,
-            'last_window_titles': w.latest_window_titles if w else []
+            'last_reported_workplace': shot.reported_workplace if shot else None,
+            'last_window_titles': shot.window_titles if shot else []
         }
 
-    g1 = []
-    for i in range(9, 0, -1):
-        g1.append(get_wp_data(i))
-    
-    g2 = []
-    for i in range(10, 19):
-        g2.append(get_wp_data(i))
-    
-    teacher_wp = get_wp_data(19)
-    
-    # Get classroom settings
-    classroom, _ = Classroom.objects.get_or_create(
-        classroom_id='329',
-        defaults={'screenshots_enabled': True}
-    )
-    
-    return JsonResponse({
+    data = {
         'classroom_id': 329,
+        'version': version,
         'date': date_str,
         'lesson': lesson,
         'singles': singles,
@@ -289,15 +196,41 @@ def get_classroom_329(request):
         'lesson_to': lesson_to,
         'lesson_start': lesson_start.isoformat(),
         'lesson_end': lesson_end.isoformat(),
-        'workplaces_1': g1,
-        'workplaces_2': g2,
-        'teacher_workplace': teacher_wp,
         'unique_users_count': uniq,
         'usernames': sort_ukrainian(usernames),
         'last_updated': datetime.datetime.now().isoformat(),
-        'screenshots_enabled': classroom.screenshots_enabled,
-        'screenshot_interval': classroom.screenshot_interval,
-    })
+    }
+
+    if changed_numbers is not None:
+        data['delta'] = True
+        data['since'] = int(since)
+        data['workplaces'] = [get_wp_data(i) for i in sorted(changed_numbers) if 1 <= i <= 19]
+    else:
+        g1 = []
+        for i in range(9, 0, -1):
+            g1.append(get_wp_data(i))
+
+        g2 = []
+        for i in range(10, 19):
+            g2.append(get_wp_data(i))
+
+        data['delta'] = False
+        data['workplaces_1'] = g1
+        data['workplaces_2'] = g2
+        data['teacher_workplace'] = get_wp_data(19)
+
+    if settings_changed:
+        # Get classroom settings
+        classroom, _ = Classroom.objects.get_or_create(
+            classroom_id='329',
+            defaults={'screenshots_enabled': True}
+        )
+        data['screenshots_enabled'] = classroom.screenshots_enabled
+        data['screenshot_interval'] = classroom.screenshot_interval
+
+    response = JsonResponse(data)
+    response['ETag'] = etag
+    return response
 
 
 @csrf_exempt
@@ -344,6 +277,53 @@ def assign_workplace_329(request, workplace_id):
     }, status=201)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def auto_assign_group_329(request, group_id):
+    """
+    POST /api/classrooms/329/groups/<group_id>/auto_assign/
+    Seat every student of a group who has no placement this lesson, respecting group features.
+    Optional JSON body: {"workplaces": [1, 2, ...], "user_ids": [...], "dry_run": true}
+    """
+    from roster import seating
+    from roster.models import StudentGroup
+
+    try:
+        data = json.loads(request.body) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    try:
+        group = StudentGroup.objects.get(id=group_id)
+    except StudentGroup.DoesNotExist:
+        return JsonResponse({'error': 'Group not found'}, status=404)
+
+    try:
+        seats = [int(n) for n in data['workplaces']] if data.get('workplaces') is not None else None
+        students = [int(n) for n in data['user_ids']] if data.get('user_ids') is not None else None
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'workplaces and user_ids must be lists of integers'}, status=400)
+
+    try:
+        if data.get('dry_run'):
+            assignment = seating.plan_group(group, seats, students)
+            return JsonResponse({
+                'success': True,
+                'assignments': [
+                    {'user_id': user_id, 'workplace_number': seat}
+                    for user_id, seat in sorted(assignment.items(), key=lambda item: item[1])
+                ],
+            })
+        placements = seating.assign_group(group, seats, students)
+    except seating.SeatingError as e:
+        return JsonResponse({'error': str(e)}, status=409)
+
+    return JsonResponse({
+        'success': True,
+        'placements': [serialize_placement(p) for p in placements]
+    }, status=201)
+
+
 @csrf_exempt
 @require_http_methods(["DELETE"])
 def remove_workplace_329(request, workplace_id):
@@ -442,12 +422,8 @@ def screenshots_status_329(request):
     GET /api/classrooms/329/screenshots/status/
     Simple endpoint for PowerShell scripts - returns "1" if enabled, "0" if disabled
     """
-    classroom, _ = Classroom.objects.get_or_create(
-        classroom_id='329',
-        defaults={'screenshots_enabled': True, 'screenshot_interval': 60}
-    )
-    
-    return HttpResponse("1" if classroom.screenshots_enabled else "0", content_type="text/plain")
+    config = agent_config.get('329').settings
+    return HttpResponse("1" if config['screenshots_enabled'] else "0", content_type="text/plain")
 
 
 @require_http_methods(["GET"])
@@ -456,12 +432,125 @@ def screenshots_interval_329(request):
     GET /api/classrooms/329/screenshots/interval/
     Simple endpoint for PowerShell scripts - returns the interval in seconds
     """
-    classroom, _ = Classroom.objects.get_or_create(
-        classroom_id='329',
-        defaults={'screenshots_enabled': True, 'screenshot_interval': 60}
+    config = agent_config.get('329').settings
+    return HttpResponse(str(config['screenshot_interval']), content_type="text/plain")
+
+
+@require_http_methods(["GET"])
+def agent_config_329(request):
+    """
+    GET /api/classrooms/329/agent/config/
+    Everything a screenshot agent polls for: enabled flag, interval, capture profile,
+    server time and next_poll (seconds until the next poll, jittered per response;
+    also in X-Next-Poll). Carries a weak ETag of the settings (If-None-Match -> 304).
+    """
+    config = agent_config.get('329')
+    next_poll = agent_config.next_poll()
+    if get_conditional_response(request, etag=config.etag) is not None:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse({
+            **config.settings,
+            'server_time': timezone.now().isoformat(),
+            'next_poll': next_poll,
+        })
+    response['ETag'] = config.etag
+    response['X-Next-Poll'] = str(next_poll)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _active_user(workplace_number, os_username):
+    """The student a frame from this workplace belongs to: its latest placement, else the OS user"""
+    from roster.models import WorkplaceUserPlacement
+
+    active_user = None
+    try:
+        # Step 1: Try finding match by placement (highest priority)
+        # workplace_number is parsed from any spelling: "1", "329-1", "329-01", "W-1", "Workplace 1"
+        last_placement = WorkplaceUserPlacement.objects.filter(
+            workplace_number=workplace_number
+        ).filter(
+            Q(classroom='329') | Q(classroom__isnull=True)
+        ).select_related('user').order_by('-created_at').first()
+        
+        if last_placement:
+            active_user = last_placement.user
+        
+        # Step 2: Fallback to OS Username match
+        if not active_user and os_username:
+            # Try to find a user where OS username matches Django username
+            # or a custom profile field if we had one.
+            # Many students have usernames like 'ivanov' or 'i.ivanov'
+            matched_user = User.objects.filter(username__iexact=os_username).first()
+            if matched_user:
+                active_user = matched_user
+
+    except Exception as e:
+        print(f"Error finding user: {e}")
+    return active_user
+
+
+def _store_screenshot(dir_path, workplace_dir_name, workplace_id, filename, file_size, frame_hash, os_username, window_titles):
+    """Database side of a screenshot upload: history row, latest pointer, retention"""
+    from roster.models import Workplace
+
+    # Resolve workplace
+    workplace = None
+    try:
+        workplace_num = int(workplace_dir_name)
+        if 1 <= workplace_num <= 19:
+            workplace, _ = Workplace.objects.get_or_create(workplace_number=workplace_num)
+    except ValueError:
+        pass
+
+    # Update database
+    if workplace:
+        # --- NEW: Create History Record ---
+        from roster.models import WorkplaceScreenshot
+        
+        active_user = _active_user(workplace.workplace_number, os_username)
+
+        screenshot = WorkplaceScreenshot.objects.create(
+            workplace=workplace,
+            screenshot_filename=filename,
+            file_size=file_size,
+            frame_hash=frame_hash,
+            user=active_user,
+            reported_workplace=workplace_id,
+            os_username=os_username,
+            window_titles=window_titles
+        )
+        # Denormalized pointer read by the dashboard
+        Workplace.objects.filter(pk=workplace.pk).update(latest_screenshot=screenshot)
+        # ----------------------------------
+
+    # Transcoding and Smart Retention run on the background worker once the row is committed
+    screenshot_id = screenshot.id if workplace else None
+    db.on_commit(lambda: transcode.schedule_transcode(dir_path, filename, screenshot_id))
+    db.on_commit(lambda: schedule_rotation(str(workplace_dir_name), workplace))
+
+
+def _record_repeat(screenshot_id, file_size):
+    """An upload repeated this frame: mark it as still on screen instead of storing the copy"""
+    from django.db.models import F
+    from roster import rollups
+    from roster.models import WorkplaceScreenshot
+
+    now = timezone.now()
+    WorkplaceScreenshot.objects.filter(pk=screenshot_id).update(
+        last_seen_at=now, repeat_count=F('repeat_count') + 1
     )
-    
-    return HttpResponse(str(classroom.screenshot_interval), content_type="text/plain")
+    shot = WorkplaceScreenshot.objects.select_related('workplace').filter(pk=screenshot_id).first()
+    if shot is None:
+        return
+    rollups.frame_skipped(shot.workplace_id, now, file_size)
+    if shot.repeat_count % dedupe.REPEAT_EVENT_EVERY == 0:
+        # Lets the dashboard see that the workplace is still reporting
+        events.publish('screenshot', shot.workplace.workplace_number, {
+            'filename': shot.screenshot_filename,
+            'repeat': True,
+        })
 
 
 @csrf_exempt
@@ -474,7 +563,7 @@ def upload_screenshot_329(request, workplace_id):
     import os
     import glob
     import re
-    from roster.models import Workplace
+    from roster.models import Workplace, WorkplaceScreenshot, parse_workplace_id
     
     # Extract directory name logic
     match = re.search(r'-(\d+)', workplace_id)
@@ -527,13 +616,35 @@ def upload_screenshot_329(request, workplace_id):
         # Field exists but raw_titles was empty/None? Check getlist
         window_titles = request.POST.getlist('window_titles') or request.GET.getlist('window_titles')
     
-    # Create directory if not exists
-    dir_path = os.path.join(settings.BASE_DIR, 'data', 'screenshots', str(workplace_dir_name))
-    os.makedirs(dir_path, exist_ok=True)
-    
+    # Frames repeating the workplace's latest one are not stored, only counted
+    fp = None
+    if settings.SCREENSHOT_DEDUPE:
+        fp = dedupe.fingerprint(file)
+        _, number = parse_workplace_id(str(workplace_dir_name))
+        previous = Workplace.objects.filter(workplace_number=number).values_list(
+            'latest_screenshot', flat=True
+        ).first()
+        if previous is not None:
+            previous = WorkplaceScreenshot.objects.filter(pk=previous).first()
+        active_user = _active_user(number, os_username) if previous is not None else None
+        repeat = dedupe.is_repeat(fp, previous, os_username, active_user and active_user.pk, window_titles)
+        dedupe.dedupe_stats.record(fp, repeat, file.size)
+        if repeat:
+            db.write(_record_repeat, previous.pk, file.size)
+            return JsonResponse({
+                'success': True,
+                'workplace_dir': workplace_dir_name,
+                'filename': previous.screenshot_filename,
+                'repeat': True,
+            })
+
     # Generate filename with timestamp (including seconds for uniqueness and requested format)
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{timestamp}.png"
+
+    # Frames are stored by day: <classroom>/<workplace>/YYYY/MM/DD/ (roster.storage)
+    dir_path = storage.frame_dir(workplace_dir_name, filename)
+    os.makedirs(dir_path, exist_ok=True)
     file_path = os.path.join(dir_path, filename)
     
     try:
@@ -543,60 +654,18 @@ def upload_screenshot_329(request, workplace_id):
     except Exception as e:
         return JsonResponse({'error': f'Failed to write file: {str(e)}'}, status=500)
         
-    # Resolve workplace
-    workplace = None
+    # Thumbnails run on the background worker, off the request path, ahead of transcoding
+    tasks.submit(('thumbnails', file_path), thumbnails.pregenerate, file_path, str(workplace_dir_name), filename)
+    # The database rows are written by the shared writer (batched under the concurrent DB profile);
+    # the upload is acknowledged once they are committed
     try:
-        workplace_num = int(workplace_dir_name)
-        if 1 <= workplace_num <= 19:
-            workplace, _ = Workplace.objects.get_or_create(workplace_number=workplace_num)
-    except ValueError:
-        pass
-
-    # Validation logic: Smart Retention
-    rotate_screenshots(dir_path, workplace)
-
-    # Update database
-    if workplace:
-        # --- NEW: Create History Record ---
-        from roster.models import WorkplaceScreenshot, WorkplaceUserPlacement
-        
-        active_user = None
-        try:
-            # Step 1: Try finding match by placement (highest priority)
-            from django.db.models import Q
-            wp_str = str(workplace.workplace_number)
-            # Try various common formats: "1", "329-1", "329-01", "W-1", "Workplace 1"
-            formats = [wp_str, f"329-{wp_str}", f"329-0{wp_str}", f"W-{wp_str}", f"Workplace {wp_str}"]
-            
-            last_placement = WorkplaceUserPlacement.objects.filter(
-                workplace_id__in=formats
-            ).order_by('-created_at').first()
-            
-            if last_placement:
-                active_user = last_placement.user
-            
-            # Step 2: Fallback to OS Username match
-            if not active_user and os_username:
-                # Try to find a user where OS username matches Django username
-                # or a custom profile field if we had one.
-                # Many students have usernames like 'ivanov' or 'i.ivanov'
-                matched_user = User.objects.filter(username__iexact=os_username).first()
-                if matched_user:
-                    active_user = matched_user
-
-        except Exception as e:
-            print(f"Error finding user: {e}")
-        
-        WorkplaceScreenshot.objects.create(
-            workplace=workplace,
-            screenshot_filename=filename,
-            user=active_user,
-            reported_workplace=workplace_id,
-            os_username=os_username,
-            window_titles=window_titles
+        db.write(
+            _store_screenshot, dir_path, workplace_dir_name, workplace_id, filename, file.size,
+            fp and fp.hash, os_username, window_titles,
         )
-        # ----------------------------------
-    
+    except Exception as e:
+        return JsonResponse({'error': f'Failed to store screenshot: {str(e)}'}, status=500)
+
     return JsonResponse({
         'success': True,
         'workplace_dir': workplace_dir_name,
@@ -608,60 +677,133 @@ def upload_screenshot_329(request, workplace_id):
 def serve_screenshot_329(request, workplace_id, filename):
     """
     GET /api/classrooms/329/workplaces/<workplace_id>/screenshots/<filename>/
-    Securely serves a screenshot file
+    Securely serves a screenshot file (with ETag/Last-Modified, 304 and Range support)
     """
+    import io
     import os
-    from django.http import FileResponse, Http404
+    from django.http import Http404
     
     # Basic validation of workplace_id to prevent directory traversal
     if not re.match(r'^[\w-]+$', workplace_id):
         raise Http404("Invalid workplace ID")
         
     # Validation of filename
-    if not re.match(r'^[\w-]+\.png$', filename):
+    if not transcode.FRAME_NAME_RE.match(filename):
         raise Http404("Invalid filename")
 
-    file_path = os.path.join(settings.BASE_DIR, 'data', 'screenshots', workplace_id, filename)
+    # Either directory layout; the frame may have been transcoded since the name was handed out
+    file_path = storage.locate(workplace_id, filename)
+    # Cold days are packed into segments and read from the mapped file
+    packed = storage.read_frame(workplace_id, filename) if file_path is None else None
+    # A segment keeps the bytes of frames deleted after it was packed until it is rewritten
+    if packed is not None and _packed_frame_deleted(workplace_id, filename):
+        packed = None
     
-    if not os.path.exists(file_path):
+    if file_path is None and packed is None:
         raise Http404("Screenshot not found")
         
+    width = None
     if request.GET.get('thumb') == '1':
-        from PIL import Image
-        import io
-        from django.http import HttpResponse
-        
+        width = settings.SCREENSHOT_THUMBNAIL_WIDTHS[0]
+    elif request.GET.get('w', '').isdigit():
+        width = thumbnails.pick_width(int(request.GET['w']))
+
+    if width:
         try:
-            img = Image.open(file_path)
-            # Resize to 160px width, keeping aspect ratio
-            base_width = 160
-            w_percent = (base_width / float(img.size[0]))
-            h_size = int((float(img.size[1]) * float(w_percent)))
-            img = img.resize((base_width, h_size), Image.Resampling.LANCZOS)
-            
-            buf = io.BytesIO()
-            img.save(buf, format='PNG')
-            return HttpResponse(buf.getvalue(), content_type='image/png')
+            if packed is not None:
+                thumb_path = thumbnails.get_thumbnail(
+                    packed.segment, workplace_id, filename, width, source=io.BytesIO(packed.data)
+                )
+            else:
+                thumb_path = thumbnails.get_thumbnail(file_path, workplace_id, filename, width)
+            return serve_file(request, thumb_path, thumbnails.THUMBNAIL_CONTENT_TYPE)
         except Exception as e:
             # Fallback to full image if something goes wrong with processing
             pass
 
-    return FileResponse(open(file_path, 'rb'), content_type='image/png')
+    if packed is not None:
+        return serve_buffer(request, packed.data, transcode.content_type(packed.filename), packed.mtime)
+    return serve_file(request, file_path, transcode.content_type(file_path))
+
+
+def _packed_frame_deleted(workplace_id, filename):
+    """Whether the screenshot row of a packed frame (under any extension) is image_deleted"""
+    import os
+    from roster.models import WorkplaceScreenshot
+
+    if not workplace_id.isdigit():
+        return False
+    stem = os.path.splitext(filename)[0]
+    rows = WorkplaceScreenshot.objects.filter(
+        workplace__workplace_number=int(workplace_id),
+        screenshot_filename__in=[stem + extension for extension in transcode.FRAME_EXTENSIONS],
+    )
+    return rows.filter(image_deleted=True).exists() and not rows.filter(image_deleted=False).exists()
+
+
+def _encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """Inverse of _encode_cursor; returns None for a malformed cursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _paginated_response(request, data, next_cursor, prev_cursor):
+    """JSON array of one page; cursors go to the Link header and X-Next-Cursor / X-Prev-Cursor"""
+    response = JsonResponse(data, safe=False)
+    links = []
+    for rel, param, cursor in (('next', 'before', next_cursor), ('prev', 'after', prev_cursor)):
+        if cursor:
+            params = request.GET.copy()
+            params.pop('before', None)
+            params.pop('after', None)
+            params[param] = cursor
+            links.append(f'<{request.path}?{params.urlencode()}>; rel="{rel}"')
+            response[f'X-{rel.capitalize()}-Cursor'] = cursor
+    if links:
+        response['Link'] = ', '.join(links)
+    return response
 
 
 @require_http_methods(["GET"])
 def list_screenshots_329(request, workplace_id):
     """
-    GET /api/classrooms/329/workplaces/<workplace_id>/screenshots/
-    Returns list of available screenshots for a workplace
+    GET /api/classrooms/329/workplaces/<workplace_id>/screenshots/?limit=&before=&after=&around=&fields=
+    Returns one page of available screenshots for a workplace, newest first.
+    Pages are keyset-paginated on (created_at, id): follow the cursor from the
+    X-Next-Cursor header (or Link rel="next") with ?before=, X-Prev-Cursor with ?after=.
+    ?around=<filename> starts the page at that screenshot (under any extension), with
+    both cursors, so a frame deep in the history is shown with its metadata.
+    ?fields=filename,created_at,... limits the returned fields (e.g. to skip window_titles).
     """
     import os
-    import glob
     from roster.models import WorkplaceScreenshot, Workplace
     
     # Basic validation of workplace_id
     if not re.match(r'^[\w-]+$', workplace_id):
         return JsonResponse({'error': 'Invalid workplace ID'}, status=400)
+
+    try:
+        limit = min(int(request.GET.get('limit', SCREENSHOT_PAGE_SIZE)), SCREENSHOT_PAGE_SIZE_MAX)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
+
+    fields = SCREENSHOT_LIST_FIELDS
+    if request.GET.get('fields'):
+        fields = [f for f in request.GET['fields'].split(',') if f in SCREENSHOT_LIST_FIELDS]
+
+    before = _decode_cursor(request.GET['before']) if request.GET.get('before') else None
+    after = _decode_cursor(request.GET['after']) if request.GET.get('after') else None
+    if (request.GET.get('before') and before is None) or (request.GET.get('after') and after is None):
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
     
     # Try to fetch from DB first (WorkplaceScreenshot)
     try:
@@ -673,138 +815,368 @@ def list_screenshots_329(request, workplace_id):
                 screenshots = WorkplaceScreenshot.objects.filter(
                     workplace=workplace,
                     image_deleted=False
-                ).select_related('user').order_by('-created_at')
-                
+                )
+
+                anchor = None
+                if request.GET.get('around') and not (before or after):
+                    stem = os.path.splitext(request.GET['around'])[0]
+                    anchor = screenshots.filter(
+                        screenshot_filename__in=[stem + extension for extension in transcode.FRAME_EXTENSIONS]
+                    ).values_list('created_at', 'id').first()
+
+                if anchor:
+                    # Inclusive of the anchor; a prev cursor only if there is anything newer
+                    anchor_has_newer = screenshots.filter(
+                        Q(created_at__gt=anchor[0]) | Q(created_at=anchor[0], id__gt=anchor[1])
+                    ).exists()
+                    screenshots = screenshots.filter(
+                        Q(created_at__lt=anchor[0]) | Q(created_at=anchor[0], id__lte=anchor[1])
+                    ).order_by('-created_at', '-id')
+                elif before or after:
+                    try:
+                        created_at, shot_id = before or after
+                        created_at = datetime.datetime.fromisoformat(created_at)
+                    except (ValueError, TypeError):
+                        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+                    if before:
+                        screenshots = screenshots.filter(
+                            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=shot_id)
+                        ).order_by('-created_at', '-id')
+                    else:
+                        screenshots = screenshots.filter(
+                            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=shot_id)
+                        ).order_by('created_at', 'id')
+                else:
+                    screenshots = screenshots.order_by('-created_at', '-id')
+
+                columns = {'id', 'created_at', 'screenshot_filename'}
+                if 'user_name' in fields:
+                    columns |= {'user__first_name', 'user__last_name'}
+                columns |= {f for f in fields if f in ('os_username', 'reported_workplace', 'window_titles', 'image_deleted')}
+                rows = list(screenshots.values(*columns)[:limit + 1])
+
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                if after:
+                    rows.reverse()
+
                 data = []
-                for s in screenshots:
+                for s in rows:
                     user_name = None
-                    if s.user:
-                        user_name = f"{s.user.last_name} {s.user.first_name}"
-                        
-                    data.append({
-                        'filename': s.screenshot_filename,
-                        'created_at': s.created_at.isoformat(),
+                    if s.get('user__last_name') is not None:
+                        user_name = f"{s['user__last_name']} {s['user__first_name']}"
+
+                    item = {
+                        'filename': s['screenshot_filename'],
+                        'created_at': s['created_at'].isoformat(),
                         'user_name': user_name,
-                        'os_username': s.os_username,
-                        'reported_workplace': s.reported_workplace,
-                        'window_titles': s.window_titles,
-                        'image_deleted': s.image_deleted
-                    })
-                
+                        'os_username': s.get('os_username'),
+                        'reported_workplace': s.get('reported_workplace'),
+                        'window_titles': s.get('window_titles'),
+                        'image_deleted': s.get('image_deleted'),
+                    }
+                    data.append({k: v for k, v in item.items() if k in fields})
+
                 # If we have DB records, return them
-                if data:
-                    return JsonResponse(data, safe=False)
+                if rows or before or after:
+                    first, last = (rows[0], rows[-1]) if rows else (None, None)
+                    next_cursor = prev_cursor = None
+                    if last and (has_more or after):
+                        next_cursor = _encode_cursor(last['created_at'].isoformat(), last['id'])
+                    if first and (before or (anchor and anchor_has_newer) or (after and has_more)):
+                        prev_cursor = _encode_cursor(first['created_at'].isoformat(), first['id'])
+                    return _paginated_response(request, data, next_cursor, prev_cursor)
             except Workplace.DoesNotExist:
                 pass
     except ValueError:
         pass
     
     # Fallback to file system if no DB records found (backward compatibility)
-    dir_path = os.path.join(settings.BASE_DIR, 'data', 'screenshots', workplace_id)
-    
-    if not os.path.exists(dir_path):
-        return JsonResponse([])
-        
+    if not settings.SCREENSHOT_FILESYSTEM_FALLBACK or not re.match(r'^[\w-]+$', workplace_id):
+        return JsonResponse([], safe=False)
+
     try:
-        # Get all png files
-        files = glob.glob(os.path.join(dir_path, "*.png"))
-        # Sort by modification time (newest first)
-        files.sort(key=os.path.getmtime, reverse=True)
+        # Filenames are timestamps (YYYYMMDD_HHMMSS.<png|webp|avif>), so name order is time order.
+        # Only the day directories the page reaches are listed, and only the page is stat()-ed.
+        page = storage.page_names(
+            workplace_id, limit, before=before and before[0], after=after and after[0]
+        )
+
+        has_more = len(page) > limit
+        page = page[-limit:] if after else page[:limit]
         
         # Extract just filenames and return as objects (mocking the new structure)
         data = []
-        for f in files:
-            filename = os.path.basename(f)
-            # Try to get timestamp from filename or mtime
-            timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(f)).isoformat()
-            
-            data.append({
+        for filename in page:
+            timestamp = datetime.datetime.fromtimestamp(storage.frame_mtime(workplace_id, filename)).isoformat()
+            item = {
                 'filename': filename,
                 'created_at': timestamp,
                 'user_name': None # No user info for legacy files
-            })
-        
-        return JsonResponse(data, safe=False)
+            }
+            data.append({k: v for k, v in item.items() if k in fields})
+
+        next_cursor = prev_cursor = None
+        if page and (has_more or after):
+            next_cursor = _encode_cursor(page[-1])
+        if page and (before or (after and has_more)):
+            prev_cursor = _encode_cursor(page[0])
+        return _paginated_response(request, data, next_cursor, prev_cursor)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 @require_http_methods(["GET"])
 def screenshot_dates_329(request):
     """
-    GET /api/classrooms/329/screenshots/dates/
-    Returns a list of dates (YYYY-MM-DD) that have screenshots
+    GET /api/classrooms/329/screenshots/dates/?from=<YYYY-MM-DD>&to=<YYYY-MM-DD>
+    Returns a list of dates (YYYY-MM-DD) that have screenshots, optionally limited to a date range
     """
-    from roster.models import WorkplaceScreenshot
-    from django.db.models.functions import TruncDate
-    
-    dates = WorkplaceScreenshot.objects.annotate(
-        date=TruncDate('created_at')
-    ).values_list('date', flat=True).distinct().order_by('-date')
-    
-    return JsonResponse(list(dates), safe=False)
+    from roster import rollups
+
+    try:
+        start, end = rollups.parse_range(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be YYYY-MM-DD'}, status=400)
+    return JsonResponse(rollups.dates(start, end), safe=False)
+
+
+@require_http_methods(["GET"])
+def screenshot_summary_329(request):
+    """
+    GET /api/classrooms/329/screenshots/summary/?from=<YYYY-MM-DD>&to=<YYYY-MM-DD>
+    Returns screenshot activity per date: frames, frames_kept, bytes, workplaces, users, first_at, last_at
+    """
+    from roster import rollups
+
+    try:
+        start, end = rollups.parse_range(request.GET)
+    except ValueError:
+        return JsonResponse({'error': 'Dates must be YYYY-MM-DD'}, status=400)
+    return JsonResponse(rollups.summary(start, end), safe=False)
 
 
 @require_http_methods(["GET"])
 def search_screenshots_329(request):
     """
-    GET /api/classrooms/329/screenshots/search/?q=<query>&date=<YYYY-MM-DD>
-    Search for screenshots across all workplaces by OS username or student name
-    With optional date filter
+    GET /api/classrooms/329/screenshots/search/?q=<query>&date=<YYYY-MM-DD>&limit=&before=
+    Search for screenshots across all workplaces by OS username, student name or window title
+    With optional date filter. Words match as prefixes, "quoted text" as a phrase;
+    results are returned best match first (newest first without a full-text index).
+    The total is returned in X-Total-Count on the first page, further pages
+    are followed with ?before=<X-Next-Cursor>.
     """
-    query = request.GET.get('q', '')
+    query = request.GET.get('q', '').strip()
     date_str = request.GET.get('date', '')
     show_deleted = request.GET.get('show_deleted', 'off') == 'on'
     
+    from roster import search
     from roster.models import WorkplaceScreenshot
-    from django.db.models import Q, Value
-    from django.db.models.functions import Concat, TruncDate
+    from django.db.models import Value
+    from django.db.models.functions import Concat
 
-    qs = WorkplaceScreenshot.objects.annotate(
-        full_name=Concat('user__last_name', Value(' '), 'user__first_name'),
-        full_name_rev=Concat('user__first_name', Value(' '), 'user__last_name')
-    )
+    try:
+        limit = min(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), SCREENSHOT_PAGE_SIZE_MAX)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': 'limit must be positive'}, status=400)
 
-    if query:
-        qs = qs.filter(
-            Q(os_username__icontains=query) |
-            Q(user__first_name__icontains=query) |
-            Q(user__last_name__icontains=query) |
-            Q(user__username__icontains=query) |
-            Q(full_name__icontains=query) |
-            Q(full_name_rev__icontains=query) |
-            Q(window_titles__icontains=query)
-        )
-    
+    cursor = None
+    if request.GET.get('before'):
+        cursor = _decode_cursor(request.GET['before'])
+        if cursor is None or len(cursor) != 2:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    day_start = day_end = None
     if date_str:
         try:
             target_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-            qs = qs.annotate(c_date=TruncDate('created_at')).filter(c_date=target_date)
+            day_start = timezone.make_aware(datetime.datetime.combine(target_date, datetime.time.min))
+            day_end = day_start + datetime.timedelta(days=1)
         except ValueError:
             pass
 
-    if not show_deleted:
-        qs = qs.filter(image_deleted=False)
-
-    if not query and not date_str and not show_deleted:
+    if not query and not day_start and not show_deleted:
         return JsonResponse([], safe=False)
 
-    screenshots = qs.select_related('user', 'workplace').order_by('-created_at')[:100]
+    try:
+        result = search.search(query, day_start, day_end, show_deleted, limit, cursor) if query else None
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    if result is not None:
+        ids, total, next_cursor = result
+    else:
+        # No text query, or no full-text index on this backend
+        qs = WorkplaceScreenshot.objects.all()
+        if query:
+            qs = qs.annotate(
+                full_name=Concat('user__last_name', Value(' '), 'user__first_name'),
+                full_name_rev=Concat('user__first_name', Value(' '), 'user__last_name')
+            ).filter(
+                Q(os_username__icontains=query) |
+                Q(user__first_name__icontains=query) |
+                Q(user__last_name__icontains=query) |
+                Q(user__username__icontains=query) |
+                Q(full_name__icontains=query) |
+                Q(full_name_rev__icontains=query) |
+                Q(window_titles__icontains=query)
+            )
+        if day_start:
+            qs = qs.filter(created_at__gte=day_start, created_at__lt=day_end)
+        if not show_deleted:
+            qs = qs.filter(image_deleted=False)
+
+        total = None if cursor else qs.count()
+        if cursor:
+            try:
+                created_at = datetime.datetime.fromisoformat(cursor[0])
+            except (ValueError, TypeError):
+                return JsonResponse({'error': 'Invalid cursor'}, status=400)
+            qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=cursor[1]))
+        page = list(qs.order_by('-created_at', '-id').values_list('id', 'created_at')[:limit + 1])
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = [page[-1][1].isoformat(), page[-1][0]]
+        ids = [shot_id for shot_id, _ in page]
+        if page:
+            # Lets PostgreSQL read only the partitions the page falls into
+            day_start, day_end = page[-1][1], page[0][1] + datetime.timedelta(microseconds=1)
+
+    rows = WorkplaceScreenshot.objects.filter(id__in=ids)
+    if day_start:
+        rows = rows.filter(created_at__gte=day_start, created_at__lt=day_end)
+    rows = rows.values(
+        'id', 'screenshot_filename', 'created_at', 'user__first_name', 'user__last_name',
+        'os_username', 'reported_workplace', 'workplace__workplace_number', 'window_titles', 'image_deleted',
+    )
+    by_id = {row['id']: row for row in rows}
 
     data = []
-    for s in screenshots:
+    for shot_id in ids:
+        s = by_id.get(shot_id)
+        if s is None:
+            continue
         user_name = None
-        if s.user:
-            user_name = f"{s.user.last_name} {s.user.first_name}"
+        if s['user__last_name'] is not None:
+            user_name = f"{s['user__last_name']} {s['user__first_name']}"
             
         data.append({
-            'filename': s.screenshot_filename,
-            'created_at': s.created_at.isoformat(),
+            'filename': s['screenshot_filename'],
+            'created_at': s['created_at'].isoformat(),
             'user_name': user_name,
-            'os_username': s.os_username,
-            'reported_workplace': s.reported_workplace,
-            'workplace_number': s.workplace.workplace_number,
-            'window_titles': s.window_titles,
-            'image_deleted': s.image_deleted
+            'os_username': s['os_username'],
+            'reported_workplace': s['reported_workplace'],
+            'workplace_number': s['workplace__workplace_number'],
+            'window_titles': s['window_titles'],
+            'image_deleted': s['image_deleted']
         })
 
-    return JsonResponse(data, safe=False)
+    response = _paginated_response(request, data, next_cursor and _encode_cursor(*next_cursor), None)
+    if total is not None:
+        response['X-Total-Count'] = str(total)
+    return response
+
+
+@require_http_methods(["GET"])
+def metrics_329(request):
+    """
+    GET /api/classrooms/329/metrics/
+    Returns internal counters: background worker queue depth and lag, thumbnail cache hit rate,
+    database write lock wait and write batching, storage transcoding savings, skipped repeated frames
+    """
+    return JsonResponse({
+        'background_tasks': tasks.stats(),
+        'database': db.stats(),
+        'thumbnails': thumbnails.stats(),
+        'transcoding': transcode.stats(),
+        'dedupe': dedupe.stats(),
+        'segments': segments.stats(),
+    })
+
+
+async def classroom_events_329(request):
+    """
+    GET /api/classrooms/329/events/
+    Server-Sent Events stream of placement, screenshot and classroom-setting changes.
+    Reconnects resume after the Last-Event-ID header (or ?last_event_id=).
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    from django.http import HttpResponseNotAllowed, StreamingHttpResponse
+
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    raw_last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(raw_last_id) if raw_last_id else None
+    except ValueError:
+        last_id = None
+
+    if isinstance(request, ASGIRequest):
+        stream = _event_stream_async(last_id)
+    else:
+        # Under WSGI (e.g. runserver) an async iterator would be buffered to the end
+        stream = _event_stream_sync(last_id)
+
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _event_stream_start(last_id):
+    """Opening lines of a stream; returns (text, last_id)"""
+    text = f"retry: {settings.CLASSROOM_EVENTS_RETRY_MS}\n\n"
+    if last_id is None:
+        last_id = events.latest_event_id()
+        text += f"id: {last_id}\nevent: hello\ndata: {{}}\n\n"
+    elif not events.is_resumable(last_id):
+        # Missed events were pruned: tell the client to reload its full state
+        last_id = events.latest_event_id()
+        text += f"id: {last_id}\nevent: reset\ndata: {{}}\n\n"
+    return text, last_id
+
+
+def _event_stream_poll(last_id):
+    """Formatted events after last_id; returns (text, last_id)"""
+    text = ''
+    for event in events.events_since(last_id):
+        text += events.format_sse(event)
+        last_id = event.id
+    return text, last_id
+
+
+async def _event_stream_async(last_id):
+    text, last_id = await sync_to_async(_event_stream_start)(last_id)
+    yield text
+
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < settings.CLASSROOM_EVENTS_STREAM_LIFETIME:
+        await asyncio.sleep(settings.CLASSROOM_EVENTS_POLL_INTERVAL)
+        text, last_id = await sync_to_async(_event_stream_poll)(last_id)
+        if not text and time.monotonic() - last_sent > settings.CLASSROOM_EVENTS_KEEPALIVE:
+            text = ": keepalive\n\n"
+        if text:
+            last_sent = time.monotonic()
+            yield text
+
+
+def _event_stream_sync(last_id):
+    from django.db import close_old_connections
+
+    text, last_id = _event_stream_start(last_id)
+    yield text
+
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < settings.CLASSROOM_EVENTS_STREAM_LIFETIME:
+        time.sleep(settings.CLASSROOM_EVENTS_POLL_INTERVAL)
+        text, last_id = _event_stream_poll(last_id)
+        close_old_connections()
+        if not text and time.monotonic() - last_sent > settings.CLASSROOM_EVENTS_KEEPALIVE:
+            text = ": keepalive\n\n"
+        if text:
+            last_sent = time.monotonic()
+            yield text
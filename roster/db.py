@@ -0,0 +1,245 @@
+"""
+SQLite tuning for many concurrent writers.
+
+With DB_PROFILE = 'concurrent' (env ROSTER_DB_PROFILE) every new connection
+switches the database to WAL journaling with a busy timeout, so readers never
+block writers and a writer waits for the lock instead of failing with
+"database is locked". Hot-path inserts (screenshot uploads, login placements)
+go through a WriteCoalescer: a single writer thread that commits whatever
+accumulated within DB_WRITE_BATCH_WAIT in one transaction, so a burst of N
+writes costs one lock acquisition and one fsync instead of N. write() returns
+only once its batch is committed, with the write's result or its error, so
+the request that made it answers after its row exists.
+
+Write statements are timed on every SQLite connection; the time spent in them
+is dominated by waiting for the write lock and is exposed by stats().
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.utils import OperationalError
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+CONCURRENT_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    # WAL is durable across application crashes with NORMAL; only an OS crash can lose the last commits
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=134217728',
+]
+# Write statements slower than this are counted as having waited for the lock
+SLOW_WRITE_SECONDS = 0.05
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class WriteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.slow_writes = 0
+        self.lock_errors = 0
+
+    def record(self, duration, locked=False):
+        with self._lock:
+            self.writes += 1
+            self.write_seconds += duration
+            self.max_write_seconds = max(self.max_write_seconds, duration)
+            if duration > SLOW_WRITE_SECONDS:
+                self.slow_writes += 1
+            if locked:
+                self.lock_errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'writes': self.writes,
+                'write_seconds_total': round(self.write_seconds, 3),
+                'write_seconds_max': round(self.max_write_seconds, 3),
+                'slow_writes': self.slow_writes,
+                'lock_errors': self.lock_errors,
+            }
+
+
+write_stats = WriteStats()
+
+
+def _timed_execute(execute, sql, params, many, context):
+    if not sql.lstrip()[:7].upper().startswith(WRITE_PREFIXES):
+        return execute(sql, params, many, context)
+    started = time.monotonic()
+    locked = False
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError as e:
+        locked = 'locked' in str(e)
+        raise
+    finally:
+        write_stats.record(time.monotonic() - started, locked)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    if settings.DB_PROFILE == 'concurrent':
+        with connection.cursor() as cursor:
+            for pragma in CONCURRENT_PRAGMAS:
+                cursor.execute(pragma)
+            cursor.execute(f'PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT * 1000)}')
+    if _timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_timed_execute)
+
+
+class WriteCoalescer:
+    """Single writer thread committing queued writes in batched transactions"""
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.submitted = 0
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) in the next batch. Returns a Future resolved
+        with its result once the batch is committed, or with the exception that
+        kept it from being stored. Without DB_WRITE_COALESCING (and for writes
+        made by queued writes) it runs right away in the calling thread.
+        """
+        future = Future()
+        if not settings.DB_WRITE_COALESCING or getattr(self._local, 'callbacks', None) is not None:
+            self.submitted += 1
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self._lock:
+            self.submitted += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def on_commit(self, func):
+        """Call func once the current batch is committed (immediately outside a batch)"""
+        callbacks = getattr(self._local, 'callbacks', None)
+        if callbacks is None:
+            func()
+        else:
+            callbacks.append(func)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'submitted': self.submitted,
+            'batches': self.batches,
+            'written': self.written,
+            'errors': self.errors,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+        }
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + settings.DB_WRITE_BATCH_WAIT
+            while len(batch) < settings.DB_WRITE_BATCH_SIZE:
+                # Whatever is already queued always joins; then wait until the deadline
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            close_old_connections()
+            try:
+                self.commit(batch)
+            finally:
+                close_old_connections()
+
+    def commit(self, batch):
+        """
+        Write a batch in one transaction; a failing item is rolled back alone.
+        Items are (func, args, kwargs[, future]); futures are resolved after the commit.
+        """
+        self._local.callbacks = []
+        written = 0
+        outcomes = []
+        try:
+            with transaction.atomic():
+                for func, args, kwargs, *_ in batch:
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((True, func(*args, **kwargs)))
+                        written += 1
+                    except Exception as e:
+                        self.errors += 1
+                        outcomes.append((False, e))
+                        logger.exception(f"Queued write {getattr(func, '__name__', func)} failed")
+        except Exception as e:
+            # The commit itself failed: nothing of this batch was stored
+            self.errors += written
+            written = 0
+            outcomes = [(False, e)] * len(batch)
+            logger.exception(f"Batch of {len(batch)} writes could not be committed")
+            self._local.callbacks = []
+        finally:
+            callbacks, self._local.callbacks = self._local.callbacks, None
+
+        self.batches += 1
+        self.written += written
+        self.last_batch_size = len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception("After-commit callback failed")
+        for (_, _, _, *future), (ok, value) in zip(batch, outcomes):
+            if future:
+                if ok:
+                    future[0].set_result(value)
+                else:
+                    future[0].set_exception(value)
+
+
+writer = WriteCoalescer('roster-db-writer')
+
+
+def write(func, *args, **kwargs):
+    """Run a write through the shared writer and wait until it is committed; re-raises its error"""
+    return writer.submit(func, *args, **kwargs).result()
+
+
+def on_commit(func):
+    writer.on_commit(func)
+
+
+def stats():
+    return {
+        'profile': settings.DB_PROFILE,
+        'coalescing': settings.DB_WRITE_COALESCING,
+        'lock_wait': write_stats.stats(),
+        'writer': writer.stats(),
+    }
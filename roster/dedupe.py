@@ -0,0 +1,107 @@
+"""
+Change detection for uploaded frames.
+
+An idle desktop uploads the same picture every interval, and a locked screen or
+screensaver uploads near-uniform ones. Each frame gets a fingerprint before it
+is written: a 64-bit digest of its decoded pixels, and the mean and standard
+deviation of a 64x36 grayscale reduction, computed with NumPy. A frame is not
+stored when its pixels, window titles, OS user and resolved student all match
+the workplace's latest frame; that frame's last_seen_at and repeat_count are
+bumped instead. A perceptual hash is not used: a few more lines in an editor
+move it by a bit or two, and those frames must be kept. Blank frames (standard
+deviation below SCREENSHOT_BLANK_MAX_STDDEV) all get the digest 0, so a run of
+them is stored once.
+
+Skipped frames and bytes are counted per process (stats()) and per day in
+ScreenshotDayRollup.
+"""
+import hashlib
+import threading
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+
+STATS_SIZE = (64, 36)
+# A repeat publishes a dashboard event every this many frames, so idle workplaces don't look stale
+REPEAT_EVENT_EVERY = 5
+
+Fingerprint = namedtuple('Fingerprint', ['hash', 'mean', 'stddev', 'blank'])
+
+
+def _to_signed(value):
+    """64-bit digest as a signed integer, so it fits a BigIntegerField"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fingerprint(file):
+    """Fingerprint of an image file (path or file object); None if it cannot be decoded"""
+    from PIL import Image
+
+    try:
+        with Image.open(file) as img:
+            img.load()
+            digest = hashlib.blake2b(f'{img.mode} {img.size}'.encode(), digest_size=8)
+            digest.update(img.tobytes())
+            gray = img.convert('L')
+    except Exception:
+        return None
+    finally:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+    small = np.asarray(gray.resize(STATS_SIZE, Image.Resampling.BOX), dtype=np.float32)
+    mean, stddev = float(small.mean()), float(small.std())
+    if stddev < settings.SCREENSHOT_BLANK_MAX_STDDEV:
+        return Fingerprint(0, mean, stddev, True)
+    return Fingerprint(_to_signed(int.from_bytes(digest.digest(), 'big')), mean, stddev, False)
+
+
+def is_repeat(fp, previous, os_username, user_id, window_titles):
+    """
+    True if a frame with fingerprint fp, uploaded by os_username for user_id
+    with window_titles, adds nothing over the stored frame previous
+    """
+    if fp is None or previous is None or previous.frame_hash is None or previous.image_deleted:
+        return False
+    return (
+        fp.hash == previous.frame_hash
+        and previous.os_username == os_username
+        and previous.user_id == user_id
+        and (previous.window_titles or []) == (window_titles or [])
+    )
+
+
+class DedupeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+        self.blank = 0
+        self.bytes_saved = 0
+
+    def record(self, fp, skipped, size):
+        with self._lock:
+            self.checked += 1
+            if fp is not None and fp.blank:
+                self.blank += 1
+            if skipped:
+                self.skipped += 1
+                self.bytes_saved += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'skipped': self.skipped,
+                'blank': self.blank,
+                'bytes_saved': self.bytes_saved,
+                'skip_rate': round(self.skipped / self.checked, 3) if self.checked else None,
+            }
+
+
+dedupe_stats = DedupeStats()
+
+
+def stats():
+    return dedupe_stats.stats()
@@ -0,0 +1,72 @@
+"""
+Change feed for the classroom dashboard.
+
+Placements, screenshots and classroom settings publish a ClassroomEvent when
+they change (see roster.signals). The dashboard follows the feed over
+Server-Sent Events and refetches only when something happened; the event id is
+the SSE id, so a reconnect resumes from Last-Event-ID instead of reloading.
+"""
+import datetime
+import json
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from roster.models import ClassroomEvent
+
+CLASSROOM_ID = '329'
+
+_last_prune = 0.0
+
+
+def publish(kind, workplace_number=None, payload=None, classroom_id=CLASSROOM_ID):
+    event = ClassroomEvent.objects.create(
+        classroom_id=classroom_id,
+        kind=kind,
+        workplace_number=workplace_number,
+        payload=payload or {},
+    )
+    _prune_if_due()
+    return event
+
+
+def latest_event_id(classroom_id=CLASSROOM_ID):
+    return ClassroomEvent.objects.filter(classroom_id=classroom_id).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def oldest_event_id(classroom_id=CLASSROOM_ID):
+    return ClassroomEvent.objects.filter(classroom_id=classroom_id).order_by('id').values_list('id', flat=True).first()
+
+
+def events_since(last_id, classroom_id=CLASSROOM_ID, limit=500):
+    return list(ClassroomEvent.objects.filter(classroom_id=classroom_id, id__gt=last_id).order_by('id')[:limit])
+
+
+def is_resumable(last_id, classroom_id=CLASSROOM_ID):
+    """False if events after last_id were already pruned and the client has to reload"""
+    oldest = oldest_event_id(classroom_id)
+    return oldest is None or last_id >= oldest - 1
+
+
+def format_sse(event):
+    data = {
+        'workplace_number': event.workplace_number,
+        'created_at': event.created_at.isoformat(),
+        **event.payload,
+    }
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {json.dumps(data)}\n\n"
+
+
+def prune():
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.CLASSROOM_EVENTS_RETENTION)
+    ClassroomEvent.objects.filter(created_at__lt=cutoff).delete()
+
+
+def _prune_if_due():
+    """Drop expired events at most once an hour per process"""
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune > 3600:
+        _last_prune = now
+        prune()
@@ -1,46 +1,60 @@
 import re
 import datetime
+import threading
+import time
+from collections import Counter, defaultdict
+
 from django.conf import settings
-from roster.models import WorkplaceUserPlacement
-
-def current_lesson(now):
-    # This function was in views.py, we might need to duplicate it or import it if it's utility.
-    # For now, I'll duplicate the simple logic or better, import it if possible, but circular imports might be an issue.
-    # Let's just reimplement the simple logic here or pass the lesson index.
-    # Actually, let's look at views.py again. `current_lesson` depends on settings.
-    last = 0
-    for lesson, times in settings.LESSONS_SCHEDULE.items():
-        if now.time() >= times['start']:
-            last = lesson
-    return last
+from django.utils import timezone
 
-def check_group_constraints(user, workplace_id):
-    """
-    Check if the user is allowed to sit at the given workplace based on group features.
-    Returns (allowed: bool, error_message: str).
-    """
-    # Extract workplace number
-    try:
-        match = re.search(r'-(\d+)', workplace_id)
-        if not match:
-            return True, None
-        current_number = int(match.group(1))
-    except (TypeError, ValueError):
-        return True, None
+from roster.models import WorkplaceUserPlacement, StudentGroup, StudentGroupFeature, parse_workplace_id, lesson_index_at
+
+# Seats of classroom 329 that students can be placed at
+SEAT_NUMBERS = range(1, 19)
+
+# Cached group constraints are reloaded after this many seconds, so changes made
+# in other processes are picked up; changes in this process drop the cache at once.
+CONSTRAINTS_TTL = 60
+# Likewise for the cached occupancy; placements made in this process update it at once
+OCCUPANCY_TTL = 30
+
+
+def seat_number(workplace_id):
+    return parse_workplace_id(workplace_id)[1]
+
+
+def seats_mask(numbers):
+    mask = 0
+    for n in numbers:
+        mask |= 1 << n
+    return mask
+
+
+def mask_seats(mask):
+    return [n for n in SEAT_NUMBERS if mask >> n & 1]
+
+
+def dilate(mask, distance):
+    """Seats within distance of any seat in mask"""
+    result = mask
+    for k in range(1, distance + 1):
+        result |= (mask << k) | (mask >> k)
+    return result
+
+
+ALL_SEATS = seats_mask(SEAT_NUMBERS)
+
+
+def lesson_window(now):
+    """Time range whose placements count as the current lesson's seating"""
+    current_lesson_idx = lesson_index_at(now.time())
 
-    # Get user's groups with features
-    user_groups = user.student_groups.all().prefetch_related('features')
-    
-    # Determine current time window
-    now = datetime.datetime.now()
-    current_lesson_idx = current_lesson(now)
-    
     if current_lesson_idx == 0:
         start_time = now - datetime.timedelta(hours=2)
         end_time = now + datetime.timedelta(hours=2)
     else:
         try:
-            today = datetime.date.today()
+            today = now.date()
             lesson_data = settings.LESSONS_SCHEDULE.get(current_lesson_idx)
             if lesson_data:
                 start_time = datetime.datetime.combine(today, lesson_data['start']) - datetime.timedelta(minutes=15)
@@ -52,52 +66,180 @@ def check_group_constraints(user, workplace_id):
             start_time = now - datetime.timedelta(hours=1.5)
             end_time = now + datetime.timedelta(hours=1.5)
 
-    # Get all placements in this time window to find occupied computers
-    all_placements = WorkplaceUserPlacement.objects.filter(
-        created_at__gte=start_time,
-        created_at__lte=end_time
-    )
-    
-    occupied_computers = set()
-    for p in all_placements:
-        try:
-            match = re.search(r'-(\d+)', p.workplace_id)
-            if match:
-                occupied_computers.add(int(match.group(1)))
-        except (TypeError, ValueError):
-            continue
-
-    forbidden_computers = set()
-    
-    for group in user_groups:
-        # Check for non_sequential feature
-        feature = group.features.filter(feature_key='non_sequential', enabled=True).first()
-        if feature:
-            # Get placements of other students in this group
-            group_student_ids = group.students.exclude(id=user.id).values_list('id', flat=True)
-            
-            # Filter placements for this group's students from the already fetched placements
-            # This avoids an extra query, though we could also query if needed.
-            # Let's just filter in python since we have all_placements
-            group_placements = [p for p in all_placements if p.user_id in group_student_ids]
-
-            min_distance = feature.parameters.get('min_distance', 1)
-
-            for p in group_placements:
-                try:
-                    match = re.search(r'-(\d+)', p.workplace_id)
-                    if match:
-                        other_number = int(match.group(1))
-                        # Mark computers around this one as forbidden
-                        for i in range(other_number - min_distance, other_number + min_distance + 1):
-                            forbidden_computers.add(i)
-                except (TypeError, ValueError):
-                    continue
-
-    if current_number in forbidden_computers:
+    if settings.USE_TZ:
+        start_time, end_time = timezone.make_aware(start_time), timezone.make_aware(end_time)
+    return start_time, end_time
+
+
+class GroupConstraint:
+    """A non_sequential group feature: members keep min_distance seats apart"""
+
+    def __init__(self, group_id, min_distance, members):
+        self.group_id = group_id
+        self.min_distance = min_distance
+        self.members = members
+
+
+class ConstraintSet:
+    """All enabled seating constraints, indexed by student"""
+
+    def __init__(self, constraints):
+        self.groups = {c.group_id: c for c in constraints}
+        self.by_user = defaultdict(list)
+        for constraint in constraints:
+            for user_id in constraint.members:
+                self.by_user[user_id].append(constraint)
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls):
+        features = StudentGroupFeature.objects.filter(feature_key='non_sequential', enabled=True)
+        distances = {group_id: (parameters or {}).get('min_distance', 1) for group_id, parameters in features.values_list('group_id', 'parameters')}
+
+        members = defaultdict(set)
+        through = StudentGroup.students.through.objects.filter(studentgroup_id__in=distances)
+        for group_id, user_id in through.values_list('studentgroup_id', 'user_id'):
+            members[group_id].add(user_id)
+
+        return cls([GroupConstraint(group_id, distance, frozenset(members[group_id])) for group_id, distance in distances.items()])
+
+
+class LessonOccupancy:
+    """
+    Seats taken during one lesson window, as bitsets (bit n = seat n).
+
+    Loaded once per lesson and then kept up to date by roster.signals:
+    placements saved in this process are added, a deleted or changed one
+    drops the cache. Checks against it run no query. It is reloaded after
+    OCCUPANCY_TTL seconds to pick up placements made by other processes (and,
+    outside lessons, placements leaving the window that moves with the clock).
+    """
+
+    def __init__(self, key, window):
+        self.key = key
+        self.window = window
+        self.loaded_at = time.monotonic()
+        self.occupied = 0
+        self.max_id = 0
+        self.user_seats = defaultdict(Counter)
+        # group id -> Counter of seats taken by its members, built on first use
+        self.group_seats = {}
+        self.constraints = None
+        self._lock = threading.Lock()
+
+    def add(self, placement_id, user_id, seat):
+        with self._lock:
+            self.max_id = max(self.max_id, placement_id)
+            if seat is None:
+                return
+            self.occupied |= 1 << seat
+            self.user_seats[user_id][seat] += 1
+            if self.constraints is not None:
+                for constraint in self.constraints.by_user.get(user_id, ()):
+                    if constraint.group_id in self.group_seats:
+                        self.group_seats[constraint.group_id][seat] += 1
+
+    def load(self, placements):
+        for placement_id, user_id, seat in placements.values_list('id', 'user_id', 'workplace_number').order_by('id'):
+            self.add(placement_id, user_id, seat)
+
+    def forbidden_for(self, user_id, constraints):
+        """Seats the user may not take because of the groups they belong to"""
+        with self._lock:
+            if self.constraints is not constraints:
+                self.constraints = constraints
+                self.group_seats = {}
+
+            own = self.user_seats.get(user_id, {})
+            forbidden = 0
+            for constraint in constraints.by_user.get(user_id, ()):
+                seats = self.group_seats.get(constraint.group_id)
+                if seats is None:
+                    seats = Counter()
+                    for member in constraint.members:
+                        seats.update(self.user_seats.get(member, {}))
+                    self.group_seats[constraint.group_id] = seats
+
+                # Seats of other members only: the user's own placements don't count
+                taken = 0
+                for seat, n in seats.items():
+                    if n > own.get(seat, 0):
+                        taken |= 1 << seat
+                forbidden |= dilate(taken, constraint.min_distance)
+            return forbidden
+
+
+_lock = threading.Lock()
+_constraints = None
+_occupancy = None
+
+
+def get_constraints():
+    global _constraints
+    with _lock:
+        if _constraints is None or time.monotonic() - _constraints.loaded_at > CONSTRAINTS_TTL:
+            _constraints = ConstraintSet.load()
+        return _constraints
+
+
+def get_occupancy(now=None):
+    """Occupancy of the current lesson window; loaded on a new lesson or after OCCUPANCY_TTL"""
+    global _occupancy
+    now = now or datetime.datetime.now()
+    key = (now.date(), lesson_index_at(now.time()))
+
+    with _lock:
+        occupancy = _occupancy
+        if occupancy is None or occupancy.key != key or time.monotonic() - occupancy.loaded_at > OCCUPANCY_TTL:
+            window = lesson_window(now)
+            occupancy = LessonOccupancy(key, window)
+            occupancy.load(WorkplaceUserPlacement.objects.filter(created_at__gte=window[0], created_at__lte=window[1]))
+            _occupancy = occupancy
+        return occupancy
+
+
+def placement_saved(placement, created):
+    """Keep the cached occupancy in step with placements made in this process"""
+    global _occupancy
+    with _lock:
+        occupancy = _occupancy
+        if occupancy is None:
+            return
+        if created and occupancy.window[0] <= placement.created_at <= occupancy.window[1] and placement.id > occupancy.max_id:
+            occupancy.add(placement.id, placement.user_id, placement.workplace_number)
+        else:
+            _occupancy = None
+
+
+def invalidate_occupancy():
+    global _occupancy
+    _occupancy = None
+
+
+def invalidate_constraints():
+    global _constraints
+    _constraints = None
+
+
+def check_group_constraints(user, workplace_id):
+    """
+    Check if the user is allowed to sit at the given workplace based on group features.
+    Returns (allowed: bool, error_message: str).
+    """
+    current_number = seat_number(workplace_id)
+    if current_number is None:
+        return True, None
+
+    constraints = get_constraints()
+    if not constraints.by_user.get(user.id):
+        return True, None
+
+    occupancy = get_occupancy()
+    forbidden = occupancy.forbidden_for(user.id, constraints)
+
+    if forbidden >> current_number & 1:
         # Calculate available computers
-        all_computers = set(range(1, 19)) # Assuming 1-18 based on views.py
-        available = sorted(list(all_computers - occupied_computers - forbidden_computers))
+        available = mask_seats(ALL_SEATS & ~occupancy.occupied & ~forbidden)
         available_str = ", ".join(map(str, available))
         
         return False, f"Щоб зберегти робочий темп уроку, деякі комбінації посадки тимчасово недоступні. Ось доступні варіанти для вас: {available_str}"
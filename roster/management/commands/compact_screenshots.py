@@ -0,0 +1,63 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from roster import segments, storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Pack the frames of each workplace day older than SCREENSHOT_SEGMENT_AFTER_DAYS into "
+        "one segment file with an offset index. Safe to interrupt and re-run; run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=settings.SCREENSHOT_SEGMENT_AFTER_DAYS,
+            help="Only pack days at least this old",
+        )
+        parser.add_argument('--workplace', action='append', help="Only pack this workplace directory")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the days that would be packed")
+        parser.add_argument(
+            '--measure', action='store_true',
+            help="Report files, bytes and the time of a full walk of SCREENSHOTS_ROOT before and after",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = datetime.date.today() - datetime.timedelta(days=options['older_than_days'])
+        base = os.path.join(storage.root(), storage.CLASSROOM)
+        try:
+            workplaces = options['workplace'] or sorted(os.listdir(base))
+        except FileNotFoundError:
+            workplaces = []
+
+        if options['measure']:
+            before = segments.tree_stats()
+            self.stdout.write(self._format_stats("Before", before))
+
+        days = frames = size = 0
+        for workplace_dir in workplaces:
+            for day, day_dir in storage.day_dirs(workplace_dir):
+                if day >= cutoff or not os.path.isdir(day_dir):
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(f"Would pack {day_dir}")
+                    continue
+                packed, packed_bytes = segments.compact_day(day_dir)
+                if packed:
+                    days += 1
+                    frames += packed
+                    size += packed_bytes
+                    self.stdout.write(f"{workplace_dir} {day}: packed {packed} frames ({packed_bytes} bytes)")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Packed {frames} frames ({size} bytes) from {days} days"))
+        if options['measure']:
+            after = segments.tree_stats()
+            self.stdout.write(self._format_stats("After", after))
+            self.stdout.write(f"Files: {before['files'] - after['files']} fewer")
+
+    def _format_stats(self, label, stats):
+        return f"{label}: {stats['files']} files, {stats['bytes']} bytes, full walk {stats['walk_seconds']}s"
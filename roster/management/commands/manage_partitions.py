@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from roster import partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create monthly partitions of the screenshot and placement tables for the coming months "
+        "and detach (optionally archive) expired ones. PostgreSQL only; run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.PARTITION_MONTHS_AHEAD,
+            help="Partitions to create beyond the current month",
+        )
+        parser.add_argument(
+            '--retain-months', type=int, default=settings.PARTITION_RETAIN_MONTHS,
+            help="Detach monthly partitions older than this many months (default: keep all)",
+        )
+        parser.add_argument(
+            '--archive', action='store_true',
+            help="Dump detached partitions to gzipped CSV in --archive-dir and drop them",
+        )
+        parser.add_argument('--archive-dir', default=str(settings.PARTITION_ARCHIVE_ROOT))
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would change")
+
+    def handle(self, *args, **options):
+        if not partitions.is_supported(connection):
+            self.stdout.write(f"Partitioning is only used on PostgreSQL (database is {connection.vendor}), nothing to do")
+            return
+
+        with connection.cursor() as cursor:
+            for table in partitions.PARTITIONED_TABLES:
+                if not partitions.is_partitioned(cursor, table):
+                    self.stderr.write(f"{table} is not partitioned, run migrations first")
+                    continue
+
+                if options['dry_run']:
+                    for month in partitions.missing_months(cursor, table, options['months_ahead']):
+                        self.stdout.write(f"Would create {partitions.partition_name(table, month)}")
+                else:
+                    for name in partitions.ensure_partitions(cursor, table, options['months_ahead']):
+                        self.stdout.write(self.style.SUCCESS(f"Created {name}"))
+
+                if options['retain_months'] is None:
+                    continue
+                for name in partitions.expired_partitions(cursor, table, options['retain_months']):
+                    if options['dry_run']:
+                        self.stdout.write(f"Would detach {name}")
+                        continue
+                    partitions.detach_partition(cursor, table, name)
+                    self.stdout.write(self.style.SUCCESS(f"Detached {name}"))
+                    if options['archive']:
+                        path = partitions.archive_partition(cursor, name, options['archive_dir'])
+                        self.stdout.write(self.style.SUCCESS(f"Archived {name} to {path}"))
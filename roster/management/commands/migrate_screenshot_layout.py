@@ -0,0 +1,69 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from roster import storage, transcode
+
+
+class Command(BaseCommand):
+    help = (
+        "Move screenshot frames from the flat <workplace>/ directories into the "
+        "<classroom>/<workplace>/YYYY/MM/DD/ layout, in batches, while the server keeps running. "
+        "Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Frames moved between pauses")
+        parser.add_argument('--pause', type=float, default=0.5, help="Seconds to sleep between batches")
+        parser.add_argument(
+            '--min-age', type=float, default=60,
+            help="Leave frames modified less than this many seconds ago for the next run",
+        )
+        parser.add_argument('--workplace', action='append', help="Only migrate this workplace directory")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the frames that would move")
+
+    def handle(self, *args, **options):
+        workplaces = options['workplace'] or storage.legacy_workplaces()
+        verb = "Would move" if options['dry_run'] else "Moved"
+        total = skipped = 0
+        in_batch = 0
+
+        for workplace_dir in workplaces:
+            flat = storage.legacy_dir(workplace_dir)
+            try:
+                names = sorted(name for name in os.listdir(flat) if transcode.is_frame(name))
+            except FileNotFoundError:
+                continue
+
+            moved = 0
+            for name in names:
+                if storage.frame_date(name) is None:
+                    skipped += 1
+                    continue
+                try:
+                    # Frames being written or transcoded right now are left alone
+                    if time.time() - os.path.getmtime(os.path.join(flat, name)) < options['min_age']:
+                        skipped += 1
+                        continue
+                except FileNotFoundError:
+                    continue
+                if options['dry_run']:
+                    moved += 1
+                    continue
+                if storage.migrate_frame(workplace_dir, name):
+                    moved += 1
+                    in_batch += 1
+                    if in_batch >= options['batch_size']:
+                        in_batch = 0
+                        time.sleep(options['pause'])
+
+            total += moved
+            self.stdout.write(f"{workplace_dir}: {verb.lower()} {moved} of {len(names)} frames")
+            if not options['dry_run']:
+                try:
+                    os.rmdir(flat)
+                except OSError:
+                    pass  # Not empty: undated or recent frames stay for now
+
+        self.stdout.write(self.style.SUCCESS(f"{verb} {total} frames, left {skipped} in place"))
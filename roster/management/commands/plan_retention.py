@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from roster import budget, storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Thin screenshot days that aged into a coarser retention tier and, when a classroom or the "
+        "disk is over its budget, the oldest days further. Run daily; --dry-run only reports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classroom', default=storage.CLASSROOM)
+        parser.add_argument(
+            '--dry-run', action='store_true', help="Report projected bytes freed and frames affected, change nothing"
+        )
+
+    def handle(self, *args, **options):
+        plan = budget.plan(options['classroom'])
+        budget_text = f"{plan.budget} bytes" if plan.budget is not None else "no classroom budget"
+        self.stdout.write(
+            f"Classroom {plan.classroom_id}: {plan.usage} bytes stored, {budget_text}, "
+            f"{max(plan.target_bytes, 0)} bytes to free"
+        )
+        for action in plan.actions:
+            if action.frames:
+                self.stdout.write(
+                    f"  W-{action.workplace_id} {action.date}: tier {action.tier} ({action.reason}), "
+                    f"{action.frames} frames, {action.bytes} bytes"
+                )
+
+        totals = budget.totals(plan) if options['dry_run'] else budget.apply(plan)
+        verb = "Would free" if options['dry_run'] else "Freed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {totals['bytes']} bytes in {totals['frames']} frames"))
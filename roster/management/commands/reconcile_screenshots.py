@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from roster import reconcile
+from roster.models import Workplace
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcile stored screenshot files with WorkplaceScreenshot rows: create rows for files that "
+        "have none (timestamps from the file names), mark rows whose file is gone as image_deleted "
+        "and report files left behind for deleted rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help="Directories scanned in parallel")
+        parser.add_argument('--workplace', action='append', help="Only this workplace directory")
+        parser.add_argument('--remove-stray', action='store_true', help="Delete files whose rows are image_deleted")
+        parser.add_argument(
+            '--grace', type=int, default=reconcile.GRACE_SECONDS,
+            help="Skip files and rows younger than this many seconds at the start of the scan",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Only report the differences")
+
+    def handle(self, *args, **options):
+        dirs = options['workplace'] or sorted(
+            set(reconcile.workplace_dirs()) | {str(n) for n in Workplace.objects.values_list('workplace_number', flat=True)}
+        )
+        cutoff = time.time() - options['grace']
+        scanned = reconcile.scan_all(dirs, options['workers'])
+        totals = {'files': 0, 'imported': 0, 'missing': 0, 'stray': 0}
+
+        for workplace_dir in dirs:
+            frames = scanned[workplace_dir]
+            number = reconcile.workplace_number(workplace_dir)
+            if number is None:
+                self.stdout.write(f"{workplace_dir}: {len(frames)} files, not a workplace, skipped")
+                continue
+
+            workplace = Workplace.objects.filter(workplace_number=number).first()
+            orphans, missing, stray = reconcile.compare(workplace, frames, cutoff)
+            totals['files'] += len(frames)
+            self.stdout.write(
+                f"{workplace_dir}: {len(frames)} files, {len(orphans)} without a row, "
+                f"{len(missing)} rows without a file, {len(stray)} stray files"
+            )
+            if options['dry_run']:
+                totals['imported'] += len(orphans)
+                totals['missing'] += len(missing)
+                totals['stray'] += len(stray)
+                continue
+
+            if orphans:
+                workplace = workplace or Workplace.objects.get_or_create(workplace_number=number)[0]
+                totals['imported'] += len(reconcile.import_frames(workplace, orphans))
+            if missing:
+                reconcile.flag_missing(workplace, missing)
+                totals['missing'] += len(missing)
+            if stray:
+                totals['stray'] += reconcile.remove_stray(stray) if options['remove_stray'] else len(stray)
+
+        verb = "Would import" if options['dry_run'] else "Imported"
+        stray_verb = "removed" if options['remove_stray'] and not options['dry_run'] else "found"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {totals['files']} files. {verb} {totals['imported']} rows, "
+            f"flagged {totals['missing']} rows without a file, {stray_verb} {totals['stray']} stray files"
+        ))
@@ -0,0 +1,170 @@
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from roster import reprocess, retention, rollups, storage, transcode
+from roster.models import Workplace, WorkplaceScreenshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encode stored screenshot frames into the storage format and byte budget on a pool of "
+        "worker processes, throttled so it can run during lessons. Interrupted runs resume where they stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+            help="Worker processes (0 runs the image work in this process)",
+        )
+        parser.add_argument('--batch-size', type=int, default=200, help="Frames per batch of row updates")
+        parser.add_argument('--format', default=settings.SCREENSHOT_STORAGE_FORMAT or 'png', choices=list(transcode.FORMATS))
+        parser.add_argument(
+            '--over-bytes', type=int, default=None,
+            help="Also re-encode frames in the target format that are larger than this",
+        )
+        parser.add_argument('--max-frames-per-second', type=float, default=None)
+        parser.add_argument('--max-mb-per-second', type=float, default=None, help="Limit on bytes read")
+        parser.add_argument('--nice', type=int, default=10, help="CPU priority decrease of the workers")
+        parser.add_argument('--retention', action='store_true', help="Run a retention pass per workplace first")
+        parser.add_argument(
+            '--state-file', default=str(settings.BASE_DIR / 'data' / 'reprocess_screenshots.json'),
+            help="Where progress is kept between runs",
+        )
+        parser.add_argument('--restart', action='store_true', help="Ignore saved progress")
+        parser.add_argument('--report-every', type=float, default=5, help="Seconds between throughput reports")
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        over_bytes = options['over_bytes']
+        # Re-encoded frames fit the threshold, so the next run does not pick them up again
+        target_bytes = settings.SCREENSHOT_TARGET_BYTES
+        if over_bytes is not None:
+            target_bytes = min(target_bytes, over_bytes)
+        params = {'format': fmt, 'over_bytes': over_bytes}
+
+        if options['retention']:
+            for workplace in Workplace.objects.order_by('workplace_number'):
+                retention.rotate_screenshots(str(workplace.workplace_number), workplace)
+            self.stdout.write("Retention pass done")
+
+        state = self._load_state(options['state_file'])
+        last_id = 0
+        if not options['restart'] and state.get('params') == params:
+            last_id = state.get('last_id', 0)
+            if last_id:
+                self.stdout.write(f"Resuming after screenshot #{last_id}")
+
+        throttle = reprocess.Throttle(
+            options['max_frames_per_second'],
+            options['max_mb_per_second'] and options['max_mb_per_second'] * 1024 * 1024,
+        )
+        totals = {'checked': 0, 'frames': 0, 'bytes_in': 0, 'bytes_out': 0, 'errors': 0}
+        started = last_report = time.monotonic()
+
+        pool = None
+        if options['workers'] > 0:
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'], initializer=reprocess.init_worker, initargs=(options['nice'],)
+            )
+        try:
+            while True:
+                rows = list(
+                    WorkplaceScreenshot.objects.filter(image_deleted=False, id__gt=last_id).order_by('id').values_list(
+                        'id', 'workplace_id', 'workplace__workplace_number', 'screenshot_filename', 'file_size', 'created_at'
+                    )[:options['batch_size']]
+                )
+                if not rows:
+                    break
+
+                jobs, info = [], {}
+                for shot_id, workplace_id, number, filename, file_size, created_at in rows:
+                    if not reprocess.needs_work(filename, file_size, fmt, over_bytes):
+                        continue
+                    # Frames packed into segments are left alone
+                    path = storage.locate(str(number), filename)
+                    if path is None:
+                        continue
+                    jobs.append(reprocess.Job(
+                        shot_id, path, fmt, over_bytes, target_bytes, settings.SCREENSHOT_STORAGE_LOSSLESS
+                    ))
+                    info[shot_id] = (workplace_id, created_at, file_size)
+
+                if pool is not None:
+                    chunksize = max(1, len(jobs) // (4 * options['workers']))
+                    results = list(pool.map(reprocess.process_frame, jobs, chunksize=chunksize))
+                else:
+                    results = [reprocess.process_frame(job) for job in jobs]
+                self._save_results(results, info, totals)
+
+                totals['checked'] += len(rows)
+                last_id = rows[-1][0]
+                self._save_state(options['state_file'], {'params': params, 'last_id': last_id})
+                throttle.account(len(jobs), sum(result.size_in for result in results))
+
+                now = time.monotonic()
+                if now - last_report >= options['report_every']:
+                    last_report = now
+                    self.stdout.write(self._throughput(totals, now - started, last_id))
+        except KeyboardInterrupt:
+            raise CommandError(f"Interrupted after screenshot #{last_id}; run again to resume")
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        self._save_state(options['state_file'], {'params': params, 'last_id': last_id, 'done': True})
+        self.stdout.write(self.style.SUCCESS(self._throughput(totals, time.monotonic() - started, last_id)))
+
+    def _save_results(self, results, info, totals):
+        """One transaction per batch: rows renamed/resized together with their day rollups"""
+        updated = []
+        deltas = defaultdict(list)
+        for result in results:
+            if result.error:
+                totals['errors'] += 1
+                self.stderr.write(f"Cannot reprocess {result.error}")
+                continue
+            if result.new_filename is None:
+                continue
+            workplace_id, created_at, file_size = info[result.screenshot_id]
+            updated.append(WorkplaceScreenshot(
+                id=result.screenshot_id, screenshot_filename=result.new_filename, file_size=result.size_out
+            ))
+            deltas[workplace_id].append((created_at, result.size_out - (file_size or result.size_in)))
+            totals['frames'] += 1
+            totals['bytes_in'] += result.size_in
+            totals['bytes_out'] += result.size_out
+
+        if updated:
+            with transaction.atomic():
+                WorkplaceScreenshot.objects.bulk_update(updated, ['screenshot_filename', 'file_size'])
+                for workplace_id, changes in deltas.items():
+                    rollups.images_resized(workplace_id, changes)
+
+    def _throughput(self, totals, elapsed, last_id):
+        elapsed = max(elapsed, 1e-6)
+        return (
+            f"#{last_id}: checked {totals['checked']}, re-encoded {totals['frames']} "
+            f"({totals['frames'] / elapsed:.1f} frames/s, {totals['bytes_in'] / elapsed / 1024 / 1024:.2f} MB/s read), "
+            f"{totals['bytes_in']} -> {totals['bytes_out']} bytes, {totals['errors']} errors"
+        )
+
+    def _load_state(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self, path, state):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
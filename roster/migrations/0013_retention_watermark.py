@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0012_workplacescreenshot_image_deleted'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workplace',
+            name='retention_last_kept_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Останній збережений при ротації кадр'),
+        ),
+        migrations.AddField(
+            model_name='workplace',
+            name='retention_watermark',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ротація скріншотів виконана до'),
+        ),
+        migrations.AddIndex(
+            model_name='workplacescreenshot',
+            index=models.Index(fields=['workplace', 'image_deleted', 'created_at'], name='screenshot_retention_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0013_retention_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassroomEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('classroom_id', models.CharField(max_length=50, verbose_name='ID кабінету')),
+                ('kind', models.CharField(choices=[('placement', 'Посадка'), ('screenshot', 'Скріншот'), ('settings', 'Налаштування кабінету')], max_length=20, verbose_name='Тип')),
+                ('workplace_number', models.IntegerField(blank=True, null=True, verbose_name='Номер робочого місця')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='Дані')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата створення')),
+            ],
+            options={
+                'verbose_name': 'Подія кабінету',
+                'verbose_name_plural': 'Події кабінету',
+                'indexes': [models.Index(fields=['classroom_id', 'id'], name='classroom_event_feed_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_latest_screenshot(apps, schema_editor):
+    Workplace = apps.get_model('roster', 'Workplace')
+    WorkplaceScreenshot = apps.get_model('roster', 'WorkplaceScreenshot')
+    for workplace in Workplace.objects.all():
+        workplace.latest_screenshot = WorkplaceScreenshot.objects.filter(
+            workplace=workplace, image_deleted=False
+        ).order_by('-created_at').first()
+        workplace.save(update_fields=['latest_screenshot'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0014_classroomevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workplace',
+            name='latest_screenshot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='roster.workplacescreenshot', verbose_name='Останній скріншот'),
+        ),
+        migrations.RunPython(backfill_latest_screenshot, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+import json
+
+from django.db import migrations
+
+# Frozen copies of roster.search as of this migration
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS roster_screenshot_fts USING fts5("
+    "os_username, user_name, window_titles, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+BATCH_SIZE = 1000
+
+
+def _user_name(last_name, first_name, username):
+    return ' '.join(part for part in (last_name, first_name, username) if part)
+
+
+def _window_titles(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value
+    if isinstance(value, list):
+        return '\n'.join(str(title) for title in value)
+    return str(value or '')
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is SQLite-only; other backends search with icontains (see roster.search)
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    with schema_editor.connection.cursor() as cursor:
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT s.id, s.os_username, u.last_name, u.first_name, u.username, s.window_titles "
+                "FROM roster_workplacescreenshot s LEFT JOIN auth_user u ON u.id = s.user_id "
+                "WHERE s.id > %s ORDER BY s.id LIMIT %s",
+                [last_id, BATCH_SIZE],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                "INSERT INTO roster_screenshot_fts (rowid, os_username, user_name, window_titles) VALUES (%s, %s, %s, %s)",
+                [
+                    (shot_id, os_username or '', _user_name(last, first, username), _window_titles(titles))
+                    for shot_id, os_username, last, first, username, titles in rows
+                ],
+            )
+            last_id = rows[-1][0]
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS roster_screenshot_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0015_workplace_latest_screenshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
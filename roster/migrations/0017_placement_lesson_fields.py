@@ -0,0 +1,79 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:39
+
+import bisect
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+# Frozen copies of roster.models helpers as of this migration
+WORKPLACE_ID_RE = re.compile(r'^(?:(?P<classroom>\d+)-)?\D*?(?P<number>\d+)$')
+
+
+def parse_workplace_id(workplace_id):
+    match = WORKPLACE_ID_RE.match((workplace_id or '').strip())
+    if not match:
+        return None, None
+    return match.group('classroom'), int(match.group('number'))
+
+
+def lesson_index_at(time):
+    lessons = sorted(settings.LESSONS_SCHEDULE.items(), key=lambda item: item[1]['start'])
+    position = bisect.bisect_right([times['start'] for _, times in lessons], time)
+    return lessons[position - 1][0] if position else 0
+
+
+def backfill_lesson_fields(apps, schema_editor):
+    WorkplaceUserPlacement = apps.get_model('roster', 'WorkplaceUserPlacement')
+    batch = []
+    for placement in WorkplaceUserPlacement.objects.all().iterator(chunk_size=2000):
+        local = timezone.localtime(placement.created_at)
+        placement.classroom, placement.workplace_number = parse_workplace_id(placement.workplace_id)
+        placement.lesson_date = local.date()
+        placement.lesson_index = lesson_index_at(local.time())
+        batch.append(placement)
+        if len(batch) >= 2000:
+            WorkplaceUserPlacement.objects.bulk_update(batch, ['classroom', 'workplace_number', 'lesson_date', 'lesson_index'])
+            batch = []
+    if batch:
+        WorkplaceUserPlacement.objects.bulk_update(batch, ['classroom', 'workplace_number', 'lesson_date', 'lesson_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0016_screenshot_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workplaceuserplacement',
+            name='classroom',
+            field=models.CharField(blank=True, max_length=20, null=True, verbose_name='Аудиторія'),
+        ),
+        migrations.AddField(
+            model_name='workplaceuserplacement',
+            name='lesson_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Дата уроку'),
+        ),
+        migrations.AddField(
+            model_name='workplaceuserplacement',
+            name='lesson_index',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Номер уроку'),
+        ),
+        migrations.AddField(
+            model_name='workplaceuserplacement',
+            name='workplace_number',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Номер робочого місця'),
+        ),
+        migrations.AddIndex(
+            model_name='workplaceuserplacement',
+            index=models.Index(fields=['lesson_date', 'lesson_index', 'workplace_number'], name='placement_lesson_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workplaceuserplacement',
+            index=models.Index(fields=['workplace_number', 'created_at'], name='placement_workplace_idx'),
+        ),
+        migrations.RunPython(backfill_lesson_fields, migrations.RunPython.noop),
+    ]
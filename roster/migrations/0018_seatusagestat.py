@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:41
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Frozen copy of roster.suggestions.weight as of this migration
+EPOCH = datetime.date(2024, 1, 1)
+HALF_LIFE_DAYS = 30
+
+
+def weight(day):
+    return 2.0 ** ((day - EPOCH).days / HALF_LIFE_DAYS)
+
+
+def backfill_seat_usage(apps, schema_editor):
+    WorkplaceUserPlacement = apps.get_model('roster', 'WorkplaceUserPlacement')
+    SeatUsageStat = apps.get_model('roster', 'SeatUsageStat')
+
+    stats = {}
+    placements = WorkplaceUserPlacement.objects.filter(workplace_number__isnull=False, lesson_index__gt=0)
+    for workplace_number, lesson_date, lesson_index, user_id in placements.values_list(
+        'workplace_number', 'lesson_date', 'lesson_index', 'user_id'
+    ).iterator(chunk_size=2000):
+        key = (workplace_number, lesson_date.weekday(), lesson_index, user_id)
+        score, last_seen = stats.get(key, (0.0, lesson_date))
+        stats[key] = (score + weight(lesson_date), max(last_seen, lesson_date))
+
+    SeatUsageStat.objects.bulk_create([
+        SeatUsageStat(workplace_number=k[0], weekday=k[1], lesson_index=k[2], user_id=k[3], score=score, last_seen=last_seen)
+        for k, (score, last_seen) in stats.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('roster', '0017_placement_lesson_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatUsageStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('workplace_number', models.PositiveSmallIntegerField(verbose_name='Номер робочого місця')),
+                ('weekday', models.PositiveSmallIntegerField(verbose_name='День тижня')),
+                ('lesson_index', models.PositiveSmallIntegerField(verbose_name='Номер уроку')),
+                ('score', models.FloatField(default=0, verbose_name='Оцінка')),
+                ('last_seen', models.DateField(verbose_name='Остання посадка')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Статистика посадок',
+                'verbose_name_plural': 'Статистика посадок',
+                'indexes': [models.Index(fields=['workplace_number', 'weekday', 'lesson_index', '-score'], name='seat_usage_top_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='seatusagestat',
+            constraint=models.UniqueConstraint(fields=('workplace_number', 'weekday', 'lesson_index', 'user'), name='seat_usage_unique'),
+        ),
+        migrations.RunPython(backfill_seat_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:05
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+# Frozen copy of the roster.partitions conversion as of this migration
+PARTITIONED_TABLES = ['roster_workplacescreenshot', 'roster_workplaceuserplacement']
+PARTITION_COLUMN = 'created_at'
+MONTHS_AHEAD = 3
+
+
+def month_start(value):
+    if isinstance(value, datetime.datetime):
+        value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    start = timezone.make_aware(datetime.datetime.combine(month, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(add_months(month, 1), datetime.time.min))
+    return start, end
+
+
+def table_definitions(cursor, table):
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table],
+    )
+    index_defs = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return index_defs, cursor.fetchall()
+
+
+def restore_definitions(cursor, qn, table, index_defs, foreign_keys):
+    for index_def in index_defs:
+        cursor.execute(index_def)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+
+def partition_table(cursor, qn, table):
+    old = f"{table}_unpartitioned"
+    index_defs, foreign_keys = table_definitions(cursor, table)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM " + qn(table))
+    max_id = cursor.fetchone()[0]
+    cursor.execute(f"SELECT MIN({PARTITION_COLUMN}), MAX({PARTITION_COLUMN}) FROM {qn(table)}")
+    first, last = cursor.fetchone()
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    cursor.execute(
+        f"CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS) PARTITION BY RANGE ({PARTITION_COLUMN})"
+    )
+    cursor.execute(f"CREATE TABLE {qn(table + '_pdefault')} PARTITION OF {qn(table)} DEFAULT")
+
+    current = month_start(timezone.now())
+    month = month_start(first) if first else current
+    last_month = max(month_start(last) if last else current, add_months(current, MONTHS_AHEAD))
+    while month <= last_month:
+        start, end = month_bounds(month)
+        cursor.execute(
+            f"CREATE TABLE {qn(f'{table}_p{month:%Y%m}')} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+        month = add_months(month, 1)
+
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id")
+    cursor.execute("SELECT setval(%s, %s, %s)", [sequence, max(max_id, 1), max_id > 0])
+    cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {PARTITION_COLUMN})")
+    restore_definitions(cursor, qn, table, index_defs, foreign_keys)
+
+
+def unpartition_table(cursor, qn, table):
+    old = f"{table}_partitioned"
+    index_defs, foreign_keys = table_definitions(cursor, table)
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    cursor.execute(f"CREATE TABLE {qn(table)} (LIKE {qn(old)})")
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id)")
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {qn(table)}")
+    restart = cursor.fetchone()[0]
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {int(restart)})"
+    )
+    restore_definitions(cursor, qn, table, index_defs, foreign_keys)
+
+
+def partition_tables(apps, schema_editor):
+    # Range partitioning is PostgreSQL-only; SQLite keeps plain tables (see roster.partitions)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            partition_table(cursor, schema_editor.quote_name, table)
+
+
+def unpartition_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table in PARTITIONED_TABLES:
+            unpartition_table(cursor, schema_editor.quote_name, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0018_seatusagestat'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='workplace',
+            name='latest_screenshot',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='roster.workplacescreenshot', verbose_name='Останній скріншот'),
+        ),
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
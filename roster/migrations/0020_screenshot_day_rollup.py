@@ -0,0 +1,97 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:49
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def summarize(rows):
+    """Frozen copy of roster.rollups.summarize as of this migration"""
+    rollups = {}
+    for workplace_id, created_at, user_id, image_deleted, file_size in rows:
+        day = timezone.localtime(created_at).date() if timezone.is_aware(created_at) else created_at.date()
+        rollup = rollups.get((day, workplace_id))
+        if rollup is None:
+            rollup = rollups[(day, workplace_id)] = {
+                'frames': 0, 'frames_kept': 0, 'bytes': 0,
+                'first_at': created_at, 'last_at': created_at, 'user_ids': [],
+            }
+        rollup['frames'] += 1
+        if not image_deleted:
+            rollup['frames_kept'] += 1
+            rollup['bytes'] += file_size or 0
+        rollup['first_at'] = min(rollup['first_at'], created_at)
+        rollup['last_at'] = max(rollup['last_at'], created_at)
+        if user_id and user_id not in rollup['user_ids']:
+            rollup['user_ids'].append(user_id)
+    return rollups
+
+
+def backfill_rollups(apps, schema_editor):
+    WorkplaceScreenshot = apps.get_model('roster', 'WorkplaceScreenshot')
+    ScreenshotDayRollup = apps.get_model('roster', 'ScreenshotDayRollup')
+
+    # Sizes of the images still on disk
+    sized = []
+    live = WorkplaceScreenshot.objects.filter(image_deleted=False).values_list(
+        'id', 'workplace__workplace_number', 'screenshot_filename'
+    )
+    for shot_id, workplace_number, filename in live.iterator(chunk_size=2000):
+        try:
+            size = os.path.getsize(os.path.join(settings.SCREENSHOTS_ROOT, str(workplace_number), filename))
+        except OSError:
+            continue
+        sized.append(WorkplaceScreenshot(id=shot_id, file_size=size))
+        if len(sized) >= 1000:
+            WorkplaceScreenshot.objects.bulk_update(sized, ['file_size'])
+            sized = []
+    WorkplaceScreenshot.objects.bulk_update(sized, ['file_size'])
+
+    rows = WorkplaceScreenshot.objects.order_by().values_list(
+        'workplace_id', 'created_at', 'user_id', 'image_deleted', 'file_size'
+    ).iterator(chunk_size=2000)
+    ScreenshotDayRollup.objects.bulk_create([
+        ScreenshotDayRollup(date=day, workplace_id=workplace_id, **fields)
+        for (day, workplace_id), fields in summarize(rows).items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0019_partition_time_series'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workplacescreenshot',
+            name='file_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Розмір файлу'),
+        ),
+        migrations.CreateModel(
+            name='ScreenshotDayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('frames', models.PositiveIntegerField(default=0, verbose_name='Кадрів')),
+                ('frames_kept', models.PositiveIntegerField(default=0, verbose_name='Кадрів із зображенням')),
+                ('bytes', models.BigIntegerField(default=0, verbose_name='Розмір зображень')),
+                ('first_at', models.DateTimeField(blank=True, null=True, verbose_name='Перший кадр')),
+                ('last_at', models.DateTimeField(blank=True, null=True, verbose_name='Останній кадр')),
+                ('user_ids', models.JSONField(blank=True, default=list, verbose_name='Користувачі')),
+                ('workplace', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_rollups', to='roster.workplace')),
+            ],
+            options={
+                'verbose_name': 'Підсумок скріншотів за день',
+                'verbose_name_plural': 'Підсумки скріншотів за день',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='screenshotdayrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'workplace'), name='screenshot_rollup_unique'),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0020_screenshot_day_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screenshotdayrollup',
+            name='skipped_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='Заощаджено байтів'),
+        ),
+        migrations.AddField(
+            model_name='screenshotdayrollup',
+            name='skipped_frames',
+            field=models.PositiveIntegerField(default=0, verbose_name='Пропущено повторів'),
+        ),
+        migrations.AddField(
+            model_name='workplacescreenshot',
+            name='frame_hash',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Відбиток кадру'),
+        ),
+        migrations.AddField(
+            model_name='workplacescreenshot',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Востаннє бачено'),
+        ),
+        migrations.AddField(
+            model_name='workplacescreenshot',
+            name='repeat_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Повторів'),
+        ),
+    ]
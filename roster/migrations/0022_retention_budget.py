@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:02
+
+from django.db import migrations, models
+import roster.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0021_screenshot_dedupe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classroom',
+            name='retention_budget_bytes',
+            field=models.BigIntegerField(blank=True, help_text='Порожньо — без ліміту', null=True, verbose_name='Ліміт диску для скріншотів (байт)'),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='retention_compress_over_bytes',
+            field=models.PositiveIntegerField(default=51200, verbose_name='Стискати кадри понад (байт)'),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='retention_keep_recent',
+            field=models.PositiveIntegerField(default=100, verbose_name='Недоторканих останніх кадрів'),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='retention_tiers',
+            field=models.JSONField(default=roster.models.default_retention_tiers, help_text='[[вік у днях, хвилин між кадрами або null — видалити], ...]', verbose_name='Рівні проріджування'),
+        ),
+        migrations.AddField(
+            model_name='screenshotdayrollup',
+            name='retention_tier',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Рівень проріджування'),
+        ),
+    ]
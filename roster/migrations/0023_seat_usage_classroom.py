@@ -0,0 +1,86 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:35
+
+import datetime
+
+from django.db import migrations, models
+
+# Frozen copies of roster.suggestions.weight and roster.storage.CLASSROOM as of this migration
+EPOCH = datetime.date(2024, 1, 1)
+HALF_LIFE_DAYS = 30
+CLASSROOM = '329'
+
+
+def weight(day):
+    return 2.0 ** ((day - EPOCH).days / HALF_LIFE_DAYS)
+
+
+def recount_per_classroom(apps, schema_editor):
+    WorkplaceUserPlacement = apps.get_model('roster', 'WorkplaceUserPlacement')
+    SeatUsageStat = apps.get_model('roster', 'SeatUsageStat')
+
+    stats = {}
+    placements = WorkplaceUserPlacement.objects.filter(workplace_number__isnull=False, lesson_index__gt=0)
+    for classroom, workplace_number, lesson_date, lesson_index, user_id in placements.values_list(
+        'classroom', 'workplace_number', 'lesson_date', 'lesson_index', 'user_id'
+    ).iterator(chunk_size=2000):
+        key = (classroom or CLASSROOM, workplace_number, lesson_date.weekday(), lesson_index, user_id)
+        score, last_seen = stats.get(key, (0.0, lesson_date))
+        stats[key] = (score + weight(lesson_date), max(last_seen, lesson_date))
+
+    SeatUsageStat.objects.all().delete()
+    SeatUsageStat.objects.bulk_create([
+        SeatUsageStat(
+            classroom=k[0], workplace_number=k[1], weekday=k[2], lesson_index=k[3], user_id=k[4],
+            score=score, last_seen=last_seen,
+        )
+        for k, (score, last_seen) in stats.items()
+    ], batch_size=1000)
+
+
+def merge_classrooms(apps, schema_editor):
+    SeatUsageStat = apps.get_model('roster', 'SeatUsageStat')
+
+    kept = {}
+    for stat in SeatUsageStat.objects.order_by('id').iterator(chunk_size=2000):
+        key = (stat.workplace_number, stat.weekday, stat.lesson_index, stat.user_id)
+        first = kept.get(key)
+        if first is None:
+            kept[key] = stat
+            continue
+        first.score += stat.score
+        first.last_seen = max(first.last_seen, stat.last_seen)
+        first.save(update_fields=['score', 'last_seen'])
+        stat.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('roster', '0022_retention_budget'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='seatusagestat',
+            name='seat_usage_unique',
+        ),
+        migrations.RemoveIndex(
+            model_name='seatusagestat',
+            name='seat_usage_top_idx',
+        ),
+        migrations.AddField(
+            model_name='seatusagestat',
+            name='classroom',
+            field=models.CharField(default='329', max_length=20, verbose_name='Аудиторія'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(recount_per_classroom, merge_classrooms),
+        migrations.AddIndex(
+            model_name='seatusagestat',
+            index=models.Index(fields=['classroom', 'workplace_number', 'weekday', 'lesson_index', '-score'], name='seat_usage_top_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='seatusagestat',
+            constraint=models.UniqueConstraint(fields=('classroom', 'workplace_number', 'weekday', 'lesson_index', 'user'), name='seat_usage_unique'),
+        ),
+    ]
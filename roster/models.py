@@ -1,4 +1,27 @@
+import bisect
+import re
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
+
+# "329-4", "329-04", "W-4", "Workplace 4", "4": optional numeric classroom prefix, trailing number
+WORKPLACE_ID_RE = re.compile(r'^(?:(?P<classroom>\d+)-)?\D*?(?P<number>\d+)$')
+
+
+def parse_workplace_id(workplace_id):
+    """Returns (classroom, workplace_number); either may be None"""
+    match = WORKPLACE_ID_RE.match((workplace_id or '').strip())
+    if not match:
+        return None, None
+    return match.group('classroom'), int(match.group('number'))
+
+
+def lesson_index_at(time):
+    """Index of the last lesson in LESSONS_SCHEDULE that started at or before time (0 before the first one)"""
+    lessons = sorted(settings.LESSONS_SCHEDULE.items(), key=lambda item: item[1]['start'])
+    position = bisect.bisect_right([times['start'] for _, times in lessons], time)
+    return lessons[position - 1][0] if position else 0
 
 
 class WorkplaceUserPlacement(models.Model):
@@ -6,10 +29,38 @@ class WorkplaceUserPlacement(models.Model):
     workplace_id = models.CharField(max_length=100)
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Derived from workplace_id and created_at on save
+    classroom = models.CharField(max_length=20, null=True, blank=True, verbose_name="Аудиторія")
+    workplace_number = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Номер робочого місця")
+    lesson_date = models.DateField(null=True, blank=True, verbose_name="Дата уроку")
+    lesson_index = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Номер уроку")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['lesson_date', 'lesson_index', 'workplace_number'], name='placement_lesson_idx'),
+            models.Index(fields=['workplace_number', 'created_at'], name='placement_workplace_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.workplace_id} - {self.created_at}"
 
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'classroom', 'workplace_number', 'lesson_date', 'lesson_index'}
+        super().save(*args, **kwargs)
+
+    def set_derived_fields(self):
+        self.classroom, self.workplace_number = parse_workplace_id(self.workplace_id)
+        # created_at is only filled in by auto_now_add while saving a new row
+        created_at = self.created_at or timezone.now()
+        if timezone.is_naive(created_at):
+            created_at = timezone.make_aware(created_at)
+        local = timezone.localtime(created_at)
+        self.lesson_date = local.date()
+        self.lesson_index = lesson_index_at(local.time())
+
 
 class StudentGroup(models.Model):
     """Model for storing student groups"""
@@ -55,6 +106,13 @@ class StudentGroupFeature(models.Model):
 class Workplace(models.Model):
     """Model which represents a specific workplace"""
     workplace_number = models.IntegerField(unique=True, verbose_name="Номер робочого місця")
+    retention_watermark = models.DateTimeField(null=True, blank=True, verbose_name="Ротація скріншотів виконана до")
+    retention_last_kept_at = models.DateTimeField(null=True, blank=True, verbose_name="Останній збережений при ротації кадр")
+    # No database constraint: on PostgreSQL screenshots live in a partitioned table (see roster.partitions)
+    latest_screenshot = models.ForeignKey(
+        'WorkplaceScreenshot', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        db_constraint=False, verbose_name="Останній скріншот"
+    )
     
     class Meta:
         verbose_name = "Робоче місце"
@@ -63,6 +121,11 @@ class Workplace(models.Model):
     def __str__(self):
         return f"W-{self.workplace_number}"
 
+    def refresh_latest_screenshot(self):
+        """Re-point latest_screenshot at the newest frame whose image still exists"""
+        self.latest_screenshot = self.screenshots.filter(image_deleted=False).order_by('-created_at').first()
+        Workplace.objects.filter(pk=self.pk).update(latest_screenshot=self.latest_screenshot)
+
 
 class WorkplaceScreenshot(models.Model):
     """Model which represents a historical screenshot"""
@@ -74,9 +137,17 @@ class WorkplaceScreenshot(models.Model):
     os_username = models.CharField(max_length=255, null=True, blank=True, verbose_name="Користувач OS")
     window_titles = models.JSONField(default=list, blank=True, verbose_name="Заголовки вікон")
     image_deleted = models.BooleanField(default=False, verbose_name="Зображення видалено")
+    file_size = models.PositiveIntegerField(null=True, blank=True, verbose_name="Розмір файлу")
+    # Later uploads identical to this frame are not stored (see roster.dedupe)
+    frame_hash = models.BigIntegerField(null=True, blank=True, verbose_name="Відбиток кадру")
+    last_seen_at = models.DateTimeField(null=True, blank=True, verbose_name="Востаннє бачено")
+    repeat_count = models.PositiveIntegerField(default=0, verbose_name="Повторів")
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['workplace', 'image_deleted', 'created_at'], name='screenshot_retention_idx'),
+        ]
         verbose_name = "Скріншот"
         verbose_name_plural = "Скріншоти"
     
@@ -84,11 +155,29 @@ class WorkplaceScreenshot(models.Model):
         return f"Screenshot {self.workplace} - {self.created_at}"
 
 
+def default_retention_tiers():
+    """[min age in days, minutes between kept frames (None: delete)], see roster.retention"""
+    return [[0, 15], [7, 60], [30, 240], [365, None]]
+
+
 class Classroom(models.Model):
     """Model for storing classroom-specific settings"""
     classroom_id = models.CharField(max_length=50, primary_key=True, verbose_name="ID кабінету")
     screenshots_enabled = models.BooleanField(default=True, verbose_name="Скріншоти увімкнені")
     screenshot_interval = models.IntegerField(default=60, verbose_name="Інтервал скріншотів (сек)")
+    # Screenshot retention policy (see roster.retention and roster.budget)
+    retention_keep_recent = models.PositiveIntegerField(default=100, verbose_name="Недоторканих останніх кадрів")
+    retention_tiers = models.JSONField(
+        default=default_retention_tiers, verbose_name="Рівні проріджування",
+        help_text="[[вік у днях, хвилин між кадрами або null — видалити], ...]"
+    )
+    retention_compress_over_bytes = models.PositiveIntegerField(
+        default=50 * 1024, verbose_name="Стискати кадри понад (байт)"
+    )
+    retention_budget_bytes = models.BigIntegerField(
+        null=True, blank=True, verbose_name="Ліміт диску для скріншотів (байт)",
+        help_text="Порожньо — без ліміту"
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата створення")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата оновлення")
     
@@ -99,6 +188,18 @@ class Classroom(models.Model):
     def __str__(self):
         return f"Кабінет {self.classroom_id}"
 
+    def clean(self):
+        from django.core.exceptions import ValidationError
+
+        tiers = self.retention_tiers
+        valid = isinstance(tiers, list) and tiers and all(
+            isinstance(tier, list) and len(tier) == 2 and isinstance(tier[0], int) and tier[0] >= 0
+            and (tier[1] is None or (isinstance(tier[1], int) and tier[1] > 0))
+            for tier in tiers
+        )
+        if not valid:
+            raise ValidationError({'retention_tiers': "Очікується список пар [днів, хвилин або null]"})
+
 
 class UserProfile(models.Model):
     """Extended user profile with additional settings"""
@@ -115,3 +216,91 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return f"Profile: {self.user.get_full_name() or self.user.username}"
+
+
+class ClassroomEvent(models.Model):
+    """Change-feed entry for the classroom dashboard; the id doubles as the SSE event id"""
+    KIND_CHOICES = [
+        ('placement', 'Посадка'),
+        ('screenshot', 'Скріншот'),
+        ('settings', 'Налаштування кабінету'),
+    ]
+
+    classroom_id = models.CharField(max_length=50, verbose_name="ID кабінету")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name="Тип")
+    workplace_number = models.IntegerField(null=True, blank=True, verbose_name="Номер робочого місця")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Дані")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата створення")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['classroom_id', 'id'], name='classroom_event_feed_idx'),
+        ]
+        verbose_name = "Подія кабінету"
+        verbose_name_plural = "Події кабінету"
+
+    def __str__(self):
+        return f"#{self.id} {self.classroom_id} {self.kind}"
+
+
+class SeatUsageStat(models.Model):
+    """
+    How often a user sits at a classroom's workplace in a given lesson on a given weekday.
+    score is a forward-decayed count (see roster.suggestions): every placement
+    adds a weight that doubles each half-life, so ordering by score ranks
+    recent habits first without rewriting old rows.
+    """
+    classroom = models.CharField(max_length=20, verbose_name="Аудиторія")
+    workplace_number = models.PositiveSmallIntegerField(verbose_name="Номер робочого місця")
+    weekday = models.PositiveSmallIntegerField(verbose_name="День тижня")  # 0 = Monday
+    lesson_index = models.PositiveSmallIntegerField(verbose_name="Номер уроку")
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField(default=0, verbose_name="Оцінка")
+    last_seen = models.DateField(verbose_name="Остання посадка")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['classroom', 'workplace_number', 'weekday', 'lesson_index', 'user'], name='seat_usage_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['classroom', 'workplace_number', 'weekday', 'lesson_index', '-score'], name='seat_usage_top_idx',
+            ),
+        ]
+        verbose_name = "Статистика посадок"
+        verbose_name_plural = "Статистика посадок"
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.classroom}-{self.workplace_number} ({self.weekday}/{self.lesson_index}): {self.score:.2f}"
+
+
+class ScreenshotDayRollup(models.Model):
+    """
+    Per-day totals of a workplace's screenshots for the history calendar.
+    Maintained at ingest and by retention (see roster.rollups), so the
+    calendar never scans WorkplaceScreenshot.
+    """
+    date = models.DateField(verbose_name="Дата")
+    workplace = models.ForeignKey(Workplace, on_delete=models.CASCADE, related_name='day_rollups')
+    frames = models.PositiveIntegerField(default=0, verbose_name="Кадрів")
+    frames_kept = models.PositiveIntegerField(default=0, verbose_name="Кадрів із зображенням")
+    bytes = models.BigIntegerField(default=0, verbose_name="Розмір зображень")
+    first_at = models.DateTimeField(null=True, blank=True, verbose_name="Перший кадр")
+    last_at = models.DateTimeField(null=True, blank=True, verbose_name="Останній кадр")
+    user_ids = models.JSONField(default=list, blank=True, verbose_name="Користувачі")
+    skipped_frames = models.PositiveIntegerField(default=0, verbose_name="Пропущено повторів")
+    skipped_bytes = models.BigIntegerField(default=0, verbose_name="Заощаджено байтів")
+    # Index of the Classroom.retention_tiers entry this day was last thinned to (roster.budget)
+    retention_tier = models.PositiveSmallIntegerField(default=0, verbose_name="Рівень проріджування")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'workplace'], name='screenshot_rollup_unique'),
+        ]
+        verbose_name = "Підсумок скріншотів за день"
+        verbose_name_plural = "Підсумки скріншотів за день"
+
+    def __str__(self):
+        return f"{self.workplace_id} {self.date}: {self.frames}"
@@ -0,0 +1,251 @@
+"""
+Monthly range partitioning of the time-series tables on PostgreSQL.
+
+WorkplaceScreenshot and WorkplaceUserPlacement only ever grow, so on
+PostgreSQL they are partitioned by created_at into one table per month
+(<table>_p202601, ...) plus a default partition that catches rows outside
+every monthly range. Indexes declared on the models are created on the parent
+and PostgreSQL maintains them per partition; queries that filter created_at by
+range only touch the partitions of those months.
+
+The partitioned primary key is (id, created_at), since PostgreSQL requires
+the partition key in every unique constraint. Django keeps using id alone, and
+ids come from one sequence shared by all partitions.
+
+Partitions for the coming months are created by `manage.py manage_partitions`
+(run daily from cron), which also detaches and optionally archives months
+older than PARTITION_RETAIN_MONTHS. On SQLite none of this applies and the
+tables stay plain.
+"""
+import datetime
+import gzip
+import os
+import re
+
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+PARTITIONED_TABLES = ['roster_workplacescreenshot', 'roster_workplaceuserplacement']
+PARTITION_COLUMN = 'created_at'
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def is_supported(connection=None):
+    return (connection or default_connection).vendor == 'postgresql'
+
+
+def month_start(value):
+    if isinstance(value, datetime.datetime):
+        value = timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table):
+    return f"{table}_pdefault"
+
+
+def partition_month(name):
+    """Month of a monthly partition name, None for the default partition"""
+    match = PARTITION_NAME_RE.search(name)
+    if not match:
+        return None
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def month_bounds(month):
+    """Aware [start, end) of a month in the project time zone"""
+    start = timezone.make_aware(datetime.datetime.combine(month, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(add_months(month, 1), datetime.time.min))
+    return start, end
+
+
+def list_partitions(cursor, table):
+    """Names of the partitions currently attached to table"""
+    cursor.execute(
+        """
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        ORDER BY child.relname
+        """,
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = partrelid WHERE relname = %s",
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def create_partition(cursor, table, month):
+    """
+    Create the partition of month unless it exists. Rows of that month that
+    landed in the default partition are moved into it.
+    Returns True if a partition was created.
+    """
+    name = partition_name(table, month)
+    if name in list_partitions(cursor, table):
+        return False
+    start, end = month_bounds(month)
+    default = default_partition_name(table)
+    qn = default_connection.ops.quote_name
+    with transaction.atomic():
+        cursor.execute(f"CREATE TABLE {qn(name)} (LIKE {qn(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        if default in list_partitions(cursor, table):
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {qn(default)} WHERE {PARTITION_COLUMN} >= %s AND {PARTITION_COLUMN} < %s "
+                f"RETURNING *) INSERT INTO {qn(name)} SELECT * FROM moved",
+                [start, end],
+            )
+        cursor.execute(
+            f"ALTER TABLE {qn(table)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+    return True
+
+
+def missing_months(cursor, table, months_ahead, now=None):
+    """Months from the current one through months_ahead ahead that have no partition yet"""
+    current = month_start(now or timezone.now())
+    existing = set(list_partitions(cursor, table))
+    months = [add_months(current, offset) for offset in range(months_ahead + 1)]
+    return [month for month in months if partition_name(table, month) not in existing]
+
+
+def ensure_partitions(cursor, table, months_ahead, now=None):
+    """Create the missing partitions up to months_ahead months ahead; returns their names"""
+    return [
+        partition_name(table, month)
+        for month in missing_months(cursor, table, months_ahead, now)
+        if create_partition(cursor, table, month)
+    ]
+
+
+def expired_partitions(cursor, table, retain_months, now=None):
+    """Monthly partitions entirely older than the last retain_months months"""
+    oldest_kept = add_months(month_start(now or timezone.now()), -retain_months)
+    return [
+        name for name in list_partitions(cursor, table)
+        if partition_month(name) is not None and partition_month(name) < oldest_kept
+    ]
+
+
+def detach_partition(cursor, table, name):
+    """Detach a partition: its rows stay in a standalone table but leave every query on table"""
+    qn = default_connection.ops.quote_name
+    cursor.execute(f"ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}")
+
+
+def archive_partition(cursor, name, archive_dir):
+    """Dump a (detached) partition to <archive_dir>/<name>.csv.gz and drop it"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    qn = default_connection.ops.quote_name
+    with gzip.open(path, 'wb') as archive:
+        with cursor.copy(f"COPY {qn(name)} TO STDOUT WITH (FORMAT csv, HEADER)") as copy:
+            for data in copy:
+                archive.write(data)
+    cursor.execute(f"DROP TABLE {qn(name)}")
+    return path
+
+
+def _table_definitions(cursor, table):
+    """CREATE INDEX statements (besides the primary key) and foreign keys of table"""
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass)",
+        [table, table],
+    )
+    index_defs = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [table],
+    )
+    return index_defs, cursor.fetchall()
+
+
+def _restore_definitions(cursor, table, index_defs, foreign_keys):
+    # Captured before the rename, so the statements name the new table
+    for index_def in index_defs:
+        cursor.execute(index_def)
+    qn = default_connection.ops.quote_name
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}")
+
+
+def partition_table(cursor, table, months_ahead=3):
+    """
+    Convert a plain table into a monthly partitioned one, keeping its rows,
+    indexes, foreign keys and id sequence. Migration 0019 runs a frozen copy of it.
+    """
+    old = f"{table}_unpartitioned"
+    qn = default_connection.ops.quote_name
+
+    index_defs, foreign_keys = _table_definitions(cursor, table)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM " + qn(table))
+    max_id = cursor.fetchone()[0]
+    cursor.execute(f"SELECT MIN({PARTITION_COLUMN}), MAX({PARTITION_COLUMN}) FROM {qn(table)}")
+    first, last = cursor.fetchone()
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    cursor.execute(
+        f"CREATE TABLE {qn(table)} (LIKE {qn(old)} INCLUDING DEFAULTS) PARTITION BY RANGE ({PARTITION_COLUMN})"
+    )
+    cursor.execute(f"CREATE TABLE {qn(default_partition_name(table))} PARTITION OF {qn(table)} DEFAULT")
+
+    current = month_start(timezone.now())
+    month = month_start(first) if first else current
+    last_month = max(month_start(last) if last else current, add_months(current, months_ahead))
+    while month <= last_month:
+        start, end = month_bounds(month)
+        cursor.execute(
+            f"CREATE TABLE {qn(partition_name(table, month))} PARTITION OF {qn(table)} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+        month = add_months(month, 1)
+
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+
+    # The identity column went with the old table: a shared sequence replaces it
+    sequence = f"{table}_id_seq"
+    cursor.execute(f"CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.id")
+    cursor.execute("SELECT setval(%s, %s, %s)", [sequence, max(max_id, 1), max_id > 0])
+    cursor.execute(f"ALTER TABLE {qn(table)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id, {PARTITION_COLUMN})")
+
+    _restore_definitions(cursor, table, index_defs, foreign_keys)
+
+
+def unpartition_table(cursor, table):
+    """Reverse of partition_table: back to a plain table with an identity id"""
+    old = f"{table}_partitioned"
+    qn = default_connection.ops.quote_name
+
+    index_defs, foreign_keys = _table_definitions(cursor, table)
+
+    cursor.execute(f"ALTER TABLE {qn(table)} RENAME TO {qn(old)}")
+    cursor.execute(f"CREATE TABLE {qn(table)} (LIKE {qn(old)})")
+    cursor.execute(f"INSERT INTO {qn(table)} SELECT * FROM {qn(old)}")
+    cursor.execute(f"DROP TABLE {qn(old)} CASCADE")
+    cursor.execute(f"ALTER TABLE {qn(table)} ADD PRIMARY KEY (id)")
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {qn(table)}")
+    restart = cursor.fetchone()[0]
+    cursor.execute(
+        f"ALTER TABLE {qn(table)} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {int(restart)})"
+    )
+    _restore_definitions(cursor, table, index_defs, foreign_keys)
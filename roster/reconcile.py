@@ -0,0 +1,163 @@
+"""
+Consistency between stored frames and WorkplaceScreenshot rows.
+
+Files and rows drift apart: retention removes a file and marks its row
+image_deleted in two steps, and frames stored before the screenshot table
+existed have no row at all, which is why the history listing still has a
+filesystem fallback. `manage.py reconcile_screenshots` compares both sides per
+workplace, by frame stem (the extension changes when a frame is transcoded):
+
+- files without a row get one, bulk-created with created_at taken from the
+  timestamp in the file name;
+- rows whose file is gone are marked image_deleted;
+- files of rows already marked image_deleted are reported as stray (and
+  removed with --remove-stray).
+
+Uploads write the file before its row, and the rows are read after the scan,
+so a frame stored mid-run looks like an orphan and a row committed mid-run
+looks like it has no file. Files modified and rows created later than
+GRACE_SECONDS before the scan started are left for the next run.
+
+Workplace directories are scanned in parallel threads, since the scan is
+listdir/stat bound. Once every workplace has been reconciled, the listing
+fallback can be switched off with SCREENSHOT_FILESYSTEM_FALLBACK = False.
+"""
+import datetime
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils import timezone
+
+from roster import segments, storage
+
+# name, size and mtime of a stored frame; path is None for frames packed into a segment
+StoredFrame = namedtuple('StoredFrame', ['name', 'size', 'mtime', 'path'])
+
+# Frames and rows this much younger than the scan are not reconciled yet
+GRACE_SECONDS = 300
+
+# Workplace numbers screenshots are stored for (as in the upload view)
+WORKPLACE_NUMBERS = range(1, 20)
+
+
+def workplace_dirs():
+    """Workplace directory names present in either layout"""
+    return sorted(set(storage.legacy_workplaces()) | set(storage.sharded_workplaces()))
+
+
+def workplace_number(workplace_dir):
+    try:
+        number = int(workplace_dir)
+    except ValueError:
+        return None
+    return number if number in WORKPLACE_NUMBERS else None
+
+
+def scan(workplace_dir):
+    """Frames stored for a workplace, loose or packed: {stem: StoredFrame}"""
+    frames = {}
+    for path in storage.iter_frames(workplace_dir):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        name = os.path.basename(path)
+        frames[os.path.splitext(name)[0]] = StoredFrame(name, st.st_size, st.st_mtime, path)
+    for _, day_dir in storage.day_dirs(workplace_dir):
+        for entry in segments.cache.entries(day_dir):
+            frames.setdefault(entry.stem, StoredFrame(segments.entry_filename(entry), entry.length, entry.mtime, None))
+    return frames
+
+
+def scan_all(dirs, workers=8):
+    """{workplace_dir: scan(workplace_dir)}, directories scanned in parallel"""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return dict(zip(dirs, pool.map(scan, dirs)))
+
+
+def frame_created_at(frame):
+    """Aware creation time of a frame without a row: its name's timestamp, else its mtime"""
+    naive = storage.frame_datetime(frame.name)
+    if naive is None:
+        return timezone.make_aware(datetime.datetime.fromtimestamp(frame.mtime))
+    return timezone.make_aware(naive)
+
+
+def compare(workplace, frames, cutoff=None):
+    """
+    (orphan frames, rows whose file is gone, stray frames) of a workplace.
+    Rows are (id, screenshot_filename, created_at, file_size, image_deleted).
+    Orphans modified and missing rows created after cutoff (a timestamp) are
+    left out, as their other half may still be on its way.
+    """
+    from roster.models import WorkplaceScreenshot
+
+    rows = WorkplaceScreenshot.objects.filter(workplace=workplace).values_list(
+        'id', 'screenshot_filename', 'created_at', 'file_size', 'image_deleted'
+    ) if workplace is not None else []
+    seen = set()
+    missing, stray = [], []
+    for row in rows:
+        stem = os.path.splitext(row[1])[0]
+        seen.add(stem)
+        if row[4]:
+            if stem in frames:
+                stray.append(frames[stem])
+        elif stem not in frames and (cutoff is None or row[2].timestamp() <= cutoff):
+            missing.append(row)
+    orphans = [
+        frame for stem, frame in sorted(frames.items())
+        if stem not in seen and (cutoff is None or frame.mtime <= cutoff)
+    ]
+    return orphans, missing, stray
+
+
+def import_frames(workplace, frames, batch_size=1000):
+    """Create rows for orphan frames; returns the created rows"""
+    from roster import rollups
+    from roster.models import WorkplaceScreenshot
+
+    created = []
+    for start in range(0, len(frames), batch_size):
+        batch = frames[start:start + batch_size]
+        shots = WorkplaceScreenshot.objects.bulk_create([
+            WorkplaceScreenshot(workplace=workplace, screenshot_filename=frame.name, file_size=frame.size)
+            for frame in batch
+        ])
+        # created_at is auto_now_add, which bulk_update does not apply
+        for shot, frame in zip(shots, batch):
+            shot.created_at = frame_created_at(frame)
+        WorkplaceScreenshot.objects.bulk_update(shots, ['created_at'])
+        created.extend(shots)
+
+    rollups.add_frames((workplace.pk, shot.created_at, None, False, shot.file_size) for shot in created)
+    if created and workplace.latest_screenshot_id is None:
+        workplace.refresh_latest_screenshot()
+    return created
+
+
+def flag_missing(workplace, rows):
+    """Mark rows whose file is gone as image_deleted"""
+    from roster import rollups
+    from roster.models import WorkplaceScreenshot
+
+    ids = [row[0] for row in rows]
+    WorkplaceScreenshot.objects.filter(id__in=ids).update(image_deleted=True)
+    rollups.images_deleted(workplace.pk, [(row[2], row[3]) for row in rows])
+    if workplace.latest_screenshot_id in ids:
+        workplace.refresh_latest_screenshot()
+
+
+def remove_stray(frames):
+    """Delete loose files of frames whose rows are image_deleted; returns how many were removed"""
+    removed = 0
+    for frame in frames:
+        if frame.path is None:
+            continue  # Packed: freed when retention drops the segment
+        try:
+            os.remove(frame.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
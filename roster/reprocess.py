@@ -0,0 +1,102 @@
+"""
+Bulk re-encoding of stored frames, for `manage.py reprocess_screenshots`.
+
+After the storage format or byte budget changes, or an old archive is
+imported, every stored frame may need decoding and encoding again. That is
+CPU-bound Pillow work, so the command fans it out to a ProcessPoolExecutor.
+The workers only touch files: process_frame() gets the path and the encoding
+parameters, writes the new file atomically and reports what it did. The
+command then updates the WorkplaceScreenshot rows and rollups of a whole batch
+at once.
+
+A frame is re-encoded if it is not in the target format, or if it is larger
+than the over_bytes threshold. Lossy frames are fitted into target_bytes
+(quality bisection, see transcode.encode); frames that still do not fit at the
+lowest quality are halved once, down to MIN_WIDTH. A re-encoded frame is at
+most target_bytes, so a second run skips it: runs can be repeated and resumed.
+"""
+import os
+import time
+from collections import namedtuple
+
+from roster import transcode
+
+# Frames are not halved below this width
+MIN_WIDTH = 640
+
+# Encoding parameters, passed to the workers (which may not share the parent's settings)
+Job = namedtuple('Job', ['screenshot_id', 'path', 'fmt', 'over_bytes', 'target_bytes', 'lossless'])
+# new_filename is None when the frame was left as it is; error holds the message of a failure
+Result = namedtuple('Result', ['screenshot_id', 'new_filename', 'size_in', 'size_out', 'error'])
+
+
+def init_worker(niceness):
+    """Pool initializer: lower the worker's CPU priority and make Django settings usable"""
+    import django
+
+    if niceness and hasattr(os, 'nice'):
+        os.nice(niceness)
+    django.setup()
+
+
+def needs_work(filename, size, fmt, over_bytes):
+    if transcode.format_of(filename) != fmt:
+        return True
+    return over_bytes is not None and size is not None and size > over_bytes
+
+
+def process_frame(job):
+    """Re-encode one frame; runs in a worker process"""
+    from PIL import Image
+
+    try:
+        size_in = os.path.getsize(job.path)
+        if not needs_work(job.path, size_in, job.fmt, job.over_bytes):
+            return Result(job.screenshot_id, None, size_in, size_in, None)
+
+        with Image.open(job.path) as img:
+            img.load()
+            image = transcode.convert_for(img, job.fmt) if job.fmt != 'png' else img
+            data, _ = transcode.encode(image, job.fmt, target_bytes=job.target_bytes, lossless=job.lossless)
+            if job.target_bytes and len(data) > job.target_bytes and image.width >= MIN_WIDTH * 2:
+                half = image.resize((image.width // 2, image.height // 2), Image.Resampling.LANCZOS)
+                data, _ = transcode.encode(half, job.fmt, target_bytes=job.target_bytes, lossless=job.lossless)
+
+        dir_path, filename = os.path.split(job.path)
+        new_filename = os.path.splitext(filename)[0] + transcode.FORMATS[job.fmt][1]
+        new_path = os.path.join(dir_path, new_filename)
+        transcode.write_frame(new_path, data, like=job.path)
+        if new_path != job.path:
+            os.remove(job.path)
+        return Result(job.screenshot_id, new_filename, size_in, len(data), None)
+    except FileNotFoundError:
+        return Result(job.screenshot_id, None, 0, 0, None)
+    except Exception as e:
+        return Result(job.screenshot_id, None, 0, 0, f"{job.path}: {e}")
+
+
+class Throttle:
+    """Keeps a loop under max_frames per second and max_bytes per second (None: unlimited)"""
+
+    def __init__(self, max_frames=None, max_bytes=None, clock=time.monotonic, sleep=time.sleep):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.sleep = sleep
+        self.started = clock()
+        self.frames = 0
+        self.bytes = 0
+
+    def account(self, frames, size):
+        """Record work done and sleep until the average rate is back under the limits"""
+        self.frames += frames
+        self.bytes += size
+        due = 0
+        if self.max_frames:
+            due = max(due, self.frames / self.max_frames)
+        if self.max_bytes:
+            due = max(due, self.bytes / self.max_bytes)
+        delay = due - (self.clock() - self.started)
+        if delay > 0:
+            self.sleep(delay)
+        return max(delay, 0)
@@ -0,0 +1,310 @@
+"""
+Screenshot retention.
+
+Rotation used to run inline in upload_screenshot_329; it is now scheduled on the
+background worker (see roster.tasks) so uploads return as soon as the file and
+its WorkplaceScreenshot row are stored.
+
+For workplaces the plan is derived from the WorkplaceScreenshot.created_at index
+and a per-workplace watermark (Workplace.retention_watermark): each pass only
+looks at frames that fell out of the "recent" window since the previous pass,
+so its cost does not grow with the size of the history.
+
+The policy (how many recent frames stay untouched, the thinning tiers, the
+compression threshold) is configured per classroom on the Classroom model; see
+policy(). Rotation applies the first tier to frames leaving the recent window
+and deletes frames past the last tier's age. Thinning older days to the coarser
+tiers and keeping within the disk budget is planned by roster.budget.
+
+Frames of days packed into a segment (roster.segments) are removed by
+rewriting the segment without them, or dropping it once every frame in it has
+been deleted.
+"""
+import datetime
+import logging
+import os
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from roster import rollups, segments, storage, tasks, thumbnails, transcode
+from roster.models import Classroom, Workplace, WorkplaceScreenshot
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of frames examined by a single pass; the rest is picked up by the next one
+BATCH_SIZE = 1000
+
+# tiers: ((min age in days, timedelta between kept frames or None to delete), ...) by age
+Policy = namedtuple('Policy', ['keep_recent', 'tiers', 'compress_over_bytes', 'budget_bytes'])
+
+
+def policy(classroom_id=storage.CLASSROOM):
+    """Retention policy of a classroom (the model defaults if it has no row yet)"""
+    classroom = Classroom.objects.filter(pk=classroom_id).first() or Classroom(classroom_id=classroom_id)
+    tiers = tuple(sorted(
+        (int(age), datetime.timedelta(minutes=interval) if interval is not None else None)
+        for age, interval in classroom.retention_tiers
+    ))
+    return Policy(classroom.retention_keep_recent, tiers, classroom.retention_compress_over_bytes,
+                  classroom.retention_budget_bytes)
+
+
+def tier_index(policy, age_days):
+    """Index of the tier a day age_days old belongs to"""
+    index = 0
+    for i, (min_age, _) in enumerate(policy.tiers):
+        if age_days >= min_age:
+            index = i
+    return index
+
+
+def max_age(policy):
+    """Age past which frames are deleted, None if they are kept forever"""
+    for min_age, interval in policy.tiers:
+        if interval is None:
+            return datetime.timedelta(days=min_age)
+    return None
+
+
+def rotate_screenshots(workplace_dir, workplace=None):
+    """
+    Implements smart retention policy (see policy() for the numbers):
+    1. Keep the keep_recent most recent files as is.
+    2. For older files:
+       - Delete if older than the last tier.
+       - Keep only one file per first-tier interval.
+       - Delete others (and mark their DB records image_deleted).
+       - If kept file > compress_over_bytes, compress/resize it.
+    """
+    try:
+        if workplace is None:
+            _rotate_directory(workplace_dir, policy())
+        else:
+            _rotate_workplace(workplace_dir, workplace, policy())
+    except Exception as e:
+        logger.exception(f"Error in rotate_screenshots: {e}")
+
+
+def recent_cutoff(workplace, keep_recent):
+    """created_at of the oldest frame among the keep_recent newest ones; None if there are fewer"""
+    live = WorkplaceScreenshot.objects.filter(workplace=workplace, image_deleted=False)
+    if keep_recent == 0:
+        return timezone.now()
+    return live.order_by('-created_at').values_list('created_at', flat=True)[keep_recent - 1:keep_recent].first()
+
+
+def _rotate_workplace(workplace_dir, workplace, policy):
+    """Incremental pass over the frames of one workplace, driven by the screenshot index"""
+    workplace = Workplace.objects.get(pk=workplace.pk)
+    now = timezone.now()
+    live = WorkplaceScreenshot.objects.filter(workplace=workplace, image_deleted=False)
+    expires = now - max_age(policy) if max_age(policy) is not None else None
+    thin_interval = policy.tiers[0][1]
+
+    cutoff = recent_cutoff(workplace, policy.keep_recent)
+    if cutoff is None:
+        return
+
+    to_delete = []
+
+    # Frames that were kept by earlier passes and have now aged out
+    if workplace.retention_watermark and expires:
+        expired = live.filter(
+            created_at__lt=expires,
+            created_at__lte=workplace.retention_watermark,
+        ).values_list('id', 'screenshot_filename', 'created_at', 'file_size')
+        to_delete.extend(expired)
+
+    # Frames that left the recent window since the last pass
+    candidates = live.filter(created_at__lt=cutoff)
+    if workplace.retention_watermark:
+        candidates = candidates.filter(created_at__gt=workplace.retention_watermark)
+    candidates = candidates.order_by('created_at').values_list(
+        'id', 'screenshot_filename', 'created_at', 'file_size'
+    )[:BATCH_SIZE]
+
+    last_kept_at = workplace.retention_last_kept_at
+    watermark = workplace.retention_watermark
+
+    for shot_id, filename, created_at, file_size in candidates:
+        watermark = created_at
+        if (expires and created_at < expires) or thin_interval is None:
+            to_delete.append((shot_id, filename, created_at, file_size))
+        elif last_kept_at is not None and created_at - last_kept_at < thin_interval:
+            to_delete.append((shot_id, filename, created_at, file_size))
+        else:
+            last_kept_at = created_at
+            # Frames are resolved in either directory layout (roster.storage)
+            path = storage.locate(workplace_dir, filename)
+            if path is None:
+                continue
+            # Legacy PNGs kept for history are moved to the storage format on the way
+            transcoded = transcode.transcode_frame(os.path.dirname(path), os.path.basename(path), shot_id)
+            if transcoded:
+                filename, file_size = transcoded
+                path = os.path.join(os.path.dirname(path), filename)
+            new_size = _compress(path, policy.compress_over_bytes)
+            if new_size is not None and file_size is not None:
+                WorkplaceScreenshot.objects.filter(pk=shot_id).update(file_size=new_size)
+                rollups.image_resized(workplace.pk, created_at, new_size - file_size)
+
+    delete_frames(workplace_dir, workplace, to_delete)
+
+    if watermark != workplace.retention_watermark:
+        Workplace.objects.filter(pk=workplace.pk).update(
+            retention_watermark=watermark,
+            retention_last_kept_at=last_kept_at,
+        )
+
+
+def delete_frames(workplace_dir, workplace, frames):
+    """
+    Remove the images of frames ((id, filename, created_at, file_size) rows) and
+    mark their rows image_deleted; the rows themselves stay for the history.
+    Returns the bytes that left the disk.
+    """
+    freed = 0
+    for shot_id, filename, _, _ in frames:
+        path = storage.locate(workplace_dir, filename)
+        try:
+            if path is not None:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting {filename}: {e}")
+        thumbnails.invalidate(workplace_dir, filename)
+
+    if frames:
+        deleted_ids = [shot_id for shot_id, _, _, _ in frames]
+        WorkplaceScreenshot.objects.filter(id__in=deleted_ids).update(image_deleted=True)
+        rollups.images_deleted(workplace.pk, [(created_at, file_size) for _, _, created_at, file_size in frames])
+        if workplace.latest_screenshot_id in deleted_ids:
+            workplace.refresh_latest_screenshot()
+        freed += _reclaim_segments(workplace_dir, workplace, [filename for _, filename, _, _ in frames])
+    return freed
+
+
+def _reclaim_segments(workplace_dir, workplace, deleted_filenames):
+    """
+    Rewrite the segments of the days of deleted_filenames without their deleted
+    frames, or drop those without a live frame left; returns the bytes freed
+    """
+    day_dirs = {
+        storage.frame_dir(workplace_dir, filename)
+        for filename in deleted_filenames if storage.frame_date(filename)
+    }
+    freed = 0
+    for day_dir in day_dirs:
+        if not segments.exists(day_dir):
+            continue
+        names = segments.names(day_dir)
+        rows = WorkplaceScreenshot.objects.filter(workplace=workplace, screenshot_filename__in=names)
+        if not rows.filter(image_deleted=False).exists():
+            size = segments.drop(day_dir)
+            logger.info(f"Dropped segment {day_dir} ({size} bytes)")
+        else:
+            deleted = rows.filter(image_deleted=True).values_list('screenshot_filename', flat=True)
+            size = segments.remove(day_dir, {os.path.splitext(name)[0] for name in deleted})
+        freed += size
+    return freed
+
+
+def _compress(file_path, over_bytes):
+    """
+    Halve the resolution of a kept frame if it is larger than over_bytes,
+    re-encoded in its own format (lossy formats within half the frame byte budget).
+    Returns the new file size, or None if the file was left alone.
+    """
+    from PIL import Image
+
+    try:
+        size = os.path.getsize(file_path)
+        if size > over_bytes:
+            fmt = transcode.format_of(file_path) or 'png'
+            with Image.open(file_path) as img:
+                # As requested: "make smaller dimension"
+                w, h = img.size
+                resized = img.resize((int(w * 0.5), int(h * 0.5)), Image.Resampling.LANCZOS)
+            data, _ = transcode.encode(
+                transcode.convert_for(resized, fmt) if fmt != 'png' else resized, fmt,
+                target_bytes=settings.SCREENSHOT_TARGET_BYTES // 2,
+                lossless=settings.SCREENSHOT_STORAGE_LOSSLESS,
+            )
+            transcode.write_frame(file_path, data, like=file_path)
+            return len(data)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.error(f"Error compressing {file_path}: {e}")
+    return None
+
+
+def _rotate_directory(workplace_dir, policy):
+    """
+    Filesystem-only variant of the policy, used for directories that have no
+    Workplace row (e.g. teacher_pc) and therefore no screenshot index.
+    """
+    expiry = max_age(policy)
+    thin_interval = policy.tiers[0][1]
+    for day, day_dir in storage.day_dirs(workplace_dir):
+        if expiry and day < datetime.date.today() - expiry and segments.exists(day_dir):
+            segments.drop(day_dir)
+
+    files = list(storage.iter_frames(workplace_dir))
+    # Sort by modification time, newest first
+    files.sort(key=os.path.getmtime, reverse=True)
+
+    # We only care if we have more than keep_recent files
+    if len(files) <= policy.keep_recent:
+        return
+
+    last_kept_time = None
+
+    for file_path in files[policy.keep_recent:]:
+        basename = os.path.basename(file_path)
+        should_delete = False
+
+        try:
+            # Filename format: YYYYMMDD_HHMMSS.<ext> or YYYYMMDD_HHMM.<ext> (backward compatibility)
+            match = re.match(r'^(\d{8}_(\d{4,6}))\.(png|webp|avif)$', basename)
+            if not match:
+                # Unknown format, delete to be clean since it's old
+                should_delete = True
+            else:
+                ts_str = match.group(1)
+                if len(match.group(2)) == 6:
+                    dt = datetime.datetime.strptime(ts_str, "%Y%m%d_%H%M%S")
+                else:
+                    dt = datetime.datetime.strptime(ts_str, "%Y%m%d_%H%M")
+
+                if expiry and dt < datetime.datetime.now() - expiry:
+                    should_delete = True
+                elif last_kept_time is None:
+                    # This is the newest of the "old" batch. Keep it.
+                    last_kept_time = dt
+                elif thin_interval is None or abs(last_kept_time - dt) < thin_interval:
+                    should_delete = True
+                else:
+                    last_kept_time = dt
+        except ValueError:
+            should_delete = True
+
+        if should_delete:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                logger.error(f"Error deleting {file_path}: {e}")
+            continue
+
+        _compress(file_path, policy.compress_over_bytes)
+
+
+def schedule_rotation(workplace_dir, workplace=None):
+    """Queue a retention pass for a workplace directory; repeated triggers are coalesced"""
+    return tasks.submit(('rotate', str(workplace_dir)), rotate_screenshots, str(workplace_dir), workplace)
@@ -0,0 +1,218 @@
+"""
+Daily screenshot rollups for the history calendar.
+
+ScreenshotDayRollup holds, per local date and workplace, how many frames were
+taken, how many still have their image and how many bytes those take, the
+first and last frame time, the users seen and the repeated uploads that were
+not stored (roster.dedupe). A row is updated when a screenshot is created or
+deleted (roster.signals) and when retention removes or recompresses images
+(roster.retention), so the dates and summary endpoints read a few rows per
+day instead of the screenshot table.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from roster.models import ScreenshotDayRollup, WorkplaceScreenshot
+
+
+def local_date(value):
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def record_screenshot(screenshot):
+    """Count a new frame in its day's rollup"""
+    with transaction.atomic():
+        rollup, _ = ScreenshotDayRollup.objects.select_for_update().get_or_create(
+            date=local_date(screenshot.created_at), workplace_id=screenshot.workplace_id
+        )
+        rollup.frames += 1
+        if not screenshot.image_deleted:
+            rollup.frames_kept += 1
+            rollup.bytes += screenshot.file_size or 0
+        rollup.first_at = min(filter(None, [rollup.first_at, screenshot.created_at]))
+        rollup.last_at = max(filter(None, [rollup.last_at, screenshot.created_at]))
+        if screenshot.user_id and screenshot.user_id not in rollup.user_ids:
+            rollup.user_ids.append(screenshot.user_id)
+        rollup.save()
+
+
+def frame_skipped(workplace_id, seen_at, size):
+    """Count an upload that repeated the latest frame and was not stored"""
+    day = local_date(seen_at)
+    updated = ScreenshotDayRollup.objects.filter(date=day, workplace_id=workplace_id).update(
+        skipped_frames=F('skipped_frames') + 1, skipped_bytes=F('skipped_bytes') + size
+    )
+    if not updated:
+        # First frame of the day repeats yesterday's
+        with transaction.atomic():
+            rollup, _ = ScreenshotDayRollup.objects.select_for_update().get_or_create(date=day, workplace_id=workplace_id)
+            rollup.skipped_frames += 1
+            rollup.skipped_bytes += size
+            rollup.save()
+
+
+def forget_screenshot(screenshot):
+    """Take a deleted screenshot row out of its day's counts (its user stays among those seen)"""
+    kept = 0 if screenshot.image_deleted else 1
+    size = 0 if screenshot.image_deleted else screenshot.file_size or 0
+    ScreenshotDayRollup.objects.filter(
+        date=local_date(screenshot.created_at), workplace_id=screenshot.workplace_id
+    ).update(frames=F('frames') - 1, frames_kept=F('frames_kept') - kept, bytes=F('bytes') - size)
+
+
+def images_deleted(workplace_id, frames):
+    """frames: (created_at, file_size) of frames whose image retention removed"""
+    by_day = defaultdict(lambda: [0, 0])
+    for created_at, file_size in frames:
+        totals = by_day[local_date(created_at)]
+        totals[0] += 1
+        totals[1] += file_size or 0
+    for day, (count, size) in by_day.items():
+        ScreenshotDayRollup.objects.filter(date=day, workplace_id=workplace_id).update(
+            frames_kept=F('frames_kept') - count, bytes=F('bytes') - size
+        )
+
+
+def image_resized(workplace_id, created_at, delta):
+    """A kept frame was recompressed and its file changed size by delta bytes"""
+    ScreenshotDayRollup.objects.filter(date=local_date(created_at), workplace_id=workplace_id).update(
+        bytes=F('bytes') + delta
+    )
+
+
+def images_resized(workplace_id, changes):
+    """changes: (created_at, size delta) of kept frames that were re-encoded"""
+    by_day = defaultdict(int)
+    for created_at, delta in changes:
+        by_day[local_date(created_at)] += delta
+    for day, delta in by_day.items():
+        if delta:
+            ScreenshotDayRollup.objects.filter(date=day, workplace_id=workplace_id).update(bytes=F('bytes') + delta)
+
+
+def summarize(rows):
+    """
+    Rollup fields from (workplace_id, created_at, user_id, image_deleted, file_size)
+    rows: {(date, workplace_id): {field: value}}
+    """
+    rollups = {}
+    for workplace_id, created_at, user_id, image_deleted, file_size in rows:
+        key = (local_date(created_at), workplace_id)
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = {
+                'frames': 0, 'frames_kept': 0, 'bytes': 0,
+                'first_at': created_at, 'last_at': created_at, 'user_ids': [],
+            }
+        rollup['frames'] += 1
+        if not image_deleted:
+            rollup['frames_kept'] += 1
+            rollup['bytes'] += file_size or 0
+        rollup['first_at'] = min(rollup['first_at'], created_at)
+        rollup['last_at'] = max(rollup['last_at'], created_at)
+        if user_id and user_id not in rollup['user_ids']:
+            rollup['user_ids'].append(user_id)
+    return rollups
+
+
+def add_frames(rows):
+    """Count frames created without signals (bulk_create); rows as for summarize()"""
+    for (day, workplace_id), fields in summarize(rows).items():
+        with transaction.atomic():
+            rollup, _ = ScreenshotDayRollup.objects.select_for_update().get_or_create(date=day, workplace_id=workplace_id)
+            rollup.frames += fields['frames']
+            rollup.frames_kept += fields['frames_kept']
+            rollup.bytes += fields['bytes']
+            rollup.first_at = min(filter(None, [rollup.first_at, fields['first_at']]))
+            rollup.last_at = max(filter(None, [rollup.last_at, fields['last_at']]))
+            rollup.user_ids.extend(u for u in fields['user_ids'] if u not in rollup.user_ids)
+            rollup.save()
+
+
+def rebuild():
+    """
+    Recompute the rollup columns that follow from the screenshot table. Skipped
+    repeats and retention tiers are not recorded anywhere else, so existing
+    rows keep them, and a day is only dropped when it has neither.
+    """
+    rows = WorkplaceScreenshot.objects.order_by().values_list(
+        'workplace_id', 'created_at', 'user_id', 'image_deleted', 'file_size'
+    ).iterator(chunk_size=2000)
+    rollups = summarize(rows)
+    empty = {'frames': 0, 'frames_kept': 0, 'bytes': 0, 'first_at': None, 'last_at': None, 'user_ids': []}
+    with transaction.atomic():
+        updated, dropped = [], []
+        for rollup in ScreenshotDayRollup.objects.select_for_update():
+            fields = rollups.pop((rollup.date, rollup.workplace_id), None)
+            if fields is None and not rollup.skipped_frames and not rollup.retention_tier:
+                dropped.append(rollup.pk)
+                continue
+            for name, value in (fields or empty).items():
+                setattr(rollup, name, value)
+            updated.append(rollup)
+        ScreenshotDayRollup.objects.filter(pk__in=dropped).delete()
+        ScreenshotDayRollup.objects.bulk_update(updated, list(empty), batch_size=1000)
+        ScreenshotDayRollup.objects.bulk_create([
+            ScreenshotDayRollup(date=day, workplace_id=workplace_id, **fields)
+            for (day, workplace_id), fields in rollups.items()
+        ], batch_size=1000)
+
+
+def _in_range(qs, start, end):
+    if start:
+        qs = qs.filter(date__gte=start)
+    if end:
+        qs = qs.filter(date__lte=end)
+    return qs
+
+
+def dates(start=None, end=None):
+    """Dates with at least one frame, newest first"""
+    qs = _in_range(ScreenshotDayRollup.objects.filter(frames__gt=0), start, end)
+    return list(qs.order_by('-date').values_list('date', flat=True).distinct())
+
+
+def summary(start=None, end=None):
+    """Activity per date (all workplaces together), oldest first"""
+    active = Q(frames__gt=0) | Q(skipped_frames__gt=0)
+    qs = _in_range(ScreenshotDayRollup.objects.filter(active), start, end)
+    days = {}
+    for rollup in qs.order_by('date', 'workplace_id'):
+        day = days.get(rollup.date)
+        if day is None:
+            day = days[rollup.date] = {
+                'date': rollup.date.isoformat(), 'frames': 0, 'frames_kept': 0, 'bytes': 0,
+                'skipped_frames': 0, 'skipped_bytes': 0, 'workplaces': 0, 'users': set(),
+                'first_at': rollup.first_at, 'last_at': rollup.last_at,
+            }
+        day['frames'] += rollup.frames
+        day['frames_kept'] += rollup.frames_kept
+        day['bytes'] += rollup.bytes
+        day['skipped_frames'] += rollup.skipped_frames
+        day['skipped_bytes'] += rollup.skipped_bytes
+        day['workplaces'] += 1
+        day['users'].update(rollup.user_ids)
+        day['first_at'] = min(filter(None, [day['first_at'], rollup.first_at]), default=None)
+        day['last_at'] = max(filter(None, [day['last_at'], rollup.last_at]), default=None)
+
+    result = []
+    for day in days.values():
+        day['users'] = len(day['users'])
+        day['first_at'] = day['first_at'] and day['first_at'].isoformat()
+        day['last_at'] = day['last_at'] and day['last_at'].isoformat()
+        result.append(day)
+    return result
+
+
+def parse_range(params):
+    """(start, end) dates from ?from=&to= (YYYY-MM-DD); raises ValueError"""
+    start = end = None
+    if params.get('from'):
+        start = datetime.datetime.strptime(params['from'], '%Y-%m-%d').date()
+    if params.get('to'):
+        end = datetime.datetime.strptime(params['to'], '%Y-%m-%d').date()
+    return start, end
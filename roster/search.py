@@ -0,0 +1,224 @@
+"""
+Full-text index over screenshot metadata.
+
+On SQLite the searchable text of every WorkplaceScreenshot (OS username,
+student name and username, window titles) is mirrored into the FTS5 table
+roster_screenshot_fts, keyed by the screenshot id. roster.signals keeps it in
+sync when screenshots are saved or deleted and when a user is renamed.
+
+Queries are split into words; each word matches as a prefix, "quoted text"
+matches as a phrase. Results are ordered by bm25 rank, ties newest first.
+
+bm25 scores move as screenshots are indexed (they depend on the statistics of
+the whole table), so pages are not keyed on the score. The first page ranks
+every match up to MAX_RESULTS and keeps the ids for RESULTS_TTL seconds;
+further pages are slices of that list, and the cursor is (highest id at the
+first page, offset). A process that no longer has the list ranks the matches
+up to that id again, so new screenshots never enter a query being paged.
+
+Other database backends have no index: search() returns None and the caller
+falls back to icontains lookups.
+"""
+import json
+import re
+import threading
+import time
+
+from django.db import connection
+
+TABLE = 'roster_screenshot_fts'
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "os_username, user_name, window_titles, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+# Ranked matches kept per query, for how long, and how many queries
+MAX_RESULTS = 10000
+RESULTS_TTL = 600
+RESULTS_KEPT = 64
+
+_lock = threading.Lock()
+_results = {}
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """
+    Translate a search box query into an FTS5 MATCH expression, or None if it
+    has no searchable words.
+    """
+    terms = []
+    for phrase, word in TERM_RE.findall(query):
+        text = phrase or word
+        if not re.search(r'\w', text):
+            continue
+        text = text.replace('"', ' ')
+        terms.append(f'"{text}"' if phrase else f'"{text}"*')
+    return ' '.join(terms) or None
+
+
+def _user_name(last_name, first_name, username):
+    return ' '.join(part for part in (last_name, first_name, username) if part)
+
+
+def _window_titles(value):
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value
+    if isinstance(value, list):
+        return '\n'.join(str(title) for title in value)
+    return str(value or '')
+
+
+def index_screenshot(screenshot):
+    if not is_available():
+        return
+    user = screenshot.user
+    user_name = _user_name(user.last_name, user.first_name, user.username) if user else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [screenshot.pk])
+        cursor.execute(
+            f"INSERT INTO {TABLE} (rowid, os_username, user_name, window_titles) VALUES (%s, %s, %s, %s)",
+            [screenshot.pk, screenshot.os_username or '', user_name, _window_titles(screenshot.window_titles)],
+        )
+
+
+def unindex_screenshot(screenshot_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [screenshot_id])
+
+
+def reindex_user(user):
+    """Refresh the indexed name on all screenshots of a user"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {TABLE} SET user_name = %s WHERE rowid IN "
+            "(SELECT id FROM roster_workplacescreenshot WHERE user_id = %s)",
+            [_user_name(user.last_name, user.first_name, user.username), user.pk],
+        )
+
+
+def rebuild(using=None, batch_size=1000):
+    """Re-create the index contents from roster_workplacescreenshot, batch_size rows at a time"""
+    conn = using or connection
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        last_id = 0
+        while True:
+            cursor.execute(
+                "SELECT s.id, s.os_username, u.last_name, u.first_name, u.username, s.window_titles "
+                "FROM roster_workplacescreenshot s LEFT JOIN auth_user u ON u.id = s.user_id "
+                "WHERE s.id > %s ORDER BY s.id LIMIT %s",
+                [last_id, batch_size],
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, os_username, user_name, window_titles) VALUES (%s, %s, %s, %s)",
+                [
+                    (shot_id, os_username or '', _user_name(last, first, username), _window_titles(titles))
+                    for shot_id, os_username, last, first, username, titles in rows
+                ],
+            )
+            last_id = rows[-1][0]
+
+
+def _ranked(expression, where, params, max_id):
+    """Ids of the matches up to max_id, best first, as kept for paging"""
+    key = (expression, tuple(where), tuple(params), max_id)
+    now = time.monotonic()
+    with _lock:
+        cached = _results.get(key)
+        if cached is not None and now - cached[0] < RESULTS_TTL:
+            return cached[1]
+
+    with connection.cursor() as db:
+        # bm25() is lower for better matches; ties go to the newest screenshot
+        db.execute(
+            f"SELECT s.id FROM {TABLE} JOIN roster_workplacescreenshot s ON s.id = {TABLE}.rowid "
+            f"WHERE {' AND '.join(where)} AND s.id <= %s ORDER BY bm25({TABLE}), s.id DESC LIMIT %s",
+            params + [max_id, MAX_RESULTS],
+        )
+        ids = [row[0] for row in db.fetchall()]
+
+    with _lock:
+        for stale in [k for k, (at, _) in _results.items() if now - at >= RESULTS_TTL]:
+            del _results[stale]
+        while len(_results) >= RESULTS_KEPT:
+            del _results[next(iter(_results))]
+        _results[key] = (now, ids)
+    return ids
+
+
+def invalidate():
+    with _lock:
+        _results.clear()
+
+
+def search(query, start=None, end=None, include_deleted=False, limit=100, cursor=None):
+    """
+    Ranked search over the index.
+
+    start/end bound created_at (end exclusive); cursor is the value returned
+    for the previous page (ValueError or TypeError if it is malformed).
+    Returns (ids, total, next_cursor), where total is only counted for the
+    first page, or None if the backend has no index.
+    """
+    if not is_available():
+        return None
+    expression = match_expression(query)
+    if expression is None:
+        return [], 0, None
+
+    where = [f"{TABLE} MATCH %s"]
+    params = [expression]
+    if not include_deleted:
+        where.append("s.image_deleted = %s")
+        params.append(False)
+    if start is not None:
+        where.append("s.created_at >= %s")
+        params.append(connection.ops.adapt_datetimefield_value(start))
+    if end is not None:
+        where.append("s.created_at < %s")
+        params.append(connection.ops.adapt_datetimefield_value(end))
+
+    if cursor:
+        max_id, offset = int(cursor[0]), int(cursor[1])
+        if offset < 0:
+            raise ValueError(f"Invalid offset {offset}")
+    else:
+        with connection.cursor() as db:
+            db.execute("SELECT MAX(id) FROM roster_workplacescreenshot")
+            max_id, offset = db.fetchone()[0] or 0, 0
+
+    ids = _ranked(expression, where, params, max_id)
+    total = None
+    if not cursor:
+        if len(ids) < MAX_RESULTS:
+            total = len(ids)
+        else:
+            with connection.cursor() as db:
+                db.execute(
+                    f"SELECT COUNT(*) FROM {TABLE} JOIN roster_workplacescreenshot s ON s.id = {TABLE}.rowid "
+                    f"WHERE {' AND '.join(where)} AND s.id <= %s",
+                    params + [max_id],
+                )
+                total = db.fetchone()[0]
+
+    page = ids[offset:offset + limit]
+    next_cursor = [max_id, offset + limit] if offset + limit < len(ids) else None
+    return page, total, next_cursor
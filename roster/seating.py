@@ -0,0 +1,154 @@
+"""
+Automatic seating of a whole student group.
+
+The solver places every student of a group on a free seat so that all enabled
+group features hold: non_sequential members keep min_distance seats apart from
+each other and from members who are already seated this lesson. It is a
+backtracking search over seat bitsets (see roster.features): the student with
+the fewest remaining seats is placed first and every placement immediately
+removes the conflicting seats from the other students' domains. Branches
+where the remaining students of a group can no longer fit are cut early.
+"""
+from django.db import transaction
+
+from roster import features
+from roster.models import WorkplaceUserPlacement
+
+WORKPLACE_ID_FORMAT = '329-{}'
+# Upper bound on search nodes; a 19-seat room needs far fewer
+MAX_NODES = 100000
+
+
+class SeatingError(Exception):
+    pass
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+def _packing(mask, distance):
+    """How many seats of mask can be taken with more than distance seats between any two (greedy is exact on a line)"""
+    count = 0
+    while mask:
+        bit = mask & -mask
+        count += 1
+        mask &= ~features.dilate(bit, distance) & ~bit
+    return count
+
+
+def _fits(domains, conflicts):
+    """
+    Cheap necessary condition: when every pair of remaining students conflicts,
+    they all have to fit into the union of their seats at the smallest distance.
+    """
+    students = list(domains)
+    distance = None
+    for i, student in enumerate(students):
+        row = conflicts.get(student, {})
+        for other in students[i + 1:]:
+            d = row.get(other)
+            if not d:
+                return True
+            distance = d if distance is None else min(distance, d)
+    if distance is None:
+        return True
+    union = 0
+    for domain in domains.values():
+        union |= domain
+    return _packing(union, distance) >= len(students)
+
+
+def solve(domains, conflicts, max_nodes=MAX_NODES):
+    """
+    domains: {student: bitset of seats allowed for them}
+    conflicts: {student: {other student: min distance}} (symmetric)
+    Returns {student: seat} with every student on a distinct seat and
+    conflicting students further apart than their distance, or None.
+    """
+    assignment = {}
+    nodes = 0
+
+    def search(domains):
+        nonlocal nodes
+        if not domains:
+            return True
+        if not _fits(domains, conflicts):
+            return False
+        student = min(domains, key=lambda s: (_popcount(domains[s]), s))
+        mask = domains[student]
+        while mask:
+            bit = mask & -mask
+            mask ^= bit
+            nodes += 1
+            if nodes > max_nodes:
+                return False
+
+            seat = bit.bit_length() - 1
+            remaining = {}
+            for other, domain in domains.items():
+                if other == student:
+                    continue
+                distance = conflicts.get(student, {}).get(other)
+                domain &= ~(features.dilate(bit, distance) if distance else bit)
+                if not domain:
+                    break
+                remaining[other] = domain
+            else:
+                assignment[student] = seat
+                if search(remaining):
+                    return True
+                del assignment[student]
+        return False
+
+    if search(dict(domains)):
+        return dict(assignment)
+    return None
+
+
+def plan_group(group, seats=None, students=None):
+    """
+    Compute seats for the group's students who have no placement this lesson.
+    seats limits the workplace numbers to use (default: every free seat).
+    Returns {user_id: seat number}; raises SeatingError if no valid seating exists.
+    """
+    constraints = features.get_constraints()
+    occupancy = features.get_occupancy()
+
+    free = features.ALL_SEATS & ~occupancy.occupied
+    if seats is not None:
+        free &= features.seats_mask(seats)
+
+    if students is None:
+        students = group.students.values_list('id', flat=True)
+    students = sorted(set(students) - set(occupancy.user_seats))
+    if not students:
+        return {}
+    if len(students) > _popcount(free):
+        raise SeatingError(f"Недостатньо вільних місць: учнів {len(students)}, місць {_popcount(free)}")
+
+    domains = {}
+    conflicts = {student: {} for student in students}
+    for student in students:
+        domains[student] = free & ~occupancy.forbidden_for(student, constraints)
+        for constraint in constraints.by_user.get(student, ()):
+            for other in constraint.members:
+                if other != student and other in conflicts:
+                    distance = max(conflicts[student].get(other, 0), constraint.min_distance)
+                    conflicts[student][other] = conflicts[other][student] = distance
+
+    assignment = solve(domains, conflicts)
+    if assignment is None:
+        raise SeatingError("Не вдалося розсадити групу з урахуванням налаштувань групи")
+    return assignment
+
+
+def assign_group(group, seats=None, students=None):
+    """Seat the group (see plan_group) and store all placements in one transaction"""
+    assignment = plan_group(group, seats, students)
+    with transaction.atomic():
+        placements = [
+            WorkplaceUserPlacement.objects.create(user_id=user_id, workplace_id=WORKPLACE_ID_FORMAT.format(seat))
+            for user_id, seat in sorted(assignment.items(), key=lambda item: item[1])
+        ]
+    return placements
@@ -0,0 +1,320 @@
+"""
+Packed per-day segments for cold screenshot frames.
+
+Once a day of a workplace is older than SCREENSHOT_SEGMENT_AFTER_DAYS, its
+frames are no longer rewritten by retention, and keeping them as loose files
+only costs inodes: backups and directory scans visit every one of them.
+`manage.py compact_screenshots` packs each such day directory
+
+    <classroom>/<workplace>/YYYY/MM/DD/<frames>
+
+into two files next to it:
+
+    DD.seg  the frame bytes, appended one after another
+    DD.idx  the inode of DD.seg it describes, then a sorted index: per frame
+            its timestamp stem, format, offset, length and original mtime
+            (INDEX_RECORD, 37 bytes)
+
+Packing only appends to a segment. Frames are written and fsync-ed before the
+new index replaces the old one, and the loose files are removed last, so a
+frame is always readable from one place or the other. Readers map segments
+with mmap and hand out memoryview slices of the mapping, so serving a frame
+does not copy it through a read buffer.
+
+Retention frees a segment all at once (drop()) when every frame in it has
+expired, and rewrites it without the frames it deleted otherwise (remove()).
+A rewritten segment replaces the old file before its index does; a reader
+that sees an index and a segment of different inodes loads them again.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from roster import transcode
+
+SEGMENT_EXTENSION = '.seg'
+INDEX_EXTENSION = '.idx'
+INDEX_MAGIC = b'RSI2'
+# Indexes written before segments were rewritten carry no inode
+INDEX_MAGIC_V1 = b'RSI1'
+INDEX_HEADER = struct.Struct('<Q')
+# stem (NUL-padded), format code, offset, length, mtime (seconds)
+INDEX_RECORD = struct.Struct('<16sBQIQ')
+FORMAT_CODES = list(transcode.FORMATS)
+# Mapped segments kept open between requests
+MAX_OPEN_SEGMENTS = 64
+# Attempts at loading an index and segment of the same rewrite
+LOAD_ATTEMPTS = 5
+
+Entry = namedtuple('Entry', ['stem', 'format', 'offset', 'length', 'mtime'])
+Frame = namedtuple('Frame', ['data', 'filename', 'mtime', 'segment'])
+
+
+def segment_path(day_dir):
+    return day_dir.rstrip(os.sep) + SEGMENT_EXTENSION
+
+
+def index_path(day_dir):
+    return day_dir.rstrip(os.sep) + INDEX_EXTENSION
+
+
+def entry_filename(entry):
+    return entry.stem + transcode.FORMATS[entry.format][1]
+
+
+def _encode_index(entries, segment_inode):
+    records = [
+        INDEX_RECORD.pack(e.stem.encode(), FORMAT_CODES.index(e.format), e.offset, e.length, int(e.mtime))
+        for e in entries
+    ]
+    return INDEX_MAGIC + INDEX_HEADER.pack(segment_inode) + b''.join(records)
+
+
+def _decode_index(data):
+    """(inode of the segment or None, entries)"""
+    if data.startswith(INDEX_MAGIC):
+        segment_inode, = INDEX_HEADER.unpack_from(data, len(INDEX_MAGIC))
+        records = data[len(INDEX_MAGIC) + INDEX_HEADER.size:]
+    elif data.startswith(INDEX_MAGIC_V1):
+        segment_inode, records = None, data[len(INDEX_MAGIC_V1):]
+    else:
+        raise ValueError("not a segment index")
+    entries = []
+    for stem, code, offset, length, mtime in INDEX_RECORD.iter_unpack(records):
+        entries.append(Entry(stem.rstrip(b'\0').decode(), FORMAT_CODES[code], offset, length, mtime))
+    return segment_inode, entries
+
+
+class SegmentCache:
+    """Parsed indexes and open mappings of recently read segments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()
+        self.reads = 0
+        self.bytes_read = 0
+        self.maps_opened = 0
+
+    def _load(self, day_dir):
+        """(entries, stems, mapping) of a day's segment; None if it has none"""
+        for _ in range(LOAD_ATTEMPTS):
+            idx = index_path(day_dir)
+            try:
+                st = os.stat(idx)
+            except FileNotFoundError:
+                return None
+            key = (st.st_mtime_ns, st.st_size)
+            with self._lock:
+                cached = self._segments.get(day_dir)
+                if cached is not None and cached[0] == key:
+                    self._segments.move_to_end(day_dir)
+                    return cached[1:]
+
+            try:
+                with open(idx, 'rb') as f:
+                    segment_inode, entries = _decode_index(f.read())
+                mapping = b''
+                with open(segment_path(day_dir), 'rb') as f:
+                    seg_st = os.fstat(f.fileno())
+                    if segment_inode is not None and seg_st.st_ino != segment_inode:
+                        continue  # Caught between the two replaces of a rewrite
+                    if seg_st.st_size:
+                        # Mapped read-only; the mapping outlives the file object
+                        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                continue  # Dropped or rewritten meanwhile
+            break
+        else:
+            return None
+        stems = [e.stem for e in entries]
+
+        with self._lock:
+            self.maps_opened += 1
+            self._segments[day_dir] = (key, entries, stems, mapping)
+            self._segments.move_to_end(day_dir)
+            # Evicted mappings are not closed here: responses may still hold slices of
+            # them, and the mapping is released when the last slice is
+            while len(self._segments) > MAX_OPEN_SEGMENTS:
+                self._segments.popitem(last=False)
+        return entries, stems, mapping
+
+    def entries(self, day_dir):
+        loaded = self._load(day_dir)
+        return loaded[0] if loaded else []
+
+    def read(self, day_dir, filename):
+        """Frame stored under filename's stem in a day's segment, or None"""
+        loaded = self._load(day_dir)
+        if not loaded:
+            return None
+        entries, stems, mapping = loaded
+        stem = os.path.splitext(filename)[0]
+        i = bisect.bisect_left(stems, stem)
+        if i == len(stems) or stems[i] != stem:
+            return None
+        entry = entries[i]
+        data = memoryview(mapping)[entry.offset:entry.offset + entry.length]
+        with self._lock:
+            self.reads += 1
+            self.bytes_read += entry.length
+        return Frame(data, entry_filename(entry), entry.mtime, segment_path(day_dir))
+
+    def forget(self, day_dir):
+        with self._lock:
+            self._segments.pop(day_dir, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open_segments': len(self._segments),
+                'maps_opened': self.maps_opened,
+                'reads': self.reads,
+                'bytes_read': self.bytes_read,
+            }
+
+
+cache = SegmentCache()
+
+
+def names(day_dir):
+    """Frame names stored in a day's segment"""
+    return [entry_filename(e) for e in cache.entries(day_dir)]
+
+
+def read(day_dir, filename):
+    return cache.read(day_dir, filename)
+
+
+def _fsync_write(path, data):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def compact_day(day_dir):
+    """
+    Append the loose frames of a day directory to its segment and remove them.
+    Returns (frames packed, bytes packed).
+    """
+    try:
+        loose = sorted(name for name in os.listdir(day_dir) if transcode.is_frame(name))
+    except FileNotFoundError:
+        return 0, 0
+
+    entries = {e.stem: e for e in cache.entries(day_dir)}
+    seg = segment_path(day_dir)
+    packed, size = [], 0
+    with open(seg, 'ab') as out:
+        offset = out.tell()
+        segment_inode = os.fstat(out.fileno()).st_ino
+        for name in loose:
+            stem, fmt = os.path.splitext(name)[0], transcode.format_of(name)
+            if stem in entries or len(stem.encode()) > 16:
+                continue  # Already packed (an interrupted run) or a name the index cannot hold
+            path = os.path.join(day_dir, name)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            out.write(data)
+            entries[stem] = Entry(stem, fmt, offset, len(data), mtime)
+            offset += len(data)
+            size += len(data)
+            packed.append(name)
+        out.flush()
+        os.fsync(out.fileno())
+
+    if packed:
+        _fsync_write(index_path(day_dir), _encode_index(sorted(entries.values()), segment_inode))
+    elif not entries:
+        os.remove(seg)
+        return 0, 0
+
+    # Loose copies go only once the index that replaces them is in place
+    for name in loose:
+        if os.path.splitext(name)[0] in entries:
+            os.remove(os.path.join(day_dir, name))
+    try:
+        os.rmdir(day_dir)
+    except OSError:
+        pass  # Something besides packed frames is left
+    return len(packed), size
+
+
+def drop(day_dir):
+    """Delete a day's segment and index; returns the bytes freed"""
+    freed = 0
+    for path in (index_path(day_dir), segment_path(day_dir)):
+        try:
+            freed += os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    cache.forget(day_dir)
+    return freed
+
+
+def remove(day_dir, stems):
+    """
+    Rewrite a day's segment without the frames of stems (drop it if none is
+    left); returns the bytes freed on disk.
+    """
+    entries = cache.entries(day_dir)
+    kept = [e for e in entries if e.stem not in stems]
+    if len(kept) == len(entries):
+        return 0
+    if not kept:
+        return drop(day_dir)
+
+    seg, idx = segment_path(day_dir), index_path(day_dir)
+    before = os.path.getsize(seg) + os.path.getsize(idx)
+    tmp_path = f"{seg}.{threading.get_ident()}.tmp"
+    rewritten = []
+    with open(seg, 'rb') as src, open(tmp_path, 'wb') as out:
+        for entry in kept:
+            src.seek(entry.offset)
+            rewritten.append(entry._replace(offset=out.tell()))
+            out.write(src.read(entry.length))
+        out.flush()
+        os.fsync(out.fileno())
+        segment_inode = os.fstat(out.fileno()).st_ino
+    # Segment first: until the index follows, readers see two inodes and retry
+    os.replace(tmp_path, seg)
+    _fsync_write(idx, _encode_index(rewritten, segment_inode))
+    cache.forget(day_dir)
+    return before - os.path.getsize(seg) - os.path.getsize(idx)
+
+
+def exists(day_dir):
+    return os.path.exists(index_path(day_dir))
+
+
+def tree_stats(root=None):
+    """Files (inodes) and bytes under SCREENSHOTS_ROOT, and the seconds a full walk took"""
+    import time
+
+    root = root or str(settings.SCREENSHOTS_ROOT)
+    started = time.monotonic()
+    files = size = 0
+    for dir_path, _, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                continue
+            files += 1
+    return {'files': files, 'bytes': size, 'walk_seconds': round(time.monotonic() - started, 3)}
+
+
+def stats():
+    return cache.stats()
@@ -0,0 +1,150 @@
+"""
+File responses for screenshots and their thumbnails.
+
+Screenshot files are written once, so they are served with validators
+(ETag/Last-Modified), long-lived private caching and single-range support.
+With SCREENSHOT_SENDFILE_BACKEND set, the byte transfer is handed to the front
+proxy through X-Accel-Redirect (nginx) or X-Sendfile (apache, lighttpd).
+Frames packed into segments (roster.segments) are served from their mapped
+bytes by serve_buffer(), with the same validators and ranges.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def serve_file(request, path, content_type):
+    """Serve path with conditional GET, caching headers and Range support"""
+    st = os.stat(path)
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    last_modified = int(st.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if settings.SCREENSHOT_SENDFILE_BACKEND:
+            response = _offloaded_response(path, content_type)
+        else:
+            response = _file_response(request, path, content_type, st.st_size, etag, last_modified)
+        response['Accept-Ranges'] = 'bytes'
+    return _finish(response, etag, last_modified)
+
+
+def serve_buffer(request, data, content_type, mtime):
+    """Serve a bytes-like object (e.g. a memoryview of a mapped segment) like serve_file"""
+    size = len(data)
+    last_modified = int(mtime)
+    etag = f'"{size:x}-{last_modified * 10 ** 9:x}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        byte_range = _requested_range(request, size, etag, last_modified)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        else:
+            start, end = byte_range or (0, size - 1)
+            response = StreamingHttpResponse(
+                _slice_chunks(data, start, end), status=206 if byte_range else 200, content_type=content_type
+            )
+            response['Content-Length'] = str(end - start + 1)
+            if byte_range:
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+    return _finish(response, etag, last_modified)
+
+
+def _finish(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, max_age=settings.SCREENSHOT_CACHE_MAX_AGE, immutable=True)
+    return response
+
+
+def _offloaded_response(path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if settings.SCREENSHOT_SENDFILE_BACKEND == 'nginx':
+        relative = os.path.relpath(path, settings.SCREENSHOT_SENDFILE_ROOT).replace(os.sep, '/')
+        response['X-Accel-Redirect'] = settings.SCREENSHOT_SENDFILE_URL_PREFIX + quote(relative)
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def _file_response(request, path, content_type, size, etag, last_modified):
+    byte_range = _requested_range(request, size, etag, last_modified)
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range
+    response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def _requested_range(request, size, etag, last_modified):
+    """
+    Returns (start, end) for a satisfiable single range, False for an
+    unsatisfiable one and None when the whole file should be sent.
+    """
+    header = request.META.get('HTTP_RANGE', '').strip()
+    if not header:
+        return None
+
+    # A stale If-Range validator means the client wants the full, current file
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+
+    match = RANGE_RE.match(header)
+    if not match:
+        # Multiple or malformed ranges: ignoring Range is allowed
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        start, end = max(0, size - length), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _slice_chunks(data, start, end):
+    view = memoryview(data)
+    for offset in range(start, end + 1, CHUNK_SIZE):
+        yield view[offset:min(offset + CHUNK_SIZE, end + 1)]
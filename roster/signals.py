@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from roster import agent_config, events, features, rollups, search, suggestions, user_index
+from roster.models import WorkplaceUserPlacement, WorkplaceScreenshot, Classroom, StudentGroup, StudentGroupFeature
+
+
+@receiver(post_save, sender=WorkplaceUserPlacement)
+@receiver(post_delete, sender=WorkplaceUserPlacement)
+def placement_changed(sender, instance, **kwargs):
+    if 'created' in kwargs:
+        features.placement_saved(instance, kwargs['created'])
+        if kwargs['created']:
+            suggestions.record_placement(instance)
+    else:
+        features.invalidate_occupancy()
+    events.publish('placement', instance.workplace_number, {
+        'placement_id': instance.id,
+        'workplace_id': instance.workplace_id,
+        'removed': 'created' not in kwargs,
+    })
+
+
+@receiver(post_save, sender=WorkplaceScreenshot)
+def screenshot_saved(sender, instance, created, **kwargs):
+    search.index_screenshot(instance)
+    if created:
+        rollups.record_screenshot(instance)
+        events.publish('screenshot', instance.workplace.workplace_number, {
+            'filename': instance.screenshot_filename,
+        })
+
+
+@receiver(post_delete, sender=WorkplaceScreenshot)
+def screenshot_deleted(sender, instance, **kwargs):
+    search.unindex_screenshot(instance.pk)
+    rollups.forget_screenshot(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins save last_login alone; only name changes reach the indexes
+    if update_fields is not None and not user_index.NAME_FIELDS & update_fields:
+        return
+    if user_index.update_user(instance) and not created:
+        search.reindex_user(instance)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    user_index.remove_user(instance.pk)
+    features.invalidate_constraints()
+
+
+@receiver(post_save, sender=StudentGroupFeature)
+@receiver(post_delete, sender=StudentGroupFeature)
+@receiver(post_delete, sender=StudentGroup)
+@receiver(m2m_changed, sender=StudentGroup.students.through)
+def group_constraints_changed(sender, **kwargs):
+    features.invalidate_constraints()
+
+
+@receiver(post_save, sender=Classroom)
+def classroom_saved(sender, instance, **kwargs):
+    agent_config.invalidate(instance.classroom_id)
+    events.publish('settings', payload={
+        'screenshots_enabled': instance.screenshots_enabled,
+        'screenshot_interval': instance.screenshot_interval,
+    }, classroom_id=instance.classroom_id)
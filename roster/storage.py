@@ -0,0 +1,250 @@
+"""
+On-disk layout of screenshot frames.
+
+Frames used to be stored flat, one directory per workplace
+(SCREENSHOTS_ROOT/<workplace>/<file>). A busy workplace piles up tens of
+thousands of files in that directory, so every listing and retention pass
+scans all of them. New frames are stored by day instead:
+
+    SCREENSHOTS_ROOT/<classroom>/<workplace>/<YYYY>/<MM>/<DD>/<file>
+
+Frame names are timestamps (YYYYMMDD_HHMMSS.<ext>), so the directory of a
+frame is derived from WorkplaceScreenshot.screenshot_filename and the
+workplace alone; nothing extra is stored on the row. Names without a date
+keep the flat layout.
+
+Days older than SCREENSHOT_SEGMENT_AFTER_DAYS are packed into one segment
+file per day (roster.segments); read_frame() and the listings cover those too.
+
+Existing frames are moved by `manage.py migrate_screenshot_layout` in small
+batches while the server runs. Each move is a single rename, and every reader
+goes through locate(), which looks in the day directory first and then in the
+flat one, so a frame is found whichever side of the move it is on.
+"""
+import datetime
+import heapq
+import os
+import re
+
+from django.conf import settings
+
+from roster import transcode
+
+CLASSROOM = '329'
+# Directories under SCREENSHOTS_ROOT holding the sharded layout, not legacy workplace frames
+CLASSROOMS = (CLASSROOM,)
+FRAME_DATE_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})_')
+FRAME_TIME_RE = re.compile(r'^(\d{8}_(\d{6}|\d{4}))\.')
+
+
+def root():
+    return str(settings.SCREENSHOTS_ROOT)
+
+
+def frame_date(filename):
+    """Date encoded in a frame name, None if it has none"""
+    match = FRAME_DATE_RE.match(filename)
+    if not match:
+        return None
+    try:
+        return datetime.date(*(int(part) for part in match.groups()))
+    except ValueError:
+        return None
+
+
+def frame_datetime(filename):
+    """Naive local time encoded in a frame name (YYYYMMDD_HHMMSS or YYYYMMDD_HHMM), None if it has none"""
+    match = FRAME_TIME_RE.match(filename)
+    if not match:
+        return None
+    try:
+        return datetime.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S' if len(match.group(2)) == 6 else '%Y%m%d_%H%M')
+    except ValueError:
+        return None
+
+
+def legacy_dir(workplace_dir):
+    """Flat directory of a workplace (layout before date sharding)"""
+    return os.path.join(root(), str(workplace_dir))
+
+
+def workplace_root(workplace_dir, classroom=CLASSROOM):
+    """Directory holding the year/month/day tree of a workplace"""
+    return os.path.join(root(), classroom, str(workplace_dir))
+
+
+def relative_path(workplace_dir, filename, classroom=CLASSROOM):
+    """Path of a frame relative to SCREENSHOTS_ROOT in the current layout"""
+    day = frame_date(filename)
+    if day is None:
+        return os.path.join(str(workplace_dir), filename)
+    return os.path.join(classroom, str(workplace_dir), f"{day:%Y}", f"{day:%m}", f"{day:%d}", filename)
+
+
+def day_dir(workplace_dir, day, classroom=CLASSROOM):
+    """Directory of a workplace's frames of a day (also the base name of its segment)"""
+    return os.path.join(workplace_root(workplace_dir, classroom), f"{day:%Y}", f"{day:%m}", f"{day:%d}")
+
+
+def frame_dir(workplace_dir, filename, classroom=CLASSROOM):
+    """Directory a frame is written to"""
+    return os.path.dirname(os.path.join(root(), relative_path(workplace_dir, filename, classroom)))
+
+
+def locate(workplace_dir, filename, classroom=CLASSROOM):
+    """
+    Path of a stored frame in either layout (also under another extension,
+    see transcode.find_frame); None if missing.
+    """
+    sharded = frame_dir(workplace_dir, filename, classroom)
+    flat = legacy_dir(workplace_dir)
+    if sharded == flat:
+        return transcode.find_frame(flat, filename)
+    # The day directory is checked again last: a frame moved by the migration
+    # between the first two lookups is found there
+    for dir_path in (sharded, flat, sharded):
+        path = transcode.find_frame(dir_path, filename)
+        if path is not None:
+            return path
+    return None
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def day_dirs(workplace_dir, classroom=CLASSROOM):
+    """
+    (date, path) of the days of a workplace, oldest first. The day directory
+    may be gone once its frames are packed into a segment.
+    """
+    from roster import segments
+
+    base = workplace_root(workplace_dir, classroom)
+    days = {}
+    for year in _listdir(base):
+        for month in _listdir(os.path.join(base, year)):
+            for entry in _listdir(os.path.join(base, year, month)):
+                day, extension = os.path.splitext(entry)
+                if extension not in ('', segments.INDEX_EXTENSION):
+                    continue
+                try:
+                    date = datetime.date(int(year), int(month), int(day))
+                except ValueError:
+                    continue
+                days[date] = os.path.join(base, year, month, day)
+    return sorted(days.items())
+
+
+def _frame_names(dir_path):
+    try:
+        with os.scandir(dir_path) as it:
+            return [e.name for e in it if transcode.is_frame(e.name) and e.is_file()]
+    except FileNotFoundError:
+        return []
+
+
+def _day_names(day_path):
+    """Frames of a day, loose and packed"""
+    from roster import segments
+
+    packed = segments.names(day_path)
+    loose = _frame_names(day_path)
+    return sorted(set(loose).union(packed)) if packed else loose
+
+
+def iter_frames(workplace_dir, classroom=CLASSROOM):
+    """Paths of every loose frame of a workplace in both layouts"""
+    for name in _frame_names(legacy_dir(workplace_dir)):
+        yield os.path.join(legacy_dir(workplace_dir), name)
+    for _, path in day_dirs(workplace_dir, classroom):
+        for name in _frame_names(path):
+            yield os.path.join(path, name)
+
+
+def page_names(workplace_dir, limit, before=None, after=None, classroom=CLASSROOM):
+    """
+    Up to limit + 1 frame names of a workplace, newest first, older than
+    before or newer than after (frame names). Day directories are listed from
+    the cursor outwards and only until the page is full; the flat directory of
+    unmigrated frames is merged in.
+    """
+    flat = _frame_names(legacy_dir(workplace_dir))
+    days = day_dirs(workplace_dir, classroom)
+    sharded = []
+    if after:
+        bound = frame_date(after)
+        for day, path in days:
+            if bound and day < bound:
+                continue
+            sharded.extend(n for n in _day_names(path) if n > after)
+            # Every later day only holds newer names
+            if len(sharded) > limit:
+                break
+        names = sharded + [n for n in flat if n > after]
+        return sorted(heapq.nsmallest(limit + 1, names), reverse=True)
+
+    bound = frame_date(before) if before else None
+    for day, path in reversed(days):
+        if bound and day > bound:
+            continue
+        sharded.extend(n for n in _day_names(path) if not before or n < before)
+        if len(sharded) > limit:
+            break
+    names = sharded + [n for n in flat if not before or n < before]
+    return heapq.nlargest(limit + 1, names)
+
+
+def read_frame(workplace_dir, filename, classroom=CLASSROOM):
+    """A frame packed into its day's segment (segments.Frame), or None"""
+    from roster import segments
+
+    if frame_date(filename) is None:
+        return None
+    return segments.read(frame_dir(workplace_dir, filename, classroom), filename)
+
+
+def frame_mtime(workplace_dir, filename, classroom=CLASSROOM):
+    """Modification time of a loose or packed frame; None if missing"""
+    path = locate(workplace_dir, filename, classroom)
+    if path is not None:
+        return os.path.getmtime(path)
+    frame = read_frame(workplace_dir, filename, classroom)
+    return frame.mtime if frame else None
+
+
+def migrate_frame(workplace_dir, filename, classroom=CLASSROOM):
+    """
+    Move a frame from the flat layout into its day directory. Returns the new
+    path, or None if the name has no date or the frame is gone.
+    """
+    target_dir = frame_dir(workplace_dir, filename, classroom)
+    source = os.path.join(legacy_dir(workplace_dir), filename)
+    if target_dir == legacy_dir(workplace_dir):
+        return None
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, filename)
+    try:
+        # A rename within SCREENSHOTS_ROOT: readers see the frame in one place or the other
+        os.rename(source, target)
+    except FileNotFoundError:
+        return None
+    return target
+
+
+def sharded_workplaces(classroom=CLASSROOM):
+    """Workplace directories of a classroom in the day-sharded layout"""
+    base = os.path.join(root(), classroom)
+    return [name for name in _listdir(base) if os.path.isdir(os.path.join(base, name))]
+
+
+def legacy_workplaces():
+    """Workplace directories that still use the flat layout"""
+    try:
+        entries = sorted(os.scandir(root()), key=lambda e: e.name)
+    except FileNotFoundError:
+        return []
+    return [e.name for e in entries if e.is_dir() and e.name not in CLASSROOMS]
@@ -0,0 +1,67 @@
+"""
+Seat suggestions for the login page.
+
+SeatUsageStat keeps, per (classroom, workplace, weekday, lesson, user), a forward-decayed
+count of placements: a placement on day d adds 2 ** ((d - EPOCH) / HALF_LIFE_DAYS),
+so a placement HALF_LIFE_DAYS older weighs half as much and ordering by score
+is the same as ordering by the decayed count. Rows are updated when a placement
+is created (roster.signals) and suggestions are one indexed top-N query.
+Workplace numbers repeat across classrooms, so the statistic is kept per
+classroom; placements whose workplace id has no classroom prefix count for
+storage.CLASSROOM, as on the dashboard.
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from roster import storage
+from roster.models import SeatUsageStat, WorkplaceUserPlacement
+
+EPOCH = datetime.date(2024, 1, 1)
+HALF_LIFE_DAYS = 30
+# Users not seen at the workplace in this lesson slot for longer are not suggested
+WINDOW_DAYS = 90
+
+
+def weight(day):
+    return 2.0 ** ((day - EPOCH).days / HALF_LIFE_DAYS)
+
+
+def record_placement(placement):
+    if placement.workplace_number is None or not placement.lesson_index or placement.lesson_date is None:
+        return
+    key = {
+        'classroom': placement.classroom or storage.CLASSROOM,
+        'workplace_number': placement.workplace_number,
+        'weekday': placement.lesson_date.weekday(),
+        'lesson_index': placement.lesson_index,
+        'user_id': placement.user_id,
+    }
+    increment = weight(placement.lesson_date)
+    updated = SeatUsageStat.objects.filter(**key).update(score=F('score') + increment, last_seen=placement.lesson_date)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            SeatUsageStat.objects.create(**key, score=increment, last_seen=placement.lesson_date)
+    except IntegrityError:
+        # Created concurrently
+        SeatUsageStat.objects.filter(**key).update(score=F('score') + increment, last_seen=placement.lesson_date)
+
+
+def suggested_users(classroom, workplace_number, day, lesson_index, limit=3):
+    """
+    Users who most often sat at the classroom's workplace in this lesson on
+    this weekday, excluding those already seated anywhere in the lesson.
+    """
+    seated = WorkplaceUserPlacement.objects.filter(lesson_date=day, lesson_index=lesson_index).values('user_id')
+    stats = SeatUsageStat.objects.filter(
+        classroom=classroom or storage.CLASSROOM,
+        workplace_number=workplace_number,
+        weekday=day.weekday(),
+        lesson_index=lesson_index,
+        last_seen__gte=day - datetime.timedelta(days=WINDOW_DAYS),
+    ).exclude(user_id__in=seated).select_related('user', 'user__profile').order_by('-score')[:limit]
+    return [stat.user for stat in stats]
+
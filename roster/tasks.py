@@ -0,0 +1,125 @@
+"""
+In-process background worker for work that must not run inside a request.
+
+Jobs are submitted under a key. While a key is waiting in the queue, further
+submissions for it are coalesced into the pending run, so a burst of uploads
+from one workplace results in a single retention pass.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingWorker:
+    """Single daemon thread draining a queue of keyed, de-duplicated jobs"""
+
+    def __init__(self, name):
+        self.name = name
+        self._queue = queue.Queue()
+        self._pending = {}  # key -> (enqueued_at, func, args, kwargs)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_duration = 0.0
+        self.last_run_at = None
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        Queue func(*args, **kwargs) under key.
+        Returns False if the key was already pending and the call was coalesced.
+        """
+        if not settings.BACKGROUND_TASKS_ASYNC:
+            self.submitted += 1
+            self._run(key, time.monotonic(), func, args, kwargs)
+            return True
+
+        with self._lock:
+            self.submitted += 1
+            if key in self._pending:
+                # Keep the first enqueue time so lag is measured from the oldest trigger,
+                # but run with the freshest arguments.
+                enqueued_at = self._pending[key][0]
+                self._pending[key] = (enqueued_at, func, args, kwargs)
+                self.coalesced += 1
+                return False
+            self._pending[key] = (time.monotonic(), func, args, kwargs)
+            self._ensure_thread()
+
+        self._queue.put(key)
+        return True
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            depth = len(self._pending)
+            oldest = min((entry[0] for entry in self._pending.values()), default=None)
+
+        return {
+            'queue_depth': depth,
+            'current_lag': round(now - oldest, 3) if oldest is not None else 0.0,
+            'last_lag': round(self.last_lag, 3),
+            'max_lag': round(self.max_lag, 3),
+            'last_duration': round(self.last_duration, 3),
+            'last_run_at': self.last_run_at,
+            'submitted': self.submitted,
+            'coalesced': self.coalesced,
+            'processed': self.processed,
+            'errors': self.errors,
+        }
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while True:
+            key = self._queue.get()
+            with self._lock:
+                entry = self._pending.pop(key, None)
+            if entry is None:
+                continue
+
+            enqueued_at, func, args, kwargs = entry
+            close_old_connections()
+            try:
+                self._run(key, enqueued_at, func, args, kwargs)
+            finally:
+                close_old_connections()
+
+    def _run(self, key, enqueued_at, func, args, kwargs):
+        started = time.monotonic()
+        self.last_lag = started - enqueued_at
+        self.max_lag = max(self.max_lag, self.last_lag)
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            logger.exception(f"Background job {key!r} failed")
+        finally:
+            self.processed += 1
+            self.last_duration = time.monotonic() - started
+            self.last_run_at = time.time()
+
+
+worker = CoalescingWorker('roster-background')
+
+
+def submit(key, func, *args, **kwargs):
+    return worker.submit(key, func, *args, **kwargs)
+
+
+def stats():
+    return worker.stats()
@@ -0,0 +1,183 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
+
+from roster import agent_config, events
+from roster.models import ClassroomEvent, Classroom, WorkplaceUserPlacement, parse_workplace_id
+
+
+@override_settings(CLASSROOM_EVENTS_POLL_INTERVAL=0, CLASSROOM_EVENTS_STREAM_LIFETIME=0.05)
+class ClassroomEventsTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='student', first_name='Іван', last_name='Петренко')
+
+    def read_stream(self, **extra):
+        response = self.client.get('/api/classrooms/329/events/', **extra)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join(response.streaming_content).decode()
+
+    def test_changes_publish_events(self):
+        placement = WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+        Classroom.objects.create(classroom_id='329', screenshot_interval=30)
+        placement.delete()
+
+        kinds = list(ClassroomEvent.objects.order_by('id').values_list('kind', 'workplace_number'))
+        self.assertEqual(kinds, [('placement', 4), ('settings', None), ('placement', 4)])
+
+    def test_stream_resumes_after_last_event_id(self):
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+        last_id = events.latest_event_id()
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-7')
+
+        body = self.read_stream(HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertIn('event: placement', body)
+        self.assertIn(f'id: {last_id + 1}', body)
+        self.assertIn('"workplace_number": 7', body)
+        self.assertNotIn('"workplace_number": 4', body)
+
+    def test_new_stream_starts_at_latest_event(self):
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+
+        body = self.read_stream()
+        self.assertIn('event: hello', body)
+        self.assertNotIn('event: placement', body)
+
+    def test_pruned_history_asks_for_reload(self):
+        for n in range(3):
+            WorkplaceUserPlacement.objects.create(user=self.user, workplace_id=f'329-{n + 1}')
+        first = ClassroomEvent.objects.order_by('id').first()
+        ClassroomEvent.objects.filter(id__lte=first.id + 1).delete()
+
+        body = self.read_stream(HTTP_LAST_EVENT_ID=str(first.id - 1))
+        self.assertIn('event: reset', body)
+
+
+class ClassroomStateVersionTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='student', first_name='Іван', last_name='Петренко')
+        Classroom.objects.create(classroom_id='329')
+        self.params = {'date': '2026-01-12', 'lesson': '1', 'singles': 'off'}
+
+    def get(self, **extra):
+        return self.client.get('/api/classrooms/329/', self.params, **extra)
+
+    def test_unchanged_state_returns_304(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_since_returns_only_changed_workplaces(self):
+        version = self.get().json()['version']
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+
+        data = self.client.get('/api/classrooms/329/', {**self.params, 'since': version}).json()
+        self.assertTrue(data['delta'])
+        self.assertEqual([wp['number'] for wp in data['workplaces']], [4])
+        self.assertNotIn('workplaces_1', data)
+        self.assertNotIn('screenshots_enabled', data)
+        self.assertGreater(data['version'], version)
+
+    def test_since_older_than_retained_events_returns_full_state(self):
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-4')
+        WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-5')
+        first = ClassroomEvent.objects.order_by('id').first()
+        ClassroomEvent.objects.filter(id__lte=first.id + 1).delete()
+
+        data = self.client.get('/api/classrooms/329/', {**self.params, 'since': first.id - 1}).json()
+        self.assertFalse(data['delta'])
+        self.assertEqual(len(data['workplaces_1']), 9)
+
+
+class AgentConfigTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        agent_config.invalidate()
+
+    def get(self, **extra):
+        return self.client.get('/api/classrooms/329/agent/config/', **extra)
+
+    def test_config_is_read_without_creating_the_classroom(self):
+        with override_settings(AGENT_CONFIG_POLL_SECONDS=30, AGENT_CONFIG_POLL_JITTER=0.2):
+            data = self.get().json()
+        self.assertTrue(data['screenshots_enabled'])
+        self.assertEqual(data['screenshot_interval'], 60)
+        self.assertIn('storage_format', data['capture'])
+        self.assertIn('server_time', data)
+        self.assertTrue(24 <= data['next_poll'] <= 36)
+        self.assertFalse(Classroom.objects.exists())
+        self.assertEqual(self.client.get('/api/classrooms/329/screenshots/status/').content, b'1')
+        self.assertFalse(Classroom.objects.exists())
+
+    def test_unchanged_config_returns_304_until_patched(self):
+        response = self.get()
+        etag = response['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.patch(
+            '/api/classrooms/329/screenshots/', '{"screenshot_interval": 15}', content_type='application/json'
+        )
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['screenshot_interval'], 15)
+        self.assertEqual(self.client.get('/api/classrooms/329/screenshots/interval/').content, b'15')
+
+    def test_config_loaded_before_a_patch_is_not_cached(self):
+        load = agent_config._load
+
+        def patch_meanwhile(classroom_id):
+            config = load(classroom_id)
+            Classroom.objects.update_or_create(classroom_id=classroom_id, defaults={'screenshots_enabled': False})
+            return config
+
+        with mock.patch('roster.agent_config._load', side_effect=patch_meanwhile):
+            self.assertTrue(self.get().json()['screenshots_enabled'])
+        self.assertFalse(self.get().json()['screenshots_enabled'])
+
+
+class PlacementLessonFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='student', first_name='Іван', last_name='Петренко')
+
+    def test_parse_workplace_id(self):
+        self.assertEqual(parse_workplace_id('329-4'), ('329', 4))
+        self.assertEqual(parse_workplace_id('329-04'), ('329', 4))
+        self.assertEqual(parse_workplace_id('W-4'), (None, 4))
+        self.assertEqual(parse_workplace_id('Workplace 4'), (None, 4))
+        self.assertEqual(parse_workplace_id('4'), (None, 4))
+        self.assertEqual(parse_workplace_id('teacher_pc'), (None, None))
+
+    def test_fields_are_derived_on_save(self):
+        placement = WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-07')
+        # 10:00 Kyiv time falls into lesson 2 (9:55-10:40)
+        placement.created_at = timezone.make_aware(datetime.datetime(2026, 1, 12, 10, 0))
+        placement.save()
+
+        placement.refresh_from_db()
+        self.assertEqual(placement.classroom, '329')
+        self.assertEqual(placement.workplace_number, 7)
+        self.assertEqual(placement.lesson_date, datetime.date(2026, 1, 12))
+        self.assertEqual(placement.lesson_index, 2)
+
+    def test_dashboard_groups_by_lesson_columns(self):
+        for workplace_id, hour, minute in (('329-3', 9, 10), ('329-5', 9, 50), ('329-6', 10, 0)):
+            placement = WorkplaceUserPlacement.objects.create(user=self.user, workplace_id=workplace_id)
+            placement.created_at = timezone.make_aware(datetime.datetime(2026, 1, 12, hour, minute))
+            placement.save(update_fields=['created_at'])
+
+        data = Client().get('/api/classrooms/329/', {'date': '2026-01-12', 'lesson': '1', 'singles': 'on'}).json()
+        occupied = [wp['number'] for wp in data['workplaces_1'] if wp['placements']]
+        # 9:50 is in the break after lesson 1, 10:00 is lesson 2
+        self.assertEqual(occupied, [3])
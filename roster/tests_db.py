@@ -0,0 +1,152 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.utils import OperationalError
+from django.test import TestCase, Client, override_settings
+
+from roster import db
+from roster.models import WorkplaceUserPlacement
+
+
+class ConcurrentProfileTests(TestCase):
+    def _open(self, path):
+        default = connections['default']
+        conn = type(default)(dict(default.settings_dict, NAME=path), alias='profile-test')
+        conn.ensure_connection()
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_concurrent_profile_enables_wal_and_busy_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with override_settings(DB_PROFILE='concurrent', SQLITE_BUSY_TIMEOUT=7):
+                conn = self._open(os.path.join(tmp, 'db.sqlite3'))
+                with conn.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 7000)
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            conn.close()
+
+    def test_default_profile_keeps_rollback_journal(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = self._open(os.path.join(tmp, 'db.sqlite3'))
+            with conn.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'delete')
+            # Write timing is recorded in every profile
+            self.assertIn(db._timed_execute, conn.execute_wrappers)
+            conn.close()
+
+    def test_write_statements_are_timed(self):
+        before = db.write_stats.stats()['writes']
+        User.objects.create(username='timed')
+        User.objects.filter(username='timed').exists()
+        self.assertEqual(db.write_stats.stats()['writes'], before + 1)
+
+
+class WriteCoalescerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='student', first_name='Іван', last_name='Петренко')
+
+    def test_batch_is_written_and_failing_item_rolled_back_alone(self):
+        writer = db.WriteCoalescer('test-writer')
+        committed = []
+
+        def create_and_notify(workplace_id):
+            WorkplaceUserPlacement.objects.create(user=self.user, workplace_id=workplace_id)
+            writer.on_commit(lambda: committed.append(workplace_id))
+
+        def broken():
+            WorkplaceUserPlacement.objects.create(user=self.user, workplace_id='329-5')
+            raise ValueError('boom')
+
+        with self.assertLogs('roster.db', 'ERROR'):
+            writer.commit([
+                (create_and_notify, ('329-1',), {}),
+                (broken, (), {}),
+                (create_and_notify, ('329-2',), {}),
+            ])
+
+        self.assertEqual(
+            sorted(WorkplaceUserPlacement.objects.values_list('workplace_id', flat=True)), ['329-1', '329-2']
+        )
+        self.assertEqual(committed, ['329-1', '329-2'])
+        stats = writer.stats()
+        self.assertEqual((stats['batches'], stats['written'], stats['errors']), (1, 2, 1))
+
+    def test_without_coalescing_writes_run_inline(self):
+        writer = db.WriteCoalescer('test-writer')
+        with override_settings(DB_WRITE_COALESCING=False):
+            writer.submit(WorkplaceUserPlacement.objects.create, user=self.user, workplace_id='329-3')
+        self.assertTrue(WorkplaceUserPlacement.objects.filter(workplace_id='329-3').exists())
+        self.assertEqual(writer.stats()['batches'], 0)
+
+    def test_queued_writes_share_a_batch(self):
+        writer = db.WriteCoalescer('test-writer')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        done = threading.Event()
+
+        def blocking():
+            started.set()
+            release.wait(5)
+
+        with override_settings(DB_WRITE_COALESCING=True, DB_WRITE_BATCH_WAIT=0, DB_WRITE_BATCH_SIZE=100):
+            writer.submit(blocking)
+            self.assertTrue(started.wait(5))
+            for n in range(10):
+                writer.submit(calls.append, n)
+            # Callbacks run after the batch is committed and counted
+            writer.submit(writer.on_commit, done.set)
+            self.assertEqual(writer.stats()['queue_depth'], 11)
+            release.set()
+            self.assertTrue(done.wait(5))
+
+        self.assertEqual(calls, list(range(10)))
+        stats = writer.stats()
+        self.assertEqual(stats['batches'], 2)
+        self.assertEqual(stats['max_batch_size'], 11)
+
+
+    def test_submitters_get_the_outcome_of_their_write(self):
+        writer = db.WriteCoalescer('test-writer')
+
+        def broken():
+            raise ValueError('boom')
+
+        with override_settings(DB_WRITE_COALESCING=True, DB_WRITE_BATCH_WAIT=0):
+            created = writer.submit(lambda: 42)
+            failed = writer.submit(broken)
+            with self.assertLogs('roster.db', 'ERROR'):
+                self.assertEqual(created.result(5), 42)
+                with self.assertRaisesMessage(ValueError, 'boom'):
+                    failed.result(5)
+
+    def test_failed_commit_fails_every_write_of_the_batch(self):
+        writer = db.WriteCoalescer('test-writer')
+        first, second = db.Future(), db.Future()
+
+        with self.assertLogs('roster.db', 'ERROR'), \
+                mock.patch.object(db.transaction, 'atomic', side_effect=OperationalError('disk I/O error')):
+            writer.commit([(int, (), {}, first), (int, (), {}, second)])
+
+        for future in (first, second):
+            with self.assertRaises(OperationalError):
+                future.result(0)
+
+
+class DatabaseMetricsTests(TestCase):
+    def test_metrics_include_database_counters(self):
+        response = Client().get('/api/classrooms/329/metrics/')
+        self.assertEqual(response.status_code, 200)
+        database = response.json()['database']
+        self.assertEqual(database['profile'], 'default')
+        self.assertIn('slow_writes', database['lock_wait'])
+        self.assertIn('batches', database['writer'])
@@ -1,12 +1,19 @@
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
-from roster.models import StudentGroup, StudentGroupFeature, WorkplaceUserPlacement
+from roster.models import StudentGroup, StudentGroupFeature, WorkplaceUserPlacement, SeatUsageStat
 from roster.features import check_group_constraints
 import datetime
+import json
+import time
+from unittest import mock
 from django.utils import timezone
 
+from roster import features, seating, suggestions
+
 class GroupFeatureTests(TestCase):
     def setUp(self):
+        # The cached lesson occupancy outlives the rolled-back placements of earlier tests
+        features.invalidate_occupancy()
         self.client = Client()
         self.user1 = User.objects.create_user(username='user1', password='password')
         self.user2 = User.objects.create_user(username='user2', password='password')
@@ -139,3 +146,143 @@ class GroupFeatureTests(TestCase):
         self.assertNotIn(6, available_numbers)
         self.assertIn(1, available_numbers)
         self.assertIn(7, available_numbers)
+
+    def test_repeated_checks_reuse_cached_occupancy(self):
+        WorkplaceUserPlacement.objects.create(user=self.user1, workplace_id="computer-5")
+        check_group_constraints(self.user2, "computer-6")
+
+        # New placements are folded into the cached state; a check runs no query
+        WorkplaceUserPlacement.objects.create(user=self.user1, workplace_id="computer-10")
+        with self.assertNumQueries(0):
+            allowed, msg = check_group_constraints(self.user2, "computer-11")
+        self.assertFalse(allowed)
+
+        # Deleted placements are noticed too
+        WorkplaceUserPlacement.objects.filter(workplace_id="computer-10").delete()
+        allowed, msg = check_group_constraints(self.user2, "computer-11")
+        self.assertTrue(allowed)
+
+    def test_membership_changes_apply_immediately(self):
+        WorkplaceUserPlacement.objects.create(user=self.user1, workplace_id="computer-5")
+        self.assertTrue(check_group_constraints(self.user3, "computer-6")[0])
+
+        self.group.students.add(self.user3)
+        self.assertFalse(check_group_constraints(self.user3, "computer-6")[0])
+
+    def test_own_placement_does_not_block_neighbours(self):
+        WorkplaceUserPlacement.objects.create(user=self.user2, workplace_id="computer-5")
+        allowed, msg = check_group_constraints(self.user2, "computer-6")
+        self.assertTrue(allowed)
+
+
+class AutoAssignTests(TestCase):
+    def setUp(self):
+        features.invalidate_occupancy()
+        self.client = Client()
+        self.group = StudentGroup.objects.create(name="Seating Group")
+        self.students = [User.objects.create_user(username=f'seat{i}') for i in range(6)]
+        self.group.students.add(*self.students)
+        StudentGroupFeature.objects.create(
+            group=self.group,
+            feature_key='non_sequential',
+            enabled=True,
+            parameters={'min_distance': 2},
+        )
+        self.url = f'/api/classrooms/329/groups/{self.group.id}/auto_assign/'
+
+    def post(self, body=None):
+        return self.client.post(self.url, json.dumps(body or {}), content_type='application/json')
+
+    def test_whole_group_is_seated_apart(self):
+        # An outsider already sits at 1, a member at 18
+        WorkplaceUserPlacement.objects.create(user=User.objects.create_user(username='other'), workplace_id='329-1')
+        WorkplaceUserPlacement.objects.create(user=self.students[0], workplace_id='329-18')
+
+        response = self.post()
+        self.assertEqual(response.status_code, 201)
+        placed = [p['workplace_id'] for p in response.json()['placements']]
+        self.assertEqual(len(placed), 5)
+
+        seats = sorted(int(w.split('-')[1]) for w in placed) + [18]
+        self.assertNotIn(1, seats)
+        self.assertTrue(all(b - a > 2 for a, b in zip(seats, seats[1:])))
+
+        # Seated students are not placed again
+        self.assertEqual(self.post().json()['placements'], [])
+
+    def test_impossible_seating_writes_nothing(self):
+        response = self.post({'workplaces': list(range(1, 13))})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(WorkplaceUserPlacement.objects.count(), 0)
+
+    def test_dry_run(self):
+        data = self.post({'dry_run': True}).json()
+        self.assertEqual(len(data['assignments']), 6)
+        self.assertEqual(WorkplaceUserPlacement.objects.count(), 0)
+
+    def test_solver_is_fast_on_tight_instances(self):
+        # 6 students at distance 2 fill 18 seats exactly: 1, 4, 7, 10, 13, 16 (or shifted)
+        students = list(range(6))
+        conflicts = {s: {t: 2 for t in students if t != s} for s in students}
+        domains = {s: seating.features.ALL_SEATS for s in students}
+
+        started = time.monotonic()
+        assignment = seating.solve(domains, conflicts)
+        self.assertLess(time.monotonic() - started, 0.5)
+        seats = sorted(assignment.values())
+        self.assertTrue(all(b - a > 2 for a, b in zip(seats, seats[1:])))
+
+        # 7 students cannot fit
+        conflicts = {s: {t: 2 for t in range(7) if t != s} for s in range(7)}
+        self.assertIsNone(seating.solve({s: seating.features.ALL_SEATS for s in range(7)}, conflicts))
+
+
+class SeatSuggestionTests(TestCase):
+    def setUp(self):
+        self.regular = User.objects.create_user(username='regular')
+        self.occasional = User.objects.create_user(username='occasional')
+
+    def test_recent_regulars_are_suggested_first(self):
+        monday = datetime.date(2026, 1, 12)
+        for weeks in (1, 2, 3):
+            day = monday - datetime.timedelta(weeks=weeks)
+            suggestions.record_placement(WorkplaceUserPlacement(
+                user=self.regular, workplace_number=5, lesson_date=day, lesson_index=2))
+        suggestions.record_placement(WorkplaceUserPlacement(
+            user=self.occasional, workplace_number=5, lesson_date=monday - datetime.timedelta(weeks=1), lesson_index=2))
+        # Another weekday and another lesson don't count
+        suggestions.record_placement(WorkplaceUserPlacement(
+            user=self.occasional, workplace_number=5, lesson_date=monday - datetime.timedelta(days=1), lesson_index=2))
+        suggestions.record_placement(WorkplaceUserPlacement(
+            user=self.occasional, workplace_number=5, lesson_date=monday - datetime.timedelta(weeks=1), lesson_index=3))
+
+        with self.assertNumQueries(1):
+            users = suggestions.suggested_users('329', 5, monday, 2)
+        self.assertEqual(users, [self.regular, self.occasional])
+
+        # Users already seated this lesson are skipped
+        placement = WorkplaceUserPlacement.objects.create(user=self.regular, workplace_id='329-9')
+        WorkplaceUserPlacement.objects.filter(pk=placement.pk).update(lesson_date=monday, lesson_index=2)
+        self.assertEqual(suggestions.suggested_users('329', 5, monday, 2), [self.occasional])
+
+    def test_classrooms_are_counted_apart(self):
+        monday = datetime.date(2026, 1, 12)
+        last_week = monday - datetime.timedelta(weeks=1)
+        suggestions.record_placement(WorkplaceUserPlacement(
+            user=self.regular, classroom='330', workplace_number=5, lesson_date=last_week, lesson_index=2))
+        # Workplace ids without a classroom prefix belong to the default classroom
+        suggestions.record_placement(WorkplaceUserPlacement(
+            user=self.occasional, workplace_number=5, lesson_date=last_week, lesson_index=2))
+
+        self.assertEqual(suggestions.suggested_users('330', 5, monday, 2), [self.regular])
+        self.assertEqual(suggestions.suggested_users('329', 5, monday, 2), [self.occasional])
+        self.assertEqual(suggestions.suggested_users(None, 5, monday, 2), [self.occasional])
+
+    def test_new_placements_update_stats(self):
+        with mock.patch('roster.models.lesson_index_at', return_value=2):
+            WorkplaceUserPlacement.objects.create(user=self.regular, workplace_id='329-4')
+            WorkplaceUserPlacement.objects.create(user=self.regular, workplace_id='329-4')
+
+        stat = SeatUsageStat.objects.get(user=self.regular)
+        self.assertEqual((stat.workplace_number, stat.lesson_index, stat.weekday), (4, 2, timezone.localdate().weekday()))
+        self.assertAlmostEqual(stat.score, 2 * suggestions.weight(timezone.localdate()))
@@ -0,0 +1,50 @@
+import datetime
+import io
+
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.utils import timezone
+
+from roster import partitions, rollups
+from roster.models import Workplace, WorkplaceScreenshot
+
+
+class PartitionHelpersTests(TestCase):
+    def test_month_arithmetic_and_names(self):
+        self.assertEqual(partitions.add_months(datetime.date(2026, 11, 1), 3), datetime.date(2027, 2, 1))
+        self.assertEqual(partitions.add_months(datetime.date(2026, 1, 1), -1), datetime.date(2025, 12, 1))
+
+        name = partitions.partition_name('roster_workplacescreenshot', datetime.date(2026, 3, 1))
+        self.assertEqual(name, 'roster_workplacescreenshot_p202603')
+        self.assertEqual(partitions.partition_month(name), datetime.date(2026, 3, 1))
+        self.assertIsNone(partitions.partition_month(partitions.default_partition_name('roster_workplacescreenshot')))
+
+    def test_month_bounds_follow_local_time(self):
+        # 2026-10-31 23:30 in Kyiv is still October although it is 21:30 UTC
+        late = timezone.make_aware(datetime.datetime(2026, 10, 31, 23, 30))
+        self.assertEqual(partitions.month_start(late), datetime.date(2026, 10, 1))
+
+        start, end = partitions.month_bounds(datetime.date(2026, 10, 1))
+        self.assertTrue(start <= late < end)
+        self.assertEqual(timezone.localtime(end).date(), datetime.date(2026, 11, 1))
+
+    def test_command_is_noop_outside_postgresql(self):
+        out = io.StringIO()
+        call_command('manage_partitions', stdout=out)
+        self.assertIn('only used on PostgreSQL', out.getvalue())
+
+
+class ScreenshotDatesTests(TestCase):
+    def test_dates_can_be_limited_to_a_range(self):
+        workplace = Workplace.objects.create(workplace_number=2)
+        for day in (1, 15, 28):
+            shot = WorkplaceScreenshot.objects.create(workplace=workplace, screenshot_filename=f'{day}.png')
+            created_at = timezone.make_aware(datetime.datetime(2026, 2, day, 10, 0))
+            WorkplaceScreenshot.objects.filter(pk=shot.pk).update(created_at=created_at)
+        # The dates are read from the daily rollups, which update() bypasses
+        rollups.rebuild()
+
+        url = '/api/classrooms/329/screenshots/dates/'
+        self.assertEqual(Client().get(url).json(), ['2026-02-28', '2026-02-15', '2026-02-01'])
+        self.assertEqual(Client().get(url, {'from': '2026-02-02', 'to': '2026-02-15'}).json(), ['2026-02-15'])
+        self.assertEqual(Client().get(url, {'from': 'yesterday'}).status_code, 400)
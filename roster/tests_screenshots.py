@@ -0,0 +1,1089 @@
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
+
+from PIL import Image, ImageDraw
+
+from roster import budget, dedupe, rollups, search, segments, storage, thumbnails, transcode
+from roster.models import Classroom, ScreenshotDayRollup, Workplace, WorkplaceScreenshot, WorkplaceUserPlacement
+from roster.retention import rotate_screenshots
+from roster.tasks import CoalescingWorker
+
+
+class CoalescingWorkerTests(TestCase):
+    def test_repeated_triggers_are_coalesced(self):
+        worker = CoalescingWorker('test-worker')
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def blocking_job():
+            started.set()
+            release.wait(5)
+
+        def job(n):
+            calls.append(n)
+
+        with override_settings(BACKGROUND_TASKS_ASYNC=True):
+            # Occupy the worker so the next submissions stay queued
+            worker.submit('block', blocking_job)
+            self.assertTrue(started.wait(5))
+
+            self.assertTrue(worker.submit('wp-1', job, 1))
+            self.assertFalse(worker.submit('wp-1', job, 2))
+            self.assertFalse(worker.submit('wp-1', job, 3))
+
+            stats = worker.stats()
+            self.assertEqual(stats['queue_depth'], 1)
+            self.assertEqual(stats['coalesced'], 2)
+
+            release.set()
+            done = threading.Event()
+            worker.submit('done', done.set)
+            self.assertTrue(done.wait(5))
+
+        # Only one run, with the latest arguments
+        self.assertEqual(calls, [3])
+        self.assertEqual(worker.stats()['queue_depth'], 0)
+
+
+class UploadScreenshotTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SCREENSHOTS_ROOT=os.path.join(self.root, 'screenshots'),
+            SCREENSHOT_THUMBNAILS_ROOT=os.path.join(self.root, 'thumbnails'),
+            BACKGROUND_TASKS_ASYNC=False,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def upload(self, workplace_id='329-5', content=b'fake image content', **fields):
+        return self.client.post(
+            f'/api/classrooms/329/workplaces/{workplace_id}/screenshot/',
+            {'file': SimpleUploadedFile('upload.png', content, content_type='image/png'), 'username': 'student', **fields}
+        )
+
+    def test_upload_schedules_rotation_after_row_is_stored(self):
+        def check_row_exists(dir_path, workplace=None):
+            self.assertTrue(WorkplaceScreenshot.objects.filter(workplace=workplace).exists())
+
+        with mock.patch('roster.retention.rotate_screenshots', side_effect=check_row_exists) as rotate:
+            response = self.upload()
+
+        self.assertEqual(response.status_code, 200)
+        rotate.assert_called_once()
+        workplace = Workplace.objects.get(workplace_number=5)
+        self.assertEqual(workplace.screenshots.count(), 1)
+
+    def test_upload_updates_latest_screenshot_pointer(self):
+        self.upload()
+        filename = self.upload(content=b'newer').json()['filename']
+
+        workplace = Workplace.objects.get(workplace_number=5)
+        self.assertEqual(workplace.latest_screenshot, workplace.screenshots.order_by('-id').first())
+
+        data = self.client.get('/api/classrooms/329/').json()
+        wp = next(w for w in data['workplaces_1'] if w['number'] == 5)
+        self.assertEqual(wp['last_screenshot_filename'], filename)
+        self.assertEqual(wp['last_os_username'], 'student')
+
+    def test_thumbnail_is_rendered_once_and_served_from_disk(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (1280, 720), 'navy').save(buf, format='PNG')
+        filename = self.upload(content=buf.getvalue()).json()['filename']
+        url = f'/api/classrooms/329/workplaces/5/screenshots/{filename}/'
+
+        # The 160px derivative was rendered at ingest
+        self.assertTrue(os.path.exists(thumbnails.thumbnail_path('5', filename, 160)))
+
+        hits = thumbnails.cache.hits
+        response = self.client.get(url, {'thumb': '1'})
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as img:
+            self.assertEqual(img.size, (160, 90))
+        self.assertEqual(thumbnails.cache.hits, hits + 1)
+
+        # Other widths are snapped to the configured ones and rendered on first access
+        misses = thumbnails.cache.misses
+        self.client.get(url, {'w': '300'})
+        self.client.get(url, {'w': '300'})
+        self.assertEqual(thumbnails.cache.misses, misses + 1)
+        self.assertTrue(os.path.exists(thumbnails.thumbnail_path('5', filename, 320)))
+
+    def test_conditional_get_and_range(self):
+        filename = self.upload(content=b'0123456789').json()['filename']
+        url = f'/api/classrooms/329/workplaces/5/screenshots/{filename}/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_frames_are_transcoded_and_old_names_still_resolve(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (1280, 720), 'navy').save(buf, format='PNG')
+        filename = self.upload(content=buf.getvalue()).json()['filename']
+
+        shot = WorkplaceScreenshot.objects.get()
+        self.assertEqual(shot.screenshot_filename, filename.replace('.png', '.webp'))
+        day_dir = storage.frame_dir('5', filename)
+        self.assertEqual(shot.file_size, os.path.getsize(os.path.join(day_dir, shot.screenshot_filename)))
+        self.assertFalse(os.path.exists(os.path.join(day_dir, filename)))
+        self.assertEqual(ScreenshotDayRollup.objects.get().bytes, shot.file_size)
+
+        # The name returned by the upload keeps working
+        response = self.client.get(f'/api/classrooms/329/workplaces/5/screenshots/{filename}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+        history = self.client.get('/api/classrooms/329/workplaces/5/screenshots/').json()
+        self.assertEqual(history[0]['filename'], shot.screenshot_filename)
+
+    def test_png_storage_keeps_uploads_as_they_are(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (64, 64), 'navy').save(buf, format='PNG')
+        with override_settings(SCREENSHOT_STORAGE_FORMAT='png'):
+            filename = self.upload(content=buf.getvalue()).json()['filename']
+        self.assertEqual(WorkplaceScreenshot.objects.get().screenshot_filename, filename)
+        response = self.client.get(f'/api/classrooms/329/workplaces/5/screenshots/{filename}/')
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def png(self, draw=None, size=(640, 360), color='white'):
+        img = Image.new('RGB', size, color)
+        if draw:
+            draw(ImageDraw.Draw(img))
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+    def test_repeated_frames_are_counted_not_stored(self):
+        def desktop(d):
+            d.rectangle([0, 0, 640, 40], fill='navy')
+            d.rectangle([100, 100, 400, 300], fill='grey')
+            d.text((120, 120), 'Lorem ipsum', fill='black')
+
+        self.upload(content=self.png(desktop))
+        repeat = self.upload(content=self.png(desktop)).json()
+        self.assertTrue(repeat['repeat'])
+
+        shot = WorkplaceScreenshot.objects.get()
+        self.assertEqual(repeat['filename'], shot.screenshot_filename)
+        self.assertEqual(shot.repeat_count, 1)
+        self.assertIsNotNone(shot.last_seen_at)
+        self.assertEqual(len(os.listdir(storage.frame_dir('5', shot.screenshot_filename))), 1)
+        rollup = ScreenshotDayRollup.objects.get()
+        self.assertEqual((rollup.frames, rollup.skipped_frames), (1, 1))
+        self.assertEqual(rollup.skipped_bytes, len(self.png(desktop)))
+
+        wp = next(w for w in self.client.get('/api/classrooms/329/').json()['workplaces_1'] if w['number'] == 5)
+        self.assertEqual(wp['last_seen_at'], shot.last_seen_at.isoformat())
+
+        # A changed screen is stored again
+        self.assertNotIn('repeat', self.upload(content=self.png(lambda d: d.ellipse([0, 0, 640, 360], fill='red'))).json())
+        self.assertEqual(WorkplaceScreenshot.objects.count(), 2)
+
+    def test_small_changes_and_new_titles_are_stored(self):
+        def editor(lines):
+            def draw(d):
+                d.rectangle([0, 0, 640, 20], fill='navy')
+                for i in range(lines):
+                    d.text((10, 30 + 14 * i), f'line {i}: x = compute(x, {i})', fill='black')
+            return draw
+
+        self.upload(content=self.png(editor(10)), window_titles='["main.py"]')
+        self.assertNotIn('repeat', self.upload(content=self.png(editor(11)), window_titles='["main.py"]').json())
+        self.assertNotIn('repeat', self.upload(content=self.png(editor(11)), window_titles='["test.py"]').json())
+        self.assertTrue(self.upload(content=self.png(editor(11)), window_titles='["test.py"]').json()['repeat'])
+
+        # Another student at the same seat on the shared OS account
+        other = User.objects.create_user(username='other')
+        WorkplaceUserPlacement.objects.create(user=other, workplace_id='329-5', workplace_number=5, classroom='329')
+        self.assertNotIn('repeat', self.upload(content=self.png(editor(11)), window_titles='["test.py"]').json())
+
+        shots = WorkplaceScreenshot.objects.order_by('id')
+        self.assertEqual([s.window_titles for s in shots], [['main.py'], ['main.py'], ['test.py'], ['test.py']])
+        self.assertEqual(shots.last().user, other)
+
+    def test_blank_frames_are_stored_once(self):
+        self.upload(content=self.png(color='black'))
+        self.assertTrue(self.upload(content=self.png(color=(0, 0, 40))).json().get('repeat'))
+        self.assertEqual(WorkplaceScreenshot.objects.count(), 1)
+        self.assertEqual(dedupe.fingerprint(io.BytesIO(self.png(color='black'))).blank, True)
+
+    def test_sendfile_offload(self):
+        filename = self.upload().json()['filename']
+        with override_settings(SCREENSHOT_SENDFILE_BACKEND='nginx', SCREENSHOT_SENDFILE_ROOT=self.root):
+            response = self.client.get(f'/api/classrooms/329/workplaces/5/screenshots/{filename}/')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-data/screenshots/{storage.relative_path("5", filename)}')
+        self.assertEqual(response.content, b'')
+
+
+
+class StorageLayoutTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SCREENSHOTS_ROOT=self.root,
+            SCREENSHOT_THUMBNAILS_ROOT=os.path.join(self.root, 'thumbnails'),
+            BACKGROUND_TASKS_ASYNC=False,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, dir_path, filename, content=b'frame'):
+        os.makedirs(dir_path, exist_ok=True)
+        path = os.path.join(dir_path, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        # Old enough for the migration to pick up
+        os.utime(path, (0, 1_000_000_000))
+        return path
+
+    def test_paths_are_derived_from_the_frame_name(self):
+        self.assertEqual(storage.relative_path('5', '20261018_093000.webp'), os.path.join('329', '5', '2026', '10', '18', '20261018_093000.webp'))
+        self.assertEqual(storage.relative_path('5', 'frame.png'), os.path.join('5', 'frame.png'))
+
+    def test_upload_stores_frames_by_day(self):
+        with override_settings(SCREENSHOT_STORAGE_FORMAT='png'):
+            response = self.client.post(
+                '/api/classrooms/329/workplaces/329-5/screenshot/',
+                {'file': SimpleUploadedFile('upload.png', b'fake image content', content_type='image/png')},
+            )
+        filename = response.json()['filename']
+        self.assertTrue(os.path.exists(os.path.join(self.root, storage.relative_path('5', filename))))
+        self.assertFalse(os.path.exists(os.path.join(self.root, '5')))
+
+    def test_both_layouts_are_served_and_listed(self):
+        self.write(storage.legacy_dir('7'), '20250101_080000.png', b'legacy')
+        self.write(storage.frame_dir('7', '20250102_080000.png'), '20250102_080000.png', b'sharded')
+
+        for filename, content in (('20250101_080000.png', b'legacy'), ('20250102_080000.png', b'sharded')):
+            response = self.client.get(f'/api/classrooms/329/workplaces/7/screenshots/{filename}/')
+            self.assertEqual(b''.join(response.streaming_content), content)
+
+        # No screenshot rows: the history falls back to the filesystem
+        url = '/api/classrooms/329/workplaces/7/screenshots/'
+        response = self.client.get(url, {'limit': 1})
+        self.assertEqual([item['filename'] for item in response.json()], ['20250102_080000.png'])
+        response = self.client.get(url, {'limit': 1, 'before': response['X-Next-Cursor']})
+        self.assertEqual([item['filename'] for item in response.json()], ['20250101_080000.png'])
+
+    def test_page_names_stop_at_the_page(self):
+        for day in range(1, 6):
+            name = f'202503{day:02d}_120000.png'
+            self.write(storage.frame_dir('2', name), name)
+        self.write(storage.legacy_dir('2'), '20250220_120000.png')
+
+        with mock.patch('roster.storage._frame_names', wraps=storage._frame_names) as listed:
+            self.assertEqual(storage.page_names('2', 1), ['20250305_120000.png', '20250304_120000.png'])
+        # The flat directory and the two newest days
+        self.assertEqual(listed.call_count, 3)
+        self.assertEqual(
+            storage.page_names('2', 2, after='20250303_120000.png'), ['20250305_120000.png', '20250304_120000.png']
+        )
+        self.assertEqual(
+            storage.page_names('2', 5, before='20250302_120000.png'), ['20250301_120000.png', '20250220_120000.png']
+        )
+
+    def test_migration_moves_flat_frames_into_day_directories(self):
+        from django.core.management import call_command
+
+        for name in ('20250101_080000.webp', '20250101_081500.png', '20250203_100000.avif', 'notes.png'):
+            self.write(storage.legacy_dir('4'), name)
+        recent = self.write(storage.legacy_dir('4'), '20250301_090000.png')
+        os.utime(recent)
+
+        out = io.StringIO()
+        call_command('migrate_screenshot_layout', batch_size=2, pause=0, stdout=out)
+
+        self.assertEqual(sorted(os.listdir(storage.legacy_dir('4'))), ['20250301_090000.png', 'notes.png'])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.root, '329', '4', '2025', '01', '01'))),
+            ['20250101_080000.webp', '20250101_081500.png'],
+        )
+        self.assertIn('Moved 3 frames', out.getvalue())
+        # Moved and unmoved frames resolve alike
+        for name in ('20250203_100000.avif', '20250301_090000.png'):
+            self.assertEqual(
+                self.client.get(f'/api/classrooms/329/workplaces/4/screenshots/{name}/').status_code, 200
+            )
+
+        # Re-running only picks up what was left
+        call_command('migrate_screenshot_layout', stdout=out, min_age=0)
+        self.assertEqual(os.listdir(storage.legacy_dir('4')), ['notes.png'])
+
+
+class SegmentTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            SCREENSHOTS_ROOT=self.root,
+            SCREENSHOT_THUMBNAILS_ROOT=os.path.join(self.root, 'thumbnails'),
+        )
+        self.settings_override.enable()
+        self.day = datetime.date.today() - datetime.timedelta(days=30)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write_frames(self, workplace_dir, times, content=None):
+        names = []
+        for t in times:
+            name = f'{self.day:%Y%m%d}_{t}.webp'
+            day_dir = storage.frame_dir(workplace_dir, name)
+            os.makedirs(day_dir, exist_ok=True)
+            with open(os.path.join(day_dir, name), 'wb') as f:
+                f.write(content or name.encode())
+            names.append(name)
+        return names
+
+    def compact(self, **options):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('compact_screenshots', stdout=out, **options)
+        return out.getvalue()
+
+    def test_days_are_packed_and_served_from_the_segment(self):
+        buf = io.BytesIO()
+        Image.new('RGB', (640, 360), 'navy').save(buf, format='WEBP')
+        first, second, third = self.write_frames('6', ['080000', '081500', '083000'], content=buf.getvalue())
+        recent = datetime.date.today()
+        recent_name = f'{recent:%Y%m%d}_090000.webp'
+        os.makedirs(storage.frame_dir('6', recent_name))
+        open(os.path.join(storage.frame_dir('6', recent_name), recent_name), 'wb').close()
+
+        out = self.compact(measure=True)
+        self.assertIn('Packed 3 frames', out)
+        self.assertIn('Files: 1 fewer', out)
+        day_dir = storage.frame_dir('6', first)
+        self.assertFalse(os.path.exists(day_dir))
+        self.assertEqual(segments.names(day_dir), [first, second, third])
+        # Recent days stay loose
+        self.assertTrue(os.path.exists(os.path.join(storage.frame_dir('6', recent_name), recent_name)))
+
+        url = f'/api/classrooms/329/workplaces/6/screenshots/{first}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(b''.join(response.streaming_content), buf.getvalue())
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual((response.status_code, b''.join(response.streaming_content)), (206, b'RIFF'))
+        response = self.client.get(url, {'thumb': '1'})
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        # Listing without screenshot rows covers packed days
+        listed = self.client.get('/api/classrooms/329/workplaces/6/screenshots/').json()
+        self.assertEqual([item['filename'] for item in listed], [recent_name, third, second, first])
+
+    def test_late_frames_are_appended(self):
+        first, = self.write_frames('6', ['080000'])
+        self.compact()
+        second, = self.write_frames('6', ['070000'])
+        self.compact()
+
+        day_dir = storage.frame_dir('6', first)
+        self.assertEqual(segments.names(day_dir), [second, first])
+        self.assertEqual(bytes(storage.read_frame('6', first).data), first.encode())
+        self.assertEqual(bytes(storage.read_frame('6', second).data), second.encode())
+        self.assertEqual(os.path.getsize(segments.segment_path(day_dir)), len(first) + len(second))
+
+    def test_retention_drops_a_segment_once_all_its_frames_expired(self):
+        workplace = Workplace.objects.create(workplace_number=6)
+        now = timezone.now()
+        self.day = (now - datetime.timedelta(days=400)).date()
+        old = self.write_frames('6', ['080000', '090000'])
+        for name in old:
+            shot = WorkplaceScreenshot.objects.create(workplace=workplace, screenshot_filename=name)
+            WorkplaceScreenshot.objects.filter(pk=shot.pk).update(created_at=now - datetime.timedelta(days=400))
+        for i in range(100):
+            WorkplaceScreenshot.objects.create(workplace=workplace, screenshot_filename=f'{now:%Y%m%d}_{i:06d}.webp')
+        self.compact()
+        day_dir = storage.frame_dir('6', old[0])
+        self.assertTrue(segments.exists(day_dir))
+
+        rotate_screenshots('6', workplace)
+
+        self.assertFalse(segments.exists(day_dir))
+        self.assertFalse(os.path.exists(segments.segment_path(day_dir)))
+        self.assertEqual(WorkplaceScreenshot.objects.filter(image_deleted=True).count(), 2)
+
+
+    def test_deleted_frames_of_a_packed_day_are_not_served(self):
+        workplace = Workplace.objects.create(workplace_number=6)
+        kept, deleted = self.write_frames('6', ['080000', '090000'])
+        for name in (kept, deleted):
+            WorkplaceScreenshot.objects.create(workplace=workplace, screenshot_filename=name)
+        self.compact()
+        WorkplaceScreenshot.objects.filter(screenshot_filename=deleted).update(image_deleted=True)
+
+        url = '/api/classrooms/329/workplaces/6/screenshots/{}/'
+        self.assertEqual(self.client.get(url.format(kept)).status_code, 200)
+        self.assertEqual(self.client.get(url.format(deleted)).status_code, 404)
+
+
+class TranscodeTests(TestCase):
+    def test_lossy_encoding_fits_the_byte_budget(self):
+        # Noise is the worst case for a lossy codec
+        img = Image.frombytes('RGB', (400, 300), os.urandom(400 * 300 * 3))
+        full, full_quality = transcode.encode(img, 'webp')
+        self.assertEqual(full_quality, 90)
+
+        smallest, _ = transcode.encode(img, 'webp', target_bytes=1)
+        target = (len(smallest) + len(full)) // 2
+        data, quality = transcode.encode(img, 'webp', target_bytes=target)
+        self.assertLessEqual(len(data), target)
+        self.assertTrue(40 < quality < 90)
+        with Image.open(io.BytesIO(data)) as decoded:
+            self.assertEqual((decoded.format, decoded.size), ('WEBP', (400, 300)))
+
+    def test_lossless_webp_round_trips(self):
+        img = Image.frombytes('RGB', (32, 32), os.urandom(32 * 32 * 3))
+        data, quality = transcode.encode(img, 'webp', lossless=True)
+        self.assertIsNone(quality)
+        with Image.open(io.BytesIO(data)) as decoded:
+            self.assertEqual(decoded.convert('RGB').tobytes(), img.tobytes())
+
+    def test_frames_are_found_by_stem(self):
+        dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir_path, True)
+        open(os.path.join(dir_path, '20260101_100000.avif'), 'wb').close()
+        self.assertEqual(
+            transcode.find_frame(dir_path, '20260101_100000.png'), os.path.join(dir_path, '20260101_100000.avif'))
+        self.assertIsNone(transcode.find_frame(dir_path, '20260101_100001.png'))
+        self.assertEqual(transcode.content_type('x.avif'), 'image/avif')
+
+    def test_frames_whose_row_is_gone_are_left_alone(self):
+        dir_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dir_path, True)
+        workplace = Workplace.objects.create(workplace_number=6)
+
+        def frame(filename):
+            Image.new('RGB', (64, 64), 'navy').save(os.path.join(dir_path, filename))
+            return WorkplaceScreenshot.objects.create(workplace=workplace, screenshot_filename=filename)
+
+        gone = frame('20260101_100000.png')
+        gone_id = gone.pk
+        gone.delete()
+        self.assertIsNone(transcode.transcode_frame(dir_path, gone.screenshot_filename, gone_id))
+
+        # The row is retired while the frame is being encoded
+        retired = frame('20260101_100100.png')
+        write_frame = transcode.write_frame
+
+        def retire_meanwhile(*args, **kwargs):
+            write_frame(*args, **kwargs)
+            WorkplaceScreenshot.objects.filter(pk=retired.pk).update(image_deleted=True)
+
+        with mock.patch('roster.transcode.write_frame', side_effect=retire_meanwhile):
+            self.assertIsNone(transcode.transcode_frame(dir_path, retired.screenshot_filename, retired.pk))
+        self.assertEqual(sorted(os.listdir(dir_path)), ['20260101_100000.png', '20260101_100100.png'])
+
+        # The source is removed by retention after the row moved to the new file
+        moved = frame('20260101_100200.png')
+
+        def remove_meanwhile(path, *args, **kwargs):
+            write_frame(path, *args, **kwargs)
+            os.remove(os.path.join(dir_path, moved.screenshot_filename))
+
+        with mock.patch('roster.transcode.write_frame', side_effect=remove_meanwhile):
+            self.assertEqual(transcode.transcode_frame(dir_path, moved.screenshot_filename, moved.pk)[0], '20260101_100200.webp')
+        moved.refresh_from_db()
+        self.assertEqual(moved.screenshot_filename, '20260101_100200.webp')
+
+class ScreenshotHistoryTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.workplace = Workplace.objects.create(workplace_number=6)
+        start = timezone.now() - datetime.timedelta(hours=1)
+        for i in range(5):
+            shot = WorkplaceScreenshot.objects.create(
+                workplace=self.workplace, screenshot_filename=f'{i}.png', window_titles=['Editor'])
+            WorkplaceScreenshot.objects.filter(pk=shot.pk).update(created_at=start + datetime.timedelta(minutes=i))
+        self.url = '/api/classrooms/329/workplaces/6/screenshots/'
+
+    def test_pages_follow_cursors(self):
+        response = self.client.get(self.url, {'limit': 2})
+        self.assertEqual([s['filename'] for s in response.json()], ['4.png', '3.png'])
+        self.assertIn('rel="next"', response['Link'])
+
+        response = self.client.get(self.url, {'limit': 2, 'before': response['X-Next-Cursor']})
+        self.assertEqual([s['filename'] for s in response.json()], ['2.png', '1.png'])
+
+        newer = self.client.get(self.url, {'limit': 2, 'after': response['X-Prev-Cursor']})
+        self.assertEqual([s['filename'] for s in newer.json()], ['4.png', '3.png'])
+        self.assertNotIn('X-Prev-Cursor', newer)
+
+        response = self.client.get(self.url, {'limit': 2, 'before': response['X-Next-Cursor']})
+        self.assertEqual([s['filename'] for s in response.json()], ['0.png'])
+        self.assertNotIn('X-Next-Cursor', response)
+
+    def test_page_around_a_frame(self):
+        # Transcoded since the name was handed out
+        WorkplaceScreenshot.objects.filter(screenshot_filename='1.png').update(screenshot_filename='1.webp')
+        response = self.client.get(self.url, {'limit': 2, 'around': '1.png'})
+        self.assertEqual([s['filename'] for s in response.json()], ['1.webp', '0.png'])
+        self.assertEqual(response.json()[0]['window_titles'], ['Editor'])
+        self.assertNotIn('X-Next-Cursor', response)
+
+        newer = self.client.get(self.url, {'limit': 2, 'after': response['X-Prev-Cursor']})
+        self.assertEqual([s['filename'] for s in newer.json()], ['3.png', '2.png'])
+
+        self.assertNotIn('X-Prev-Cursor', self.client.get(self.url, {'limit': 2, 'around': '4.png'}))
+
+        # An unknown frame gives the first page
+        response = self.client.get(self.url, {'limit': 2, 'around': '9.png'})
+        self.assertEqual([s['filename'] for s in response.json()], ['4.png', '3.png'])
+
+    def test_fields_and_invalid_cursor(self):
+        data = self.client.get(self.url, {'fields': 'filename,created_at'}).json()
+        self.assertEqual(set(data[0]), {'filename', 'created_at'})
+
+        self.assertEqual(self.client.get(self.url, {'before': 'garbage'}).status_code, 400)
+
+
+class SearchScreenshotsTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.workplace = Workplace.objects.create(workplace_number=7)
+        self.user = User.objects.create_user(username='ipetrenko', first_name='Іван', last_name='Петренко')
+        self.url = '/api/classrooms/329/screenshots/search/'
+        # Ranked ids are kept per process; ids are reused once a test is rolled back
+        search.invalidate()
+
+    def add(self, filename, **kwargs):
+        return WorkplaceScreenshot.objects.create(workplace=self.workplace, screenshot_filename=filename, **kwargs)
+
+    def search(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_prefix_phrase_and_window_titles(self):
+        self.add('1.png', user=self.user, os_username='student1')
+        self.add('2.png', os_username='guest', window_titles=['Visual Studio Code', 'Пасьянс Косинка'])
+
+        self.assertEqual([s['filename'] for s in self.search(q='петр').json()], ['1.png'])
+        self.assertEqual([s['filename'] for s in self.search(q='іван петренко').json()], ['1.png'])
+        self.assertEqual([s['filename'] for s in self.search(q='пасьянс').json()], ['2.png'])
+        self.assertEqual([s['filename'] for s in self.search(q='"studio code"').json()], ['2.png'])
+        self.assertEqual(self.search(q='"code studio"').json(), [])
+
+    def test_index_follows_deletes_and_renames(self):
+        shot = self.add('1.png', user=self.user)
+        shot.delete()
+        self.assertEqual(self.search(q='петренко').json(), [])
+
+        self.add('2.png', user=self.user)
+        self.user.last_name = 'Коваленко'
+        self.user.save()
+        self.assertEqual(self.search(q='петренко').json(), [])
+        self.assertEqual([s['filename'] for s in self.search(q='коваленко').json()], ['2.png'])
+
+    def test_counts_and_cursors(self):
+        for i in range(5):
+            self.add(f'{i}.png', os_username='student')
+
+        response = self.search(q='student', limit=2)
+        self.assertEqual(response['X-Total-Count'], '5')
+        seen = [s['filename'] for s in response.json()]
+        # Screenshots indexed meanwhile neither shift nor repeat the pages that follow,
+        # also in a process that has to rank the query again
+        self.add('new.png', os_username='student student')
+        while 'X-Next-Cursor' in response:
+            response = self.search(q='student', limit=2, before=response['X-Next-Cursor'])
+            seen += [s['filename'] for s in response.json()]
+            search.invalidate()
+        self.assertEqual(seen, [f'{i}.png' for i in reversed(range(5))])
+
+    def test_better_matches_come_first(self):
+        self.add('exact.png', os_username='guest', window_titles=['Scratch', 'Scratch project', 'Scratch help'])
+        self.add('newer.png', os_username='student', window_titles=['Visual Studio Code', 'Scratch'])
+        self.add('other.png', os_username='student', window_titles=['Visual Studio Code'])
+
+        data = self.search(q='scratch').json()
+        self.assertEqual([s['filename'] for s in data], ['exact.png', 'newer.png'])
+
+    def test_rebuild_in_batches(self):
+        for i in range(5):
+            self.add(f'{i}.png', os_username='student')
+        search.rebuild(batch_size=2)
+        self.assertEqual(self.search(q='student').json()[0]['filename'], '4.png')
+        self.assertEqual(len(self.search(q='student').json()), 5)
+
+    def test_date_filter_without_query(self):
+        old = self.add('old.png')
+        WorkplaceScreenshot.objects.filter(pk=old.pk).update(created_at=timezone.now() - datetime.timedelta(days=3))
+        self.add('today.png')
+
+        data = self.search(date=timezone.localdate().isoformat()).json()
+        self.assertEqual([s['filename'] for s in data], ['today.png'])
+
+
+
+class ScreenshotRollupTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create(username='student', first_name='Іван', last_name='Петренко')
+        self.workplaces = [Workplace.objects.create(workplace_number=n) for n in (1, 2)]
+
+    def add_frame(self, workplace, created_at, user=None, file_size=100):
+        with mock.patch('django.utils.timezone.now', return_value=created_at):
+            return WorkplaceScreenshot.objects.create(
+                workplace=workplace, screenshot_filename=f"{created_at:%Y%m%d_%H%M%S}.png",
+                user=user, file_size=file_size)
+
+    def test_frames_are_rolled_up_per_day_and_workplace(self):
+        day = timezone.make_aware(datetime.datetime(2026, 2, 3, 9, 0))
+        self.add_frame(self.workplaces[0], day, self.user)
+        self.add_frame(self.workplaces[0], day + datetime.timedelta(minutes=5), self.user)
+        self.add_frame(self.workplaces[1], day + datetime.timedelta(minutes=1))
+        # 23:30 in Kyiv is already the next day in UTC, but belongs to this one
+        last = self.add_frame(self.workplaces[1], timezone.make_aware(datetime.datetime(2026, 2, 3, 23, 30)))
+        self.add_frame(self.workplaces[1], timezone.make_aware(datetime.datetime(2026, 2, 10, 12, 0)))
+
+        rollup = ScreenshotDayRollup.objects.get(date=datetime.date(2026, 2, 3), workplace=self.workplaces[0])
+        self.assertEqual((rollup.frames, rollup.frames_kept, rollup.bytes, rollup.user_ids), (2, 2, 200, [self.user.id]))
+
+        self.assertEqual(
+            self.client.get('/api/classrooms/329/screenshots/dates/').json(), ['2026-02-10', '2026-02-03'])
+        self.assertEqual(
+            self.client.get('/api/classrooms/329/screenshots/dates/', {'to': '2026-02-09'}).json(), ['2026-02-03'])
+
+        summary = self.client.get('/api/classrooms/329/screenshots/summary/', {'from': '2026-02-01'}).json()
+        self.assertEqual([d['date'] for d in summary], ['2026-02-03', '2026-02-10'])
+        self.assertEqual(
+            {k: summary[0][k] for k in ('frames', 'frames_kept', 'bytes', 'workplaces', 'users')},
+            {'frames': 4, 'frames_kept': 4, 'bytes': 400, 'workplaces': 2, 'users': 1})
+        self.assertEqual(datetime.datetime.fromisoformat(summary[0]['last_at']), last.created_at)
+
+        self.assertEqual(self.client.get('/api/classrooms/329/screenshots/summary/', {'from': 'x'}).status_code, 400)
+
+    def test_deleting_a_screenshot_updates_its_day(self):
+        shot = self.add_frame(self.workplaces[0], timezone.now())
+        self.add_frame(self.workplaces[0], timezone.now())
+        shot.delete()
+        rollup = ScreenshotDayRollup.objects.get(workplace=self.workplaces[0])
+        self.assertEqual((rollup.frames, rollup.bytes), (1, 100))
+
+    def test_retention_keeps_rollups_consistent_with_a_rebuild(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        dir_path = os.path.join(root, str(self.workplaces[0].workplace_number))
+        os.makedirs(dir_path)
+        start = timezone.now() - datetime.timedelta(days=2)
+        for i in range(130):
+            shot = self.add_frame(self.workplaces[0], start + datetime.timedelta(minutes=i), file_size=5)
+            with open(os.path.join(dir_path, shot.screenshot_filename), 'wb') as f:
+                f.write(b'frame')
+
+        with override_settings(SCREENSHOTS_ROOT=root):
+            rotate_screenshots(str(self.workplaces[0].workplace_number), self.workplaces[0])
+        self.assertTrue(WorkplaceScreenshot.objects.filter(image_deleted=True).exists())
+
+        incremental = list(ScreenshotDayRollup.objects.order_by('date').values('date', 'frames', 'frames_kept', 'bytes'))
+        rollups.rebuild()
+        rebuilt = list(ScreenshotDayRollup.objects.order_by('date').values('date', 'frames', 'frames_kept', 'bytes'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(sum(d['bytes'] for d in rebuilt), 5 * sum(d['frames_kept'] for d in rebuilt))
+
+    def test_rebuild_keeps_skipped_repeats_and_retention_tiers(self):
+        day = timezone.make_aware(datetime.datetime(2026, 2, 3, 9, 0))
+        self.add_frame(self.workplaces[0], day)
+        ScreenshotDayRollup.objects.update(frames=7, skipped_frames=3, skipped_bytes=300, retention_tier=1)
+        # A day whose frames are all gone but whose repeats were counted
+        ScreenshotDayRollup.objects.create(date=datetime.date(2026, 2, 4), workplace=self.workplaces[1], frames=2, skipped_frames=1)
+        ScreenshotDayRollup.objects.create(date=datetime.date(2026, 2, 5), workplace=self.workplaces[1], frames=2)
+
+        rollups.rebuild()
+        self.assertEqual(
+            list(ScreenshotDayRollup.objects.order_by('date').values_list(
+                'date', 'frames', 'bytes', 'skipped_frames', 'skipped_bytes', 'retention_tier')),
+            [(datetime.date(2026, 2, 3), 1, 100, 3, 300, 1), (datetime.date(2026, 2, 4), 0, 0, 1, 0, 0)],
+        )
+
+class RotateScreenshotsTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCREENSHOTS_ROOT=self.root)
+        self.settings_override.enable()
+        # Frames in the flat layout, as before date sharding
+        self.dir_path = os.path.join(self.root, '3')
+        os.makedirs(self.dir_path)
+        self.workplace = Workplace.objects.create(workplace_number=3)
+        self.now = timezone.now()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def add_frames(self, count, start, step):
+        for i in range(count):
+            created_at = start + step * i
+            filename = f"{created_at:%Y%m%d_%H%M%S}.png"
+            with open(os.path.join(self.dir_path, filename), 'wb') as f:
+                f.write(b'frame')
+            shot = WorkplaceScreenshot.objects.create(workplace=self.workplace, screenshot_filename=filename)
+            # created_at is auto_now_add
+            WorkplaceScreenshot.objects.filter(pk=shot.pk).update(created_at=created_at)
+
+    def test_old_frames_are_thinned_to_one_per_interval(self):
+        # 30 old frames one minute apart, then 100 recent ones
+        self.add_frames(30, self.now - datetime.timedelta(days=2), datetime.timedelta(minutes=1))
+        self.add_frames(100, self.now - datetime.timedelta(hours=2), datetime.timedelta(seconds=30))
+
+        rotate_screenshots('3', self.workplace)
+
+        live = WorkplaceScreenshot.objects.filter(workplace=self.workplace, image_deleted=False)
+        # 100 recent + frames at minute 0, 15 of the old batch
+        self.assertEqual(live.count(), 102)
+        self.assertEqual(len(os.listdir(self.dir_path)), 102)
+
+        self.workplace.refresh_from_db()
+        self.assertEqual(self.workplace.retention_watermark, self.now - datetime.timedelta(days=2) + datetime.timedelta(minutes=29))
+
+    def test_second_pass_only_touches_new_frames(self):
+        self.add_frames(30, self.now - datetime.timedelta(days=2), datetime.timedelta(minutes=1))
+        self.add_frames(100, self.now - datetime.timedelta(hours=2), datetime.timedelta(seconds=30))
+        rotate_screenshots('3', self.workplace)
+
+        # One more upload pushes the oldest recent frame out of the window
+        self.add_frames(1, self.now, datetime.timedelta(seconds=1))
+        with mock.patch('roster.retention._compress') as compress:
+            rotate_screenshots('3', self.workplace)
+        compress.assert_called_once()
+
+        self.workplace.refresh_from_db()
+        self.assertEqual(self.workplace.retention_watermark, self.now - datetime.timedelta(hours=2))
+
+    def test_frames_older_than_a_year_are_deleted(self):
+        self.add_frames(5, self.now - datetime.timedelta(days=400), datetime.timedelta(hours=1))
+        self.add_frames(100, self.now - datetime.timedelta(hours=2), datetime.timedelta(seconds=30))
+
+        # Pointer at a frame that rotation is about to delete
+        oldest = WorkplaceScreenshot.objects.order_by('created_at').first()
+        Workplace.objects.filter(pk=self.workplace.pk).update(latest_screenshot=oldest)
+        self.workplace.refresh_from_db()
+
+        rotate_screenshots('3', self.workplace)
+
+        self.assertEqual(WorkplaceScreenshot.objects.filter(image_deleted=True).count(), 5)
+        self.workplace.refresh_from_db()
+        self.assertEqual(self.workplace.latest_screenshot, WorkplaceScreenshot.objects.order_by('-created_at').first())
+
+
+class RetentionBudgetTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCREENSHOTS_ROOT=self.root)
+        self.settings_override.enable()
+        self.workplace = Workplace.objects.create(workplace_number=8)
+        self.classroom = Classroom.objects.create(classroom_id='329', retention_keep_recent=10)
+        self.now = timezone.now()
+        # Ten recent frames, never touched
+        self.add_frames(self.now - datetime.timedelta(hours=1), 10, datetime.timedelta(minutes=1))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def add_frames(self, start, count, step, file_size=1000):
+        for i in range(count):
+            created_at = start + step * i
+            filename = f"{timezone.localtime(created_at):%Y%m%d_%H%M%S}.webp"
+            day_dir = storage.frame_dir('8', filename)
+            os.makedirs(day_dir, exist_ok=True)
+            with open(os.path.join(day_dir, filename), 'wb') as f:
+                f.write(b'x' * file_size)
+            with mock.patch('django.utils.timezone.now', return_value=created_at):
+                WorkplaceScreenshot.objects.create(
+                    workplace=self.workplace, screenshot_filename=filename, file_size=file_size
+                )
+
+    def day_start(self, days_ago):
+        day = timezone.localdate(self.now) - datetime.timedelta(days=days_ago)
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time(8, 0)))
+
+    def plan_retention(self, **options):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('plan_retention', stdout=out, **options)
+        return out.getvalue()
+
+    def test_days_are_thinned_as_they_age_into_coarser_tiers(self):
+        # Four hours at one frame per 15 minutes, ten days ago: the 7-day tier keeps one per hour
+        self.add_frames(self.day_start(10), 16, datetime.timedelta(minutes=15))
+
+        out = self.plan_retention(dry_run=True)
+        self.assertIn('Would free 12000 bytes in 12 frames', out)
+        self.assertEqual(WorkplaceScreenshot.objects.filter(image_deleted=True).count(), 0)
+
+        self.plan_retention()
+        old = WorkplaceScreenshot.objects.filter(created_at__lt=self.now - datetime.timedelta(days=1))
+        self.assertEqual(old.filter(image_deleted=False).count(), 4)
+        self.assertEqual(len(os.listdir(storage.frame_dir('8', old.first().screenshot_filename))), 4)
+        rollup = ScreenshotDayRollup.objects.get(date=timezone.localdate(self.day_start(10)))
+        self.assertEqual((rollup.retention_tier, rollup.frames_kept, rollup.bytes), (1, 4, 4000))
+
+        # Nothing left to do until the day ages into the next tier
+        self.assertIn('Freed 0 bytes', self.plan_retention())
+
+    def test_budget_thins_the_oldest_days_first(self):
+        self.add_frames(self.day_start(3), 8, datetime.timedelta(minutes=15))
+        self.add_frames(self.day_start(2), 8, datetime.timedelta(minutes=15))
+        # 26 frames stored; freeing 6 of them is enough
+        Classroom.objects.filter(pk='329').update(retention_budget_bytes=20000)
+
+        plan = budget.plan()
+        self.assertEqual(plan.target_bytes, 6000)
+        self.assertEqual([(a.date, a.frames) for a in plan.actions], [(timezone.localdate(self.day_start(3)), 6)])
+        budget.apply(plan)
+        self.assertEqual(budget.usage(), 20000)
+        # Recent frames are kept whatever the budget
+        Classroom.objects.filter(pk='329').update(retention_budget_bytes=0)
+        budget.apply(budget.plan())
+        self.assertEqual(WorkplaceScreenshot.objects.filter(image_deleted=False).count(), 10)
+
+    def test_thinning_a_packed_day_frees_its_segment_bytes(self):
+        from django.core.management import call_command
+
+        self.add_frames(self.day_start(10), 8, datetime.timedelta(minutes=15))
+        call_command('compact_screenshots', stdout=io.StringIO())
+        day_dir = storage.day_dir('8', timezone.localdate(self.day_start(10)))
+        seg = segments.segment_path(day_dir)
+        self.assertEqual(os.path.getsize(seg), 8000)
+
+        out = self.plan_retention(dry_run=True)
+        self.assertIn('Would free 6000 bytes in 6 frames', out)
+        out = self.plan_retention()
+        self.assertEqual(os.path.getsize(seg), 2000)
+        self.assertIn(f'Freed {6000 + 6 * segments.INDEX_RECORD.size} bytes in 6 frames', out)
+
+        kept = WorkplaceScreenshot.objects.filter(created_at__lt=self.now - datetime.timedelta(days=1), image_deleted=False)
+        self.assertEqual(segments.names(day_dir), sorted(shot.screenshot_filename for shot in kept))
+        for shot in kept:
+            self.assertEqual(bytes(storage.read_frame('8', shot.screenshot_filename).data), b'x' * 1000)
+
+    def test_rotation_follows_the_classroom_policy(self):
+        self.add_frames(self.day_start(2), 6, datetime.timedelta(minutes=5))
+        Classroom.objects.filter(pk='329').update(retention_tiers=[[0, 10], [365, None]])
+
+        rotate_screenshots('8', self.workplace)
+
+        thinned = WorkplaceScreenshot.objects.filter(created_at__lt=self.now - datetime.timedelta(days=1))
+        self.assertEqual(thinned.filter(image_deleted=False).count(), 3)
+
+    def test_tiers_are_validated(self):
+        from django.core.exceptions import ValidationError
+
+        self.classroom.retention_tiers = [[0, 15], ['week', 60]]
+        with self.assertRaises(ValidationError):
+            self.classroom.clean()
+
+
+class ReprocessScreenshotsTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCREENSHOTS_ROOT=os.path.join(self.root, 'screenshots'))
+        self.settings_override.enable()
+        self.state_file = os.path.join(self.root, 'state.json')
+        self.workplace = Workplace.objects.create(workplace_number=9)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def add_png(self, created_at):
+        buf = io.BytesIO()
+        # Noise: photo-like content that lossy WebP stores in less space than PNG
+        Image.effect_noise((320, 180), 40).convert('RGB').save(buf, format='PNG')
+        filename = f"{timezone.localtime(created_at):%Y%m%d_%H%M%S}.png"
+        day_dir = storage.frame_dir('9', filename)
+        os.makedirs(day_dir, exist_ok=True)
+        with open(os.path.join(day_dir, filename), 'wb') as f:
+            f.write(buf.getvalue())
+        with mock.patch('django.utils.timezone.now', return_value=created_at):
+            return WorkplaceScreenshot.objects.create(
+                workplace=self.workplace, screenshot_filename=filename, file_size=len(buf.getvalue())
+            )
+
+    def reprocess(self, **options):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('reprocess_screenshots', state_file=self.state_file, format='webp', stdout=out, **options)
+        return out.getvalue()
+
+    def test_frames_are_reencoded_in_batches_and_runs_resume(self):
+        start = timezone.now() - datetime.timedelta(days=3)
+        shots = [self.add_png(start + datetime.timedelta(minutes=i)) for i in range(5)]
+        stored = sum(shot.file_size for shot in shots)
+
+        out = self.reprocess(workers=0, batch_size=2)
+        self.assertIn('re-encoded 5', out)
+
+        for shot in shots:
+            shot.refresh_from_db()
+            path = storage.locate('9', shot.screenshot_filename)
+            self.assertTrue(shot.screenshot_filename.endswith('.webp'))
+            self.assertEqual(os.path.getsize(path), shot.file_size)
+        self.assertEqual(ScreenshotDayRollup.objects.get().bytes, sum(shot.file_size for shot in shots))
+        self.assertLess(ScreenshotDayRollup.objects.get().bytes, stored)
+
+        # Progress is kept: the next run only looks at frames stored since
+        newer = self.add_png(start + datetime.timedelta(minutes=10))
+        out = self.reprocess(workers=0)
+        self.assertIn(f'Resuming after screenshot #{shots[-1].pk}', out)
+        self.assertIn('checked 1, re-encoded 1', out)
+        newer.refresh_from_db()
+        self.assertTrue(newer.screenshot_filename.endswith('.webp'))
+
+    def test_worker_processes(self):
+        shot = self.add_png(timezone.now() - datetime.timedelta(days=1))
+        self.reprocess(workers=2, nice=0)
+        shot.refresh_from_db()
+        self.assertTrue(shot.screenshot_filename.endswith('.webp'))
+
+    def test_throttle_sleeps_to_the_limit(self):
+        from roster.reprocess import Throttle
+
+        clock = mock.Mock(return_value=0.0)
+        sleeps = []
+        throttle = Throttle(max_frames=10, max_bytes=1000, clock=clock, sleep=sleeps.append)
+        throttle.account(5, 100)
+        throttle.account(0, 900)
+        self.assertEqual(sleeps, [0.5, 1.0])
+
+
+class ReconcileScreenshotsTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(SCREENSHOTS_ROOT=self.root)
+        self.settings_override.enable()
+        self.workplace = Workplace.objects.create(workplace_number=4)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, dir_path, filename, size=100, age=3600):
+        os.makedirs(dir_path, exist_ok=True)
+        path = os.path.join(dir_path, filename)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def reconcile(self, **options):
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command('reconcile_screenshots', workers=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_orphan_files_get_rows(self):
+        self.write(storage.legacy_dir('4'), '20240105_101500.png', 100)
+        self.write(storage.frame_dir('4', '20240106_093000.webp'), '20240106_093000.webp', 50)
+        self.write(storage.legacy_dir('teacher_pc'), '20240106_093000.png')
+
+        out = self.reconcile()
+        self.assertIn('teacher_pc: 1 files, not a workplace, skipped', out)
+        self.assertIn('Imported 2 rows', out)
+
+        shots = list(WorkplaceScreenshot.objects.filter(workplace=self.workplace).order_by('created_at'))
+        self.assertEqual([s.screenshot_filename for s in shots], ['20240105_101500.png', '20240106_093000.webp'])
+        self.assertEqual(
+            timezone.localtime(shots[0].created_at).replace(tzinfo=None), datetime.datetime(2024, 1, 5, 10, 15)
+        )
+        self.assertEqual(sorted(ScreenshotDayRollup.objects.values_list('date', 'frames_kept', 'bytes')), [
+            (datetime.date(2024, 1, 5), 1, 100), (datetime.date(2024, 1, 6), 1, 50),
+        ])
+        self.workplace.refresh_from_db()
+        self.assertEqual(self.workplace.latest_screenshot_id, shots[1].pk)
+
+        # A second run finds nothing to do
+        self.assertIn('Imported 0 rows', self.reconcile())
+
+    def test_missing_and_stray_files(self):
+        gone = WorkplaceScreenshot.objects.create(
+            workplace=self.workplace, screenshot_filename='20240105_101500.png', file_size=10
+        )
+        WorkplaceScreenshot.objects.filter(pk=gone.pk).update(created_at=timezone.now() - datetime.timedelta(hours=1))
+        deleted = WorkplaceScreenshot.objects.create(
+            workplace=self.workplace, screenshot_filename='20240105_101600.png', file_size=10, image_deleted=True
+        )
+        stray_path = self.write(storage.frame_dir('4', deleted.screenshot_filename), deleted.screenshot_filename)
+
+        out = self.reconcile(dry_run=True)
+        self.assertIn('1 rows without a file, 1 stray files', out)
+        gone.refresh_from_db()
+        self.assertFalse(gone.image_deleted)
+        self.assertTrue(os.path.exists(stray_path))
+
+        out = self.reconcile(remove_stray=True)
+        self.assertIn('removed 1 stray files', out)
+        gone.refresh_from_db()
+        self.assertTrue(gone.image_deleted)
+        self.assertFalse(os.path.exists(stray_path))
+        self.assertEqual(WorkplaceScreenshot.objects.count(), 2)
+
+    def test_frames_and_rows_of_uploads_in_flight_are_left_alone(self):
+        # File stored, row not written yet
+        self.write(storage.frame_dir('4', '20240105_101500.png'), '20240105_101500.png', age=10)
+        # Row written, file not visible to the scan
+        fresh = WorkplaceScreenshot.objects.create(
+            workplace=self.workplace, screenshot_filename='20240105_101600.png', file_size=10
+        )
+
+        out = self.reconcile()
+        self.assertIn('0 without a row, 0 rows without a file', out)
+        self.assertEqual(WorkplaceScreenshot.objects.count(), 1)
+        fresh.refresh_from_db()
+        self.assertFalse(fresh.image_deleted)
+
+        out = self.reconcile(grace=0)
+        self.assertIn('1 without a row, 1 rows without a file', out)
+
+    def test_filesystem_fallback_can_be_switched_off(self):
+        User.objects.create_user(username='teacher', password='secret', is_staff=True)
+        client = Client()
+        client.login(username='teacher', password='secret')
+        self.write(storage.legacy_dir('4'), '20240105_101500.png')
+        url = '/api/classrooms/329/workplaces/4/screenshots/'
+
+        self.assertEqual(len(client.get(url).json()), 1)
+        with override_settings(SCREENSHOT_FILESYSTEM_FALLBACK=False):
+            self.assertEqual(client.get(url).json(), [])
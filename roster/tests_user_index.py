@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.test import TestCase, Client
+
+from roster import user_index
+
+
+class UserIndexTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.petrenko = User.objects.create_user(username='ipetrenko1', first_name='Іван', last_name='Петренко')
+        self.koval = User.objects.create_user(username='mkoval2', first_name="Мар'яна", last_name='Коваль')
+
+    def search(self, query):
+        return [u['id'] for u in self.client.get('/search_users_ajax/', {'surname': query}).json()]
+
+    def test_substring_case_and_transliteration(self):
+        self.assertEqual(self.search('ТРЕН'), [self.petrenko.id])
+        self.assertEqual(self.search('іван петр'), [self.petrenko.id])
+        self.assertEqual(self.search('petrenko'), [self.petrenko.id])
+        self.assertEqual(self.search('марʼяна'), [self.koval.id])
+        self.assertEqual(self.search('zzz'), [])
+
+    def test_index_is_rebuilt_after_user_changes(self):
+        user_index.get_index()
+        user = User.objects.create_user(username='opetrenko3', first_name='Олена', last_name='Петренко')
+        self.assertEqual(self.search('петренко'), [self.petrenko.id, user.id])
+
+        user.delete()
+        self.assertEqual(self.search('петренко'), [self.petrenko.id])
+
+    def test_saves_update_only_the_changed_user(self):
+        index = user_index.get_index()
+        with mock.patch('roster.search.reindex_user') as reindex:
+            self.petrenko.last_login = timezone.now()
+            with self.assertNumQueries(1):
+                self.petrenko.save(update_fields=['last_login'])
+            self.koval.save()
+            reindex.assert_not_called()
+
+            self.petrenko.last_name = 'Петрук'
+            self.petrenko.save()
+            reindex.assert_called_once_with(self.petrenko)
+
+        self.assertEqual(self.search('петренко'), [])
+        self.assertEqual(self.search('петрук'), [self.petrenko.id])
+        self.assertEqual(user_index.get_index().similar_surnames('Петренко', 0.9), [])
+        self.assertEqual(user_index.get_index().search('коваль'), index.search('коваль'))
+        # Searches already holding the old index are not disturbed by the update
+        self.assertEqual([e.id for e in index.search('петренко')], [self.petrenko.id])
+        self.assertEqual(index.search('петрук'), [])
+
+    def test_similar_surnames(self):
+        index = user_index.get_index()
+        self.assertEqual([e.id for e, _ in index.similar_surnames('Петринко')], [self.petrenko.id])
+        # Different first letter is never suggested
+        self.assertEqual(index.similar_surnames('Бетренко'), [])
+
+    def test_bk_tree_matches_linear_scan(self):
+        words = ['коваль', 'ковальчук', 'коваленко', 'кравець', 'кузьменко', 'козак', 'ковач']
+        tree = user_index.BKTree()
+        for word in words:
+            tree.add(word)
+        for radius in range(4):
+            expected = {w for w in words if user_index.distance('коваль', w) <= radius}
+            self.assertEqual({w for w, _ in tree.search('коваль', radius)}, expected)
@@ -0,0 +1,204 @@
+"""
+Pre-generated screenshot thumbnails.
+
+Derivatives are rendered once, either on the background worker right after an
+upload or on first access, and stored under SCREENSHOT_THUMBNAILS_ROOT as
+<width>/<workplace>/<stem>.jpg. The directory is a size-bounded cache: when it
+grows past SCREENSHOT_THUMBNAIL_CACHE_BYTES the least recently served files
+are evicted.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMAT = 'JPEG'
+THUMBNAIL_EXTENSION = '.jpg'
+THUMBNAIL_CONTENT_TYPE = 'image/jpeg'
+
+
+class DerivativeCache:
+    """Bookkeeping for the thumbnail directory: hit rate and size-bounded eviction"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, computed lazily
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.evictions = 0
+
+    @property
+    def root(self):
+        return str(settings.SCREENSHOT_THUMBNAILS_ROOT)
+
+    def record_hit(self, path):
+        with self._lock:
+            self.hits += 1
+        try:
+            # Serving a derivative refreshes its position in the eviction order
+            os.utime(path)
+        except OSError:
+            pass
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def added(self, size):
+        with self._lock:
+            self.generated += 1
+            if self._size is not None:
+                self._size += size
+            over_budget = self._current_size() > settings.SCREENSHOT_THUMBNAIL_CACHE_BYTES
+        if over_budget:
+            self.evict()
+
+    def removed(self, size):
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self):
+        """Delete least recently used derivatives until the cache is at 90% of its budget"""
+        target = settings.SCREENSHOT_THUMBNAIL_CACHE_BYTES * 0.9
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+        with self._lock:
+            self._size = total
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 3) if requests else None,
+                'generated': self.generated,
+                'evictions': self.evictions,
+                'cache_bytes': self._size,
+                'cache_budget_bytes': settings.SCREENSHOT_THUMBNAIL_CACHE_BYTES,
+            }
+
+    def _current_size(self):
+        # Caller holds the lock
+        if self._size is None:
+            total = 0
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        continue
+            self._size = total
+        return self._size
+
+
+cache = DerivativeCache()
+
+
+def pick_width(requested):
+    """Snap a requested width to the nearest configured one that is not smaller"""
+    widths = sorted(settings.SCREENSHOT_THUMBNAIL_WIDTHS)
+    for width in widths:
+        if width >= requested:
+            return width
+    return widths[-1]
+
+
+def thumbnail_path(workplace_dir, filename, width):
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(cache.root, str(width), str(workplace_dir), stem + THUMBNAIL_EXTENSION)
+
+
+def get_thumbnail(source_path, workplace_dir, filename, width, source=None):
+    """
+    Return the path of a width-px derivative of source_path, rendering it if it is
+    missing or older than the source (rotation may recompress originals in place).
+    source: file object to decode instead of source_path (a frame packed in a segment).
+    """
+    path = thumbnail_path(workplace_dir, filename, width)
+    try:
+        if os.path.getmtime(path) >= os.path.getmtime(source_path):
+            cache.record_hit(path)
+            return path
+    except OSError:
+        pass
+
+    cache.record_miss()
+    render(source or source_path, path, width)
+    return path
+
+
+def render(source_path, dest_path, width):
+    from PIL import Image
+
+    with Image.open(source_path) as img:
+        w, h = img.size
+        height = max(1, int(h * width / float(w)))
+        # draft() lets JPEG sources decode at reduced scale; reducing_gap makes
+        # thumbnail() shrink with Image.reduce() before the final LANCZOS pass.
+        img.draft('RGB', (width, height))
+        img.thumbnail((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        tmp_path = f"{dest_path}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, format=THUMBNAIL_FORMAT, quality=80, optimize=True)
+
+    os.replace(tmp_path, dest_path)
+    cache.added(os.path.getsize(dest_path))
+
+
+def pregenerate(source_path, workplace_dir, filename):
+    """Render the derivatives listed in SCREENSHOT_THUMBNAIL_PREGENERATE; runs on the background worker"""
+    for width in settings.SCREENSHOT_THUMBNAIL_PREGENERATE:
+        path = thumbnail_path(workplace_dir, filename, width)
+        if not os.path.exists(path):
+            try:
+                render(source_path, path, width)
+            except Exception as e:
+                # Not an image we can decode; ?thumb=1 will fall back to the original
+                logger.warning(f"Cannot render thumbnail for {source_path}: {e}")
+                return
+
+
+def invalidate(workplace_dir, filename):
+    """Drop all derivatives of a screenshot, e.g. after rotation deleted it"""
+    for width in settings.SCREENSHOT_THUMBNAIL_WIDTHS:
+        path = thumbnail_path(workplace_dir, filename, width)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            continue
+        cache.removed(size)
+
+
+def stats():
+    return cache.stats()
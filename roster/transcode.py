@@ -0,0 +1,231 @@
+"""
+Storage format of screenshot frames.
+
+Agents upload PNG. After the row is stored, the background worker transcodes
+the frame into SCREENSHOT_STORAGE_FORMAT (WebP or AVIF), lossy or lossless.
+Lossy frames get the highest quality whose output fits SCREENSHOT_TARGET_BYTES:
+quality is bisected within SCREENSHOT_QUALITY_RANGE. The file keeps its
+timestamp stem and mtime; only the extension changes, and the row's
+screenshot_filename and file_size follow.
+
+Every reader accepts all FRAME_EXTENSIONS. A request for a name whose
+extension changed meanwhile is resolved by stem (find_frame), so legacy PNGs
+and links handed out before transcoding keep working.
+"""
+import io
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# format name -> (Pillow format, extension, content type)
+FORMATS = {
+    'png': ('PNG', '.png', 'image/png'),
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'avif': ('AVIF', '.avif', 'image/avif'),
+}
+FRAME_EXTENSIONS = tuple(extension for _, extension, _ in FORMATS.values())
+FRAME_NAME_RE = re.compile(r'^[\w-]+\.(png|webp|avif)$')
+# Bisection steps between the quality bounds; 5 steps resolve 50 quality levels to ~2
+QUALITY_STEPS = 5
+
+
+class TranscodeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, size_in, size_out):
+        with self._lock:
+            self.frames += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'format': settings.SCREENSHOT_STORAGE_FORMAT,
+                'frames': self.frames,
+                'failed': self.failed,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else None,
+            }
+
+
+transcode_stats = TranscodeStats()
+
+
+def format_of(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    for name, (_, ext, _) in FORMATS.items():
+        if ext == extension:
+            return name
+    return None
+
+
+def content_type(filename):
+    return FORMATS.get(format_of(filename) or 'png')[2]
+
+
+def is_frame(filename):
+    return filename.endswith(FRAME_EXTENSIONS)
+
+
+def find_frame(dir_path, filename):
+    """Path of the frame stored as filename, or under the same stem in another format; None if missing"""
+    path = os.path.join(dir_path, filename)
+    if os.path.exists(path):
+        return path
+    stem = os.path.splitext(filename)[0]
+    for extension in FRAME_EXTENSIONS:
+        path = os.path.join(dir_path, stem + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def needs_transcode(filename):
+    target = settings.SCREENSHOT_STORAGE_FORMAT
+    return bool(target) and target in FORMATS and format_of(filename) != target
+
+
+def _save(img, fmt, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format=FORMATS[fmt][0], **params)
+    return buffer.getvalue()
+
+
+def encode(img, fmt, target_bytes=None, lossless=False):
+    """
+    Encode img as fmt. Lossy output uses the highest quality in
+    SCREENSHOT_QUALITY_RANGE that fits target_bytes (the lowest if none does).
+    Returns (data, quality); quality is None for lossless output.
+    """
+    if fmt == 'png':
+        return _save(img, fmt, optimize=True), None
+    if lossless:
+        if fmt == 'webp':
+            return _save(img, fmt, lossless=True, quality=100, method=4), None
+        return _save(img, fmt, quality=100), None
+
+    low, high = settings.SCREENSHOT_QUALITY_RANGE
+    best = _save(img, fmt, quality=high)
+    if not target_bytes or len(best) <= target_bytes:
+        return best, high
+
+    best_quality = low
+    best = _save(img, fmt, quality=low)
+    if len(best) > target_bytes:
+        return best, low
+    for _ in range(QUALITY_STEPS):
+        if high - low <= 1:
+            break
+        quality = (low + high) // 2
+        data = _save(img, fmt, quality=quality)
+        if len(data) <= target_bytes:
+            low, best, best_quality = quality, data, quality
+        else:
+            high = quality
+    return best, best_quality
+
+
+def convert_for(img, fmt):
+    """Drop modes the target format cannot store (palette, 16-bit); keep alpha if present"""
+    if img.mode in ('RGB', 'RGBA'):
+        return img
+    return img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+
+def write_frame(path, data, like=None):
+    """Atomically write data to path; like: file whose timestamps the frame keeps"""
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    if like is not None:
+        st = os.stat(like)
+        os.utime(tmp_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp_path, path)
+
+
+def transcode_frame(dir_path, filename, screenshot_id=None):
+    """
+    Convert a stored frame into SCREENSHOT_STORAGE_FORMAT; runs on the background worker.
+    Returns (new filename, new size), or None if the frame was left as it is.
+    """
+    from PIL import Image
+    from roster import rollups
+    from roster.models import WorkplaceScreenshot
+
+    if not needs_transcode(filename):
+        return None
+    fmt = settings.SCREENSHOT_STORAGE_FORMAT
+    source = os.path.join(dir_path, filename)
+    new_filename = os.path.splitext(filename)[0] + FORMATS[fmt][1]
+    dest = os.path.join(dir_path, new_filename)
+
+    row = None
+    if screenshot_id is not None:
+        row = WorkplaceScreenshot.objects.filter(
+            pk=screenshot_id, screenshot_filename=filename, image_deleted=False
+        ).values('workplace_id', 'created_at', 'file_size').first()
+        if row is None:
+            # Deleted, retired by retention or already transcoded: nothing should point at a new file
+            return None
+
+    try:
+        size_in = os.path.getsize(source)
+        with Image.open(source) as img:
+            img.load()
+            data, _ = encode(
+                convert_for(img, fmt), fmt,
+                target_bytes=settings.SCREENSHOT_TARGET_BYTES,
+                lossless=settings.SCREENSHOT_STORAGE_LOSSLESS,
+            )
+        write_frame(dest, data, like=source)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        transcode_stats.record_failure()
+        logger.warning(f"Cannot transcode {source}: {e}")
+        return None
+
+    if row is not None:
+        updated = WorkplaceScreenshot.objects.filter(
+            pk=screenshot_id, screenshot_filename=filename, image_deleted=False
+        ).update(screenshot_filename=new_filename, file_size=len(data))
+        if not updated:
+            # The row changed while encoding; the source stays what it refers to
+            os.remove(dest)
+            return None
+        rollups.image_resized(row['workplace_id'], row['created_at'], len(data) - (row['file_size'] or 0))
+
+    try:
+        os.remove(source)
+    except FileNotFoundError:
+        pass  # Removed meanwhile by retention or reconcile
+    transcode_stats.record(size_in, len(data))
+    return new_filename, len(data)
+
+
+def schedule_transcode(dir_path, filename, screenshot_id=None):
+    """Queue transcoding of a freshly uploaded frame"""
+    from roster import tasks
+
+    if needs_transcode(filename):
+        tasks.submit(('transcode', os.path.join(str(dir_path), filename)), transcode_frame, dir_path, filename, screenshot_id)
+
+
+def stats():
+    return transcode_stats.stats()
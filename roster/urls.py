@@ -16,6 +16,7 @@ urlpatterns = [
     # Classroom API endpoints
     path("api/classrooms/329/", classroom_api.get_classroom_329, name='api_classroom_329'),
     path("api/classrooms/329/workplaces/<str:workplace_id>/assign/", classroom_api.assign_workplace_329, name='api_assign_workplace_329'),
+    path("api/classrooms/329/groups/<int:group_id>/auto_assign/", classroom_api.auto_assign_group_329, name='api_auto_assign_group_329'),
     path("api/classrooms/329/workplaces/<str:workplace_id>/", classroom_api.remove_workplace_329, name='api_remove_workplace_329'),
     path("api/classrooms/329/workplaces/<str:workplace_id>/screenshot/", classroom_api.upload_screenshot_329, name='api_upload_screenshot_329'),
     path("api/classrooms/329/workplaces/<str:workplace_id>/screenshots/", classroom_api.list_screenshots_329, name='api_list_screenshots_329'),
@@ -23,8 +24,12 @@ urlpatterns = [
     path("api/classrooms/329/screenshots/", classroom_api.manage_screenshots_329, name='api_screenshots_329'),
     path("api/classrooms/329/screenshots/status/", classroom_api.screenshots_status_329, name='api_screenshots_status_329'),
     path("api/classrooms/329/screenshots/interval/", classroom_api.screenshots_interval_329, name='api_screenshots_interval_329'),
+    path("api/classrooms/329/agent/config/", classroom_api.agent_config_329, name='api_agent_config_329'),
     path("api/classrooms/329/screenshots/dates/", classroom_api.screenshot_dates_329, name='api_screenshot_dates_329'),
+    path("api/classrooms/329/screenshots/summary/", classroom_api.screenshot_summary_329, name='api_screenshot_summary_329'),
     path("api/classrooms/329/screenshots/search/", classroom_api.search_screenshots_329, name='api_search_screenshots_329'),
+    path("api/classrooms/329/metrics/", classroom_api.metrics_329, name='api_metrics_329'),
+    path("api/classrooms/329/events/", classroom_api.classroom_events_329, name='api_classroom_events_329'),
     
     # Student Groups URLs
     path("groups/login/", views.groups_login, name='groups_login'),
@@ -0,0 +1,304 @@
+"""
+In-memory index of user names for the login page and student search.
+
+Every name is stored case-folded and in its translitua transliteration, so
+"петренко", "ПЕТРЕНКО" and "petrenko" find the same student. Substring queries
+go through an n-gram index (all 1-3 character grams of each name form), so
+only users sharing every gram of the query are compared. Surname suggestions
+for typos use one BK-tree per first letter over the distinct surnames.
+
+The index is built once per process on first use; roster.signals updates the
+entry of a User whose name changes and drops the entry of a deleted one, so
+saves that only touch last_login cost nothing. A published index is never
+modified: an update builds a copy that shares everything but the postings and
+tree it changes, and swaps it in, so searches read without the lock. Other
+processes pick up changes after USER_INDEX_TTL seconds.
+"""
+import copy
+import threading
+import time
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from translitua import translit
+
+GRAM_SIZE = 3
+APOSTROPHES = str.maketrans('', '', "'’ʼ`")
+
+UserEntry = namedtuple('UserEntry', ['id', 'username', 'first_name', 'last_name'])
+NAME_FIELDS = frozenset(UserEntry._fields) - {'id'}
+
+
+def fold(text):
+    """Case-fold a name for matching: NFC, casefold, no apostrophes (Мар'яна == Марʼяна)"""
+    return unicodedata.normalize('NFC', text or '').casefold().translate(APOSTROPHES)
+
+
+def _forms(text):
+    folded = fold(text)
+    latin = fold(translit(folded)) if folded else ''
+    return {folded, latin} - {''}
+
+
+def _grams(text):
+    """The grams a string is indexed and queried by"""
+    if len(text) <= GRAM_SIZE:
+        return {text}
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def _all_grams(text):
+    grams = set()
+    for size in range(1, GRAM_SIZE + 1):
+        grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+    return grams
+
+
+def distance(a, b):
+    """Levenshtein edit distance"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree of words under edit distance"""
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = distance(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                return
+            node = child
+
+    def search(self, word, radius):
+        """All (word, distance) within radius of word"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            d = distance(word, node_word)
+            if d <= radius:
+                found.append((node_word, d))
+            for child_d, child in children.items():
+                if d - radius <= child_d <= d + radius:
+                    stack.append(child)
+        return found
+
+    def copy(self):
+        tree = BKTree()
+
+        def copy_node(node):
+            return (node[0], {d: copy_node(child) for d, child in node[1].items()})
+
+        tree.root = copy_node(self.root) if self.root is not None else None
+        return tree
+
+
+class UserIndex:
+    def __init__(self, users):
+        self.entries = {}
+        self._last = {}
+        self._first = {}
+        self._full = {}
+        self._grams = defaultdict(set)
+        self._by_surname = defaultdict(set)
+        self._trees = defaultdict(BKTree)
+
+        for user in users:
+            self.add(UserEntry(user['id'], user['username'], user['first_name'], user['last_name']))
+
+    def add(self, entry):
+        self.entries[entry.id] = entry
+
+        last, first = _forms(entry.last_name), _forms(entry.first_name)
+        full = {f"{l} {f}" for l in last for f in first} | {f"{f} {l}" for l in last for f in first}
+        self._last[entry.id], self._first[entry.id], self._full[entry.id] = last, first, full
+        for text in last | first | full:
+            for gram in _all_grams(text):
+                self._grams[gram].add(entry.id)
+
+        surname = fold(entry.last_name)
+        if surname:
+            self._by_surname[surname].add(entry.id)
+            self._trees[surname[0]].add(surname)
+
+    def remove(self, user_id):
+        """Drop a user; their surname stays in its BK-tree, matching nobody"""
+        entry = self.entries.pop(user_id, None)
+        if entry is None:
+            return
+        texts = self._last.pop(user_id) | self._first.pop(user_id) | self._full.pop(user_id)
+        for text in texts:
+            for gram in _all_grams(text):
+                self._grams[gram].discard(user_id)
+        self._by_surname.get(fold(entry.last_name), set()).discard(user_id)
+
+    def updated(self, user_id, entry=None):
+        """
+        A copy with the user replaced by entry, or removed without one. self is
+        left as it is: the copy gets its own postings and BK-tree wherever the
+        old or new names touch them and shares the rest.
+        """
+        grams, surnames = set(), set()
+        if user_id in self.entries:
+            for text in self._last[user_id] | self._first[user_id] | self._full[user_id]:
+                grams |= _all_grams(text)
+            surnames.add(fold(self.entries[user_id].last_name))
+        if entry is not None:
+            new = UserIndex([entry._asdict()])
+            grams |= set(new._grams)
+            surnames |= set(new._by_surname)
+
+        index = copy.copy(self)
+        index.entries = dict(self.entries)
+        index._last, index._first, index._full = dict(self._last), dict(self._first), dict(self._full)
+        index._grams = defaultdict(set, self._grams)
+        for gram in grams:
+            index._grams[gram] = set(self._grams.get(gram, ()))
+        index._by_surname = defaultdict(set, self._by_surname)
+        index._trees = defaultdict(BKTree, self._trees)
+        for surname in surnames - {''}:
+            index._by_surname[surname] = set(self._by_surname.get(surname, ()))
+            if surname[0] in self._trees:
+                index._trees[surname[0]] = self._trees[surname[0]].copy()
+
+        index.remove(user_id)
+        if entry is not None:
+            index.add(entry)
+        return index
+
+    def _candidates(self, *queries):
+        """Ids of users that have every gram of every query somewhere in their names"""
+        postings = [self._grams.get(gram, set()) for query in queries for gram in _grams(query)]
+        if not postings:
+            return set(self.entries)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    def search(self, query):
+        """Users whose first name, last name or full name (either order) contains query"""
+        query = fold(query).strip()
+        if not query:
+            return []
+        matched = [
+            user_id for user_id in self._candidates(query)
+            if any(query in text for text in self._last[user_id] | self._first[user_id] | self._full[user_id])
+        ]
+        return [self.entries[user_id] for user_id in sorted(matched)]
+
+    def search_name(self, surname, name=''):
+        """Users whose last name contains surname and, if given, first name contains name"""
+        surname, name = fold(surname).strip(), fold(name).strip()
+        if not surname:
+            return []
+        matched = []
+        for user_id in self._candidates(*[q for q in (surname, name) if q]):
+            if not any(surname in text for text in self._last[user_id]):
+                continue
+            if name and not any(name in text for text in self._first[user_id]):
+                continue
+            matched.append(user_id)
+        return [self.entries[user_id] for user_id in sorted(matched)]
+
+    def similar_surnames(self, surname, min_similarity=0.6):
+        """
+        Users whose last name starts with the same letter as surname and is at
+        least min_similarity similar to it, best matches first.
+        """
+        surname = fold(surname).strip()
+        if not surname:
+            return []
+        tree = self._trees.get(surname[0])
+        if tree is None:
+            return []
+        # similarity >= s needs distance <= (1 - s) * max(len); since the
+        # distance is at least the length difference, the longest candidate
+        # has len(surname) / s characters.
+        radius = int((1 - min_similarity) * len(surname) / min_similarity + 1e-9)
+        scored = []
+        for word, d in tree.search(surname, radius):
+            # Same scale as fuzzy_match.algorithims.levenshtein: 1.0 for equal strings
+            score = (max(len(word), len(surname)) - d) / max(len(word), len(surname))
+            if score >= min_similarity:
+                scored.extend((self.entries[user_id], score) for user_id in self._by_surname.get(word, ()))
+        scored.sort(key=lambda item: (-item[1], item[0].id))
+        return scored
+
+
+_lock = threading.Lock()
+_index = None
+_built_at = 0.0
+
+
+def get_index():
+    global _index, _built_at
+    index = _index
+    if index is not None and time.monotonic() - _built_at < settings.USER_INDEX_TTL:
+        return index
+    with _lock:
+        if _index is None or time.monotonic() - _built_at >= settings.USER_INDEX_TTL:
+            users = User.objects.values('id', 'username', 'first_name', 'last_name')
+            _index = UserIndex(users)
+            _built_at = time.monotonic()
+        return _index
+
+
+def invalidate():
+    global _index
+    _index = None
+
+
+def update_user(user):
+    """
+    Bring the entry of a saved user up to date. Returns False when the index
+    already had the same names, True when they changed or are not known here.
+    """
+    global _index
+    entry = UserEntry(user.pk, user.username, user.first_name, user.last_name)
+    with _lock:
+        if _index is None:
+            return True
+        if _index.entries.get(entry.id) == entry:
+            return False
+        _index = _index.updated(entry.id, entry)
+        return True
+
+
+def remove_user(user_id):
+    global _index
+    with _lock:
+        if _index is not None:
+            _index = _index.updated(user_id)
+
+
+def users_for(entries):
+    """User objects for index entries, in the same order"""
+    users = User.objects.in_bulk([entry.id for entry in entries])
+    return [users[entry.id] for entry in entries if entry.id in users]
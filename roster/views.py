@@ -3,7 +3,6 @@ import logging
 import os
 import re
 import uuid
-from collections import defaultdict
 
 import requests
 from dotenv import load_dotenv
@@ -18,9 +17,8 @@ from translitua import translit
 
 from roster.forms import EnterForm, KeyForm
 
-from fuzzy_match import algorithims
-
-from roster.models import WorkplaceUserPlacement, StudentGroup
+from roster import db, suggestions, user_index
+from roster.models import WorkplaceUserPlacement, StudentGroup, lesson_index_at, parse_workplace_id
 from roster.group_forms import StudentGroupForm, AddStudentToGroupForm
 
 logger = logging.getLogger(__name__)
@@ -41,20 +39,10 @@ def try_fuzzy_match(form):
     surname = form.cleaned_data['surname'].lower()
     if not surname:
         return []
-    
-    first_letter = surname[0]
-    users = User.objects.all()
-
-    matched = []
-    for user in users:
-        last_name_lower = (user.last_name or '').lower()
-        if last_name_lower.startswith(first_letter):
-            d = algorithims.levenshtein(surname, last_name_lower)
-            if d >= 0.6:
-                matched.append((user, d))
 
-    # sort by distance
-    return [k for k, v in sorted(matched, key=lambda item: item[1], reverse=True)]
+    # same first letter, similarity >= 0.6, best match first
+    matched = user_index.get_index().similar_surnames(surname, min_similarity=0.6)
+    return user_index.users_for([entry for entry, score in matched])
 
 
 def try_exact_match(form):
@@ -185,8 +173,7 @@ def index(request):
                             'access_key': access_key,
                         })
 
-                    placement = WorkplaceUserPlacement.objects.create(user=the_user, workplace_id=workplace_id)
-                    placement.save()
+                    db.write(WorkplaceUserPlacement.objects.create, user=the_user, workplace_id=workplace_id)
 
                 url = moodle_auth(the_user.first_name, the_user.last_name, the_user.username, the_user.email, wantsurl)
                 response = redirect(url)
@@ -230,21 +217,7 @@ def search_users_ajax(request):
     data = []
 
     if query:
-        users = User.objects.all()
-        matched = []
-        for user in users:
-            first_name = (user.first_name or '').lower()
-            last_name = (user.last_name or '').lower()
-            full_name = f"{last_name} {first_name}"
-            full_name_rev = f"{first_name} {last_name}"
-            
-            if (query in first_name or 
-                query in last_name or 
-                query in full_name or 
-                query in full_name_rev):
-                matched.append(user)
-        
-        data = [user_json(user) for user in matched]
+        data = [user_json(user) for user in user_index.get_index().search(query)]
 
     return JsonResponse(data, safe=False)
 
@@ -302,8 +275,7 @@ def key_required(request, uid):
             if the_user.username == 'admin' and form.cleaned_data['key'] == os.environ['MOODLE_ADMIN_PASSWORD']:
                 # Create WorkplaceUserPlacement record for admin
                 if workplace_id:
-                    placement = WorkplaceUserPlacement.objects.create(user=the_user, workplace_id=workplace_id)
-                    placement.save()
+                    db.write(WorkplaceUserPlacement.objects.create, user=the_user, workplace_id=workplace_id)
                 
                 url = moodle_auth(the_user.first_name, the_user.last_name, the_user.username, the_user.email, wantsurl)
                 return redirect(url)
@@ -340,13 +312,7 @@ def classroom_workplace_login(request, workplace_id):
 
 
 def current_lesson(now):
-    last = 0
-    for lesson, times in settings.LESSONS_SCHEDULE.items():
-
-        if now.time() >= times['start']:
-            last = lesson
-
-    return last
+    return lesson_index_at(now.time())
 
 
 def get_suggested_users_for_workplace(workplace_id, limit=3):
@@ -359,54 +325,16 @@ def get_suggested_users_for_workplace(workplace_id, limit=3):
     
     now = datetime.datetime.now()
     lesson = current_lesson(now)
-    current_weekday = now.weekday()  # 0 = Monday, 6 = Sunday
     
-    if lesson == 0:
+    if lesson == 0 or lesson not in settings.LESSONS_SCHEDULE:
         return []
-    
-    # Get the time range for the current lesson
-    lesson_data = settings.LESSONS_SCHEDULE.get(lesson)
-    if not lesson_data:
+
+    classroom, workplace_number = parse_workplace_id(workplace_id)
+    if workplace_number is None:
         return []
-    
-    # Query placements for this workplace during similar time slots across all dates
-    # We'll look at a broader time window to get historical data
-    start_time = lesson_data['start']
-    end_time = lesson_data['end']
-    
-    # Get users who are already seated in any workplace during this lesson
-    # We shouldn't suggest users who are already present
-    active_user_ids = set(WorkplaceUserPlacement.objects.filter(
-        created_at__gte=datetime.datetime.combine(now.date(), start_time),
-        created_at__lte=datetime.datetime.combine(now.date(), end_time)
-    ).values_list('user_id', flat=True))
-
-    # Limit to last 3 months for better performance and relevance
-    three_months_ago = now - datetime.timedelta(days=90)
-    
-    # Get all placements for this workplace in the last 3 months
-    placements = WorkplaceUserPlacement.objects.filter(
-        workplace_id=workplace_id,
-        created_at__gte=three_months_ago
-    ).select_related('user').prefetch_related('user__profile')
-    
-    # Filter by time of day AND day of week (same lesson on same weekday)
-    # Only count users who have used THIS workplace on the same weekday and time slot
-    user_counts = defaultdict(int)
-    for placement in placements:
-        placement_time = placement.created_at.time()
-        placement_weekday = placement.created_at.weekday()
-        
-        # Only count if it matches both time slot and day of week
-        if start_time <= placement_time <= end_time and placement_weekday == current_weekday:
-            user_counts[placement.user] += 1
-    
-    # Sort by frequency and filter out currently active users, then get top N
-    # Only include users who have actually used this workplace on the same weekday and timeslot (count > 0)
-    sorted_users = sorted(user_counts.items(), key=lambda x: x[1], reverse=True)
-    top_users = [user for user, count in sorted_users if user.id not in active_user_ids and count > 0][:limit]
-    
-    return top_users
+
+    # Precomputed, decayed per-lesson usage counts (see roster.suggestions)
+    return suggestions.suggested_users(classroom, workplace_number, now.date(), lesson, limit)
 
 
 def sort_ukrainian(usernames):
@@ -524,22 +452,11 @@ def group_detail(request, group_id):
                 surname = add_form.cleaned_data['surname'].lower()
                 name = add_form.cleaned_data.get('name', '').lower()
                 
-                users = User.objects.all()
-                proposed_users = []
-                for user in users:
-                    u_last = (user.last_name or '').lower()
-                    u_first = (user.first_name or '').lower()
-                    
-                    if name:
-                        if surname in u_last and name in u_first:
-                            proposed_users.append(user)
-                    else:
-                        if surname in u_last:
-                            proposed_users.append(user)
+                matched = user_index.get_index().search_name(surname, name)
                 
                 # Sort and limit
-                proposed_users.sort(key=lambda u: (u.last_name, u.first_name))
-                proposed_users = proposed_users[:10]
+                matched.sort(key=lambda u: (u.last_name, u.first_name))
+                proposed_users = user_index.users_for(matched[:10])
 
     return render(request, 'group_detail.html', {
         'group': group,
@@ -693,8 +610,7 @@ def google_login_complete(request):
     
     # Create WorkplaceUserPlacement record
     if workplace_id:
-        placement = WorkplaceUserPlacement.objects.create(user=the_user, workplace_id=workplace_id)
-        placement.save()
+        db.write(WorkplaceUserPlacement.objects.create, user=the_user, workplace_id=workplace_id)
     
     # Redirect to Moodle
     url = moodle_auth(the_user.first_name, the_user.last_name, the_user.username, the_user.email, wantsurl)